@@ -0,0 +1,149 @@
+from Data.DataLoader import DataLoader
+import pandas as pd
+import polars as pl
+import numpy as np
+import subprocess
+import platform
+import json
+import time
+import sys
+import mne
+
+if platform.system() != 'Windows':
+    import resource
+
+
+class ConversionBenchmark(object):
+    """
+    Benchmark of the DataLoader conversions (to_pandas, to_polars, to_mne_raw) against the previous implementations.
+    Every case runs in its own interpreter so that the peak resident set size (POSIX only) can be attributed to it.
+    The copy count is the growth of the peak RSS during the conversion divided by the size of the signal block.
+    """
+    # class level constants
+    CASES = ['legacy_pandas', 'pandas', 'legacy_polars', 'polars', 'legacy_mne', 'mne']
+    SAMPLE_FREQUENCY = 200
+
+    # class level fields
+    duration_seconds = None
+    repeats = None
+
+    def __init__(self, duration_seconds=3600, repeats=2):
+        """
+        Constructor for the conversion benchmark
+        :param duration_seconds: length of the synthetic recording
+        :type duration_seconds: int
+        :param repeats: number of times each conversion is called, to show the effect of caching
+        :type repeats: int
+        """
+        self.duration_seconds = duration_seconds
+        self.repeats = repeats
+
+    @staticmethod
+    def peak_rss_bytes() -> int:
+        if platform.system() == 'Windows':
+            return 0
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+        return peak if platform.system() == 'Darwin' else peak * 1024
+
+    def create_data_loader(self) -> DataLoader:
+        """
+        Method to create a data loader holding a synthetic recording laid out like the loadmat output
+        :return: the data loader, with data_loaded set
+        :rtype: DataLoader
+        """
+        config = {'data': {'file': 'CLA-SubjectA-000000-3St-LRHand.mat', 'directory': ''}, 'data_framework': 'polars'}
+        data_loader = DataLoader(config=config)
+        n_samples = self.duration_seconds * self.SAMPLE_FREQUENCY
+        rng = np.random.default_rng(42)
+        # fill column by column so that building the recording does not raise the peak RSS above its size
+        data_loader.signal_readings = np.empty((n_samples, 22), order='F')
+        for i in range(22):
+            data_loader.signal_readings[:, i] = rng.standard_normal(n_samples) * 50.0
+        data_loader.marker_codes = rng.integers(0, 3, size=(n_samples, 1), dtype=np.uint8)
+        data_loader.file_conversions = {}
+        data_loader.data_loaded = True
+        return data_loader
+
+    @staticmethod
+    def legacy_to_pandas(data_loader) -> pd.DataFrame:
+        markers_df = pd.DataFrame(data_loader.marker_codes)
+        readings_df = pd.DataFrame(data_loader.signal_readings)
+        electrodes_df = pd.DataFrame(data_loader.ELECTRODE_NAMES_EXPECTED)
+        dataframe = pd.concat([markers_df, readings_df], axis=1)
+        dataframe.columns = ['marker'] + data_loader.ELECTRODE_NAMES_EXPECTED
+        return dataframe
+
+    @staticmethod
+    def legacy_to_polars(data_loader) -> pl.DataFrame:
+        markers_df = pl.DataFrame(data_loader.marker_codes)
+        markers_df.columns = ['marker']
+        readings_df = pl.DataFrame(data_loader.signal_readings)
+        electrodes_df = pl.DataFrame(data_loader.ELECTRODE_NAMES)
+        dataframe = pl.concat([markers_df, readings_df], how='horizontal')
+        dataframe.columns = ['marker'] + data_loader.ELECTRODE_NAMES_EXPECTED
+        return dataframe
+
+    @staticmethod
+    def legacy_to_mne_raw(data_loader) -> mne.io.RawArray:
+        # the previous implementation, with the marker column renamed so that it runs
+        data = ConversionBenchmark.legacy_to_pandas(data_loader).rename(columns={'marker': 'STI001'})
+        for electrode in data_loader.ELECTRODE_NAMES:
+            data[electrode] = data[electrode] / 1.0e6
+        info = data_loader.create_mne_info()
+        return mne.io.RawArray(data=data[data_loader.ELECTRODE_NAMES + ['STI001']].transpose(), info=info)
+
+    def run_case(self, case=None) -> dict:
+        """
+        Method to run a single case in the current interpreter
+        :param case: one of CASES
+        :type case: str
+        :return: timings of each call and the peak RSS growth
+        :rtype: dict
+        """
+        mne.set_log_level('ERROR')
+        data_loader = self.create_data_loader()
+        conversions = {'legacy_pandas': lambda: self.legacy_to_pandas(data_loader),
+                       'pandas': data_loader.to_pandas,
+                       'legacy_polars': lambda: self.legacy_to_polars(data_loader),
+                       'polars': data_loader.to_polars,
+                       'legacy_mne': lambda: self.legacy_to_mne_raw(data_loader),
+                       'mne': data_loader.to_mne_raw}
+        baseline = self.peak_rss_bytes()
+        timings = []
+        results = []
+        for _ in range(self.repeats):
+            start_time = time.perf_counter()
+            results.append(conversions[case]())
+            timings.append(time.perf_counter() - start_time)
+        peak_growth = self.peak_rss_bytes() - baseline
+        return {'case': case, 'timings': timings, 'peak_growth': peak_growth,
+                'copies': peak_growth / data_loader.signal_readings.nbytes}
+
+    def run(self) -> list:
+        """
+        Method to run every case in a separate interpreter and print a summary table
+        :return: the result of each case
+        :rtype: list
+        """
+        results = []
+        for case in self.CASES:
+            output = subprocess.run([sys.executable, '-m', 'Benchmarks.ConversionBenchmark', case,
+                                     str(self.duration_seconds), str(self.repeats)],
+                                    capture_output=True, text=True, check=True)
+            results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+        print('%-15s %12s %12s %16s %8s' % ('case', 'first (s)', 'repeat (s)', 'peak RSS (MiB)', 'copies'))
+        for result in results:
+            print('%-15s %12.3f %12.3f %16.1f %8.2f' % (result['case'], result['timings'][0], result['timings'][-1],
+                                                      result['peak_growth'] / 2 ** 20, result['copies']))
+        return results
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        # worker mode, used by ConversionBenchmark.run
+        benchmark = ConversionBenchmark(duration_seconds=int(sys.argv[2]), repeats=int(sys.argv[3]))
+        print(json.dumps(benchmark.run_case(case=sys.argv[1])))
+    else:
+        benchmark = ConversionBenchmark()
+        benchmark.run()
@@ -0,0 +1,104 @@
+from Benchmarks import time_call
+from Models.Classification.ELM.ELM import ELM
+from Preprocessing.CSP.CovarianceCSP import CovarianceCSP
+from sklearn.discriminant_analysis import LinearDiscriminantAnalysis
+import numpy as np
+import copy
+import time
+
+
+class ELMBenchmark(object):
+    """
+    Benchmark of the ELM against the LDA of the CSP + LDA pipeline, on the CSP log-power features of synthetic
+    two-class motor imagery epochs. It reports the fit and predict latency of both classifiers, the latency of
+    adding one trial to the ELM with partial_fit (OS-ELM) against refitting the LDA with that trial, and the
+    accuracy on held-out epochs.
+    """
+    # class level constants
+    SAMPLE_FREQUENCY = 200
+    N_CHANNELS = 21
+
+    # class level fields
+    n_epochs = None
+    epoch_samples = None
+    n_components = None
+    n_hidden = None
+    repeats = None
+
+    def __init__(self, n_epochs=600, epoch_samples=400, n_components=4, n_hidden=200, repeats=20):
+        """
+        Constructor for the ELM benchmark
+        :param n_epochs: number of synthetic epochs, a fifth of them are held out
+        :type n_epochs: int
+        :param epoch_samples: length of each epoch, 400 samples is the default 2 s CSP training range at 200 Hz
+        :type epoch_samples: int
+        :param n_components: number of CSP components
+        :type n_components: int
+        :param n_hidden: number of hidden neurons of the ELM
+        :type n_hidden: int
+        :param repeats: number of runs per case, the fastest run is kept
+        :type repeats: int
+        """
+        self.n_epochs = n_epochs
+        self.epoch_samples = epoch_samples
+        self.n_components = n_components
+        self.n_hidden = n_hidden
+        self.repeats = repeats
+
+    def create_features(self) -> tuple:
+        """
+        Method to create the CSP log-power features of synthetic epochs, where two sources have a class-dependent
+        power and are mixed into every channel
+        :return: training features and labels, test features and labels
+        :rtype: tuple
+        """
+        rng = np.random.default_rng(42)
+        labels = rng.integers(0, 2, self.n_epochs)
+        sources = rng.standard_normal((self.n_epochs, self.N_CHANNELS, self.epoch_samples))
+        sources[:, 0] *= (1. + 0.1 * labels)[:, np.newaxis]
+        sources[:, 1] *= (1.1 - 0.1 * labels)[:, np.newaxis]
+        epochs = rng.standard_normal((self.N_CHANNELS, self.N_CHANNELS)) @ sources * 1e-5
+        moments = CovarianceCSP.compute_moments(epochs_data=epochs)
+        n_train = int(0.8 * self.n_epochs)
+        csp = CovarianceCSP(n_components=self.n_components).fit(moments[:n_train], labels[:n_train])
+        features = csp.transform(moments)
+        return features[:n_train], labels[:n_train], features[n_train:], labels[n_train:]
+
+    def run(self):
+        """
+        Method to run every case and print the results
+        """
+        x_train, y_train, x_test, y_test = self.create_features()
+        classifiers = {'LDA': LinearDiscriminantAnalysis(),
+                       'ELM': ELM(n_hidden=self.n_hidden, random_state=0)}
+        for name, classifier in classifiers.items():
+            fit_time, _ = time_call(lambda: classifier.fit(x_train, y_train), repeats=self.repeats)
+            predict_time, _ = time_call(lambda: classifier.predict(x_test), repeats=self.repeats)
+            single_time, _ = time_call(lambda: classifier.predict(x_test[:1]), repeats=self.repeats)
+            print('%-4s fit %d trials %8.3f ms   predict %d trials %8.3f ms   predict 1 trial %8.3f ms   '
+                  'accuracy %.3f' % (name, len(y_train), 1e3 * fit_time, len(y_test), 1e3 * predict_time,
+                                     1e3 * single_time, classifier.score(x_test, y_test)))
+
+        # a new labelled trial arrives: refit the LDA on every trial, or update the ELM output weights
+        lda_time, _ = time_call(lambda: LinearDiscriminantAnalysis().fit(x_train, y_train), repeats=self.repeats)
+        # every run updates a fresh copy of the ELM fitted without the trial, so the same trial is not added twice
+        elm = ELM(n_hidden=self.n_hidden, random_state=0).fit(x_train[:-1], y_train[:-1])
+        update_time, _ = time_call(lambda model: model.partial_fit(x_train[-1:], y_train[-1:]), repeats=self.repeats,
+                                   setup=lambda: copy.deepcopy(elm))
+        print('new trial: LDA refit %8.3f ms   OS-ELM update %8.3f ms' % (1e3 * lda_time, 1e3 * update_time))
+
+        # OS-ELM over a session: trials arrive one at a time after a short calibration
+        n_calibration = 40
+        online = ELM(n_hidden=self.n_hidden, random_state=0).fit(x_train[:n_calibration], y_train[:n_calibration])
+        start_time = time.perf_counter()
+        for trial in range(n_calibration, len(y_train)):
+            online.partial_fit(x_train[trial:trial + 1], y_train[trial:trial + 1])
+        elapsed = time.perf_counter() - start_time
+        print('OS-ELM session: %d single-trial updates in %.3f ms (%.3f ms each), accuracy %.3f' %
+              (len(y_train) - n_calibration, 1e3 * elapsed, 1e3 * elapsed / (len(y_train) - n_calibration),
+               online.score(x_test, y_test)))
+
+
+if __name__ == '__main__':
+    benchmark = ELMBenchmark()
+    benchmark.run()
@@ -0,0 +1,83 @@
+import subprocess
+import sys
+
+
+class ImportTimeBenchmark(object):
+    """
+    Startup-time benchmark based on python -X importtime. Each module is imported in a fresh interpreter a few
+    times, the fastest cumulative import time is compared with the budget of the module, and the slowest imports
+    it pulls in are listed. run() returns False when any module is over its budget, so the benchmark can be used
+    as a regression check (the process exits with status 1).
+    """
+    # class level constants, budgets in ms of cumulative import time
+    MODULE_BUDGETS = {'Data.DataLoader': 400,
+                      'Data.BatchIngest': 400,
+                      'Utilities.Database.Postgres.PostgresConnector': 150,
+                      'Preprocessing.FFT.FFT': 400,
+                      'Preprocessing.Filters.Filter': 400,
+                      'Preprocessing.DWT.DWT': 400}
+    TOP_IMPORTS = 5
+
+    # class level fields
+    module_budgets = None
+    repeats = None
+
+    def __init__(self, module_budgets=None, repeats=3):
+        """
+        Constructor for the import time benchmark
+        :param module_budgets: module name to budget in ms, defaults to MODULE_BUDGETS
+        :type module_budgets: dict
+        :param repeats: number of fresh interpreters per module, the fastest run is kept
+        :type repeats: int
+        """
+        if module_budgets is None:
+            module_budgets = self.MODULE_BUDGETS
+        self.module_budgets = module_budgets
+        self.repeats = repeats
+
+    @staticmethod
+    def measure(module=None) -> tuple:
+        """
+        Method to import a module in a fresh interpreter with -X importtime
+        :param module: the module to import
+        :type module: str
+        :return: the cumulative import time of the module in ms, and (cumulative ms, name) of every import
+        :rtype: tuple
+        """
+        output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                                capture_output=True, text=True, check=True)
+        imports = []
+        for line in output.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            fields = line[len('import time:'):].split('|')
+            imports.append((int(fields[1]) / 1000.0, fields[2].strip()))
+        total = max(cumulative for cumulative, name in imports if name == module)
+        return total, imports
+
+    def run(self) -> bool:
+        """
+        Method to measure every module and print the results against the budgets
+        :return: True when every module is within its budget
+        :rtype: bool
+        """
+        within_budget = True
+        for module, budget in self.module_budgets.items():
+            runs = [self.measure(module=module) for _ in range(self.repeats)]
+            total, imports = min(runs, key=lambda run: run[0])
+            status = 'ok' if total <= budget else 'OVER BUDGET'
+            within_budget = within_budget and total <= budget
+            print('%-48s %8.1f ms (budget %d ms) %s' % (module, total, budget, status))
+            # largest third-party imports, i.e. top-level packages that are not part of this repo (site and its
+            # imports are interpreter startup and are not counted in the module time)
+            packages = [(cumulative, name) for cumulative, name in imports
+                        if '.' not in name and name not in (module.split('.')[0], 'site')]
+            for cumulative, name in sorted(packages, reverse=True)[:self.TOP_IMPORTS]:
+                print('    %-44s %8.1f ms' % (name, cumulative))
+        return within_budget
+
+
+if __name__ == '__main__':
+    benchmark = ImportTimeBenchmark()
+    if not benchmark.run():
+        sys.exit(1)
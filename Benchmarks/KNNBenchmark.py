@@ -0,0 +1,112 @@
+from Benchmarks import time_call
+from Models.Classification.KNN.KNN import KNN
+from sklearn.neighbors import KNeighborsClassifier
+import numpy as np
+
+
+class KNNBenchmark(object):
+    """
+    Benchmark of the indexed KNN against brute-force neighbour search, on a synthetic cross-subject reference pool
+    (every subject and session pooled) and a batch of query trials. Features are 4 CSP log-power components and the
+    mu and beta band power of the 21 channels. The features mix latent sources whose spread decays with their rank;
+    the band power is full rank (as many sources as features), and also low rank (a few sources), the case where
+    the approximate mode can pay off. Each case reports the index build time, the query time, the recall of the
+    neighbours found against the exact neighbours (and the recall the approximate mode estimated when it was
+    built), and the agreement of the predictions with brute force.
+    """
+    # class level constants
+    N_CHANNELS = 21
+    # name: number of features, number of latent sources (None for as many as features)
+    FEATURE_SETS = {'CSP log-power': (4, None), 'mu/beta band power': (2 * N_CHANNELS, None),
+                    'mu/beta band power, 6 sources': (2 * N_CHANNELS, 6)}
+    SOURCE_DECAY = 0.5
+
+    # class level fields
+    n_subjects = None
+    trials_per_subject = None
+    n_queries = None
+    n_neighbors = None
+
+    def __init__(self, n_subjects=40, trials_per_subject=2000, n_queries=2000, n_neighbors=5):
+        """
+        Constructor for the KNN benchmark
+        :param n_subjects: number of subjects (or sessions) in the reference pool
+        :type n_subjects: int
+        :param trials_per_subject: number of reference trials per subject
+        :type trials_per_subject: int
+        :param n_queries: number of query trials
+        :type n_queries: int
+        :param n_neighbors: number of neighbours
+        :type n_neighbors: int
+        """
+        self.n_subjects = n_subjects
+        self.trials_per_subject = trials_per_subject
+        self.n_queries = n_queries
+        self.n_neighbors = n_neighbors
+
+    def create_features(self, n_features=None, n_sources=None) -> tuple:
+        """
+        Method to create a reference pool and query trials: the features mix latent sources, the i-th scaled by
+        1 / (1 + i)^SOURCE_DECAY, plus a little noise, every subject has its own offset of the sources, and the
+        class shifts the first two sources
+        :param n_features: number of features
+        :type n_features: int
+        :param n_sources: number of latent sources, as many as features by default
+        :type n_sources: int
+        :return: reference features and labels, query features and labels
+        :rtype: tuple
+        """
+        rng = np.random.default_rng(42)
+        n_sources = n_features if n_sources is None else min(n_sources, n_features)
+        scales = (1. + np.arange(n_sources)) ** -self.SOURCE_DECAY
+        mixing = scales[:, np.newaxis] * rng.standard_normal((n_sources, n_features))
+        offsets = 2. * rng.standard_normal((self.n_subjects, n_sources))
+
+        def create(n_trials, subjects):
+            labels = rng.integers(0, 2, n_trials)
+            sources = rng.standard_normal((n_trials, n_sources)) + offsets[subjects]
+            sources[:, :2] += labels[:, np.newaxis]
+            return sources @ mixing + 0.1 * rng.standard_normal((n_trials, n_features)), labels
+
+        x_reference, y_reference = create(self.n_subjects * self.trials_per_subject,
+                                          np.repeat(np.arange(self.n_subjects), self.trials_per_subject))
+        x_query, y_query = create(self.n_queries, rng.integers(0, self.n_subjects, self.n_queries))
+        return x_reference, y_reference, x_query, y_query
+
+    def run(self):
+        """
+        Method to run every case and print the results
+        """
+        for name, (n_features, n_sources) in self.FEATURE_SETS.items():
+            x_reference, y_reference, x_query, _ = self.create_features(n_features=n_features, n_sources=n_sources)
+            print('%s: %d reference trials, %d queries, %d features' %
+                  (name, len(y_reference), len(x_query), n_features))
+
+            brute = KNeighborsClassifier(n_neighbors=self.n_neighbors, algorithm='brute')
+            build_time, _ = time_call(lambda: brute.fit(x_reference, y_reference))
+            brute_time, exact = time_call(lambda: brute.kneighbors(x_query, return_distance=False))
+            predictions = brute.predict(x_query)
+            print('    %-22s build %8.1f ms   query %8.1f ms' % ('brute force', 1e3 * build_time, 1e3 * brute_time))
+
+            cases = {'kd_tree': KNN(n_neighbors=self.n_neighbors, algorithm='kd_tree'),
+                     'ball_tree': KNN(n_neighbors=self.n_neighbors, algorithm='ball_tree'),
+                     'brute': KNN(n_neighbors=self.n_neighbors, algorithm='brute'),
+                     'approximate': KNN(n_neighbors=self.n_neighbors, approximate=True, random_state=0)}
+            for case, knn in cases.items():
+                knn.fit(x_reference, y_reference)
+                neighbours = knn.kneighbors(x_query, return_distance=False)
+                query_time = knn.query_time_
+                recall = np.mean([len(np.intersect1d(found, true)) for found, true in zip(neighbours, exact)])
+                agreement = np.mean(knn.predict(x_query) == predictions)
+                details = ''
+                if knn.projection_ is not None:
+                    details = '   (%d directions, %d candidates, estimated recall %.3f)' % \
+                              (knn.projection_.shape[1], knn.n_candidates_, knn.recall_)
+                print('    %-22s build %8.1f ms   query %8.1f ms   speed-up %6.1fx   recall %.3f   agreement %.3f%s' %
+                      (case, 1e3 * knn.build_time_, 1e3 * query_time, brute_time / query_time,
+                       recall / self.n_neighbors, agreement, details))
+
+
+if __name__ == '__main__':
+    benchmark = KNNBenchmark()
+    benchmark.run()
@@ -0,0 +1,96 @@
+from Benchmarks import time_call
+from Preprocessing.FFT.PSD import PSD
+import numpy as np
+import mne
+
+
+class PSDBenchmark(object):
+    """
+    Benchmark of the batched Welch estimator against mne.time_frequency.psd_array_welch, on synthetic epochs and on
+    several continuous recordings of different lengths. Each case reports the fastest of a few runs, the speed-up
+    and the largest relative difference between the two results.
+    """
+    # class level constants
+    SAMPLE_FREQUENCY = 200
+    N_CHANNELS = 21
+
+    # class level fields
+    n_epochs = None
+    epoch_samples = None
+    recording_seconds = None
+    repeats = None
+
+    def __init__(self, n_epochs=900, epoch_samples=521, recording_seconds=(3000, 2400, 3600), repeats=3):
+        """
+        Constructor for the PSD benchmark
+        :param n_epochs: number of synthetic epochs
+        :type n_epochs: int
+        :param epoch_samples: length of each epoch, 521 samples is the default 2.6 s epoch at 200 Hz
+        :type epoch_samples: int
+        :param recording_seconds: lengths of the synthetic continuous recordings
+        :type recording_seconds: tuple
+        :param repeats: number of runs per case, the fastest run is kept
+        :type repeats: int
+        """
+        self.n_epochs = n_epochs
+        self.epoch_samples = epoch_samples
+        self.recording_seconds = recording_seconds
+        self.repeats = repeats
+
+    def report(self, case=None, mne_time=None, psd_time=None, mne_result=None, psd_result=None):
+        """
+        Method to print the timings and the largest relative difference of one case
+        :param case: name of the case
+        :type case: str
+        :param mne_time: elapsed time of the MNE path in s
+        :type mne_time: float
+        :param psd_time: elapsed time of the batched estimator in s
+        :type psd_time: float
+        :param mne_result: list of the MNE results
+        :type mne_result: list
+        :param psd_result: list of the batched results
+        :type psd_result: list
+        """
+        error = max(np.abs(a - b).max() / np.abs(b).max() for a, b in zip(psd_result, mne_result))
+        print('%-28s mne %8.3f s   batched %8.3f s   speed-up %5.1fx   max rel. difference %.1e' %
+              (case, mne_time, psd_time, mne_time / psd_time, error))
+
+    def run(self):
+        """
+        Method to run every case and print the results
+        """
+        rng = np.random.default_rng(42)
+        psd_estimator = PSD(sfreq=self.SAMPLE_FREQUENCY)
+
+        epochs = rng.standard_normal((self.n_epochs, self.N_CHANNELS, self.epoch_samples))
+        mne_time, (mne_psd, _) = time_call(
+            lambda: mne.time_frequency.psd_array_welch(epochs, self.SAMPLE_FREQUENCY, verbose=False),
+            repeats=self.repeats)
+        psd_time, psd = time_call(lambda: psd_estimator.welch(data=epochs), repeats=self.repeats)
+        self.report(case='epochs PSD', mne_time=mne_time, psd_time=psd_time, mne_result=[mne_psd],
+                    psd_result=[psd])
+
+        # band powers: MNE PSD followed by a sum over each band, against the batched band power
+        def mne_band_power():
+            psd_mne, freqs = mne.time_frequency.psd_array_welch(epochs, self.SAMPLE_FREQUENCY, verbose=False)
+            resolution = freqs[1] - freqs[0]
+            return np.stack([psd_mne[..., (freqs >= low) & (freqs <= high)].sum(axis=-1) * resolution
+                             for low, high in PSD.BANDS.values()], axis=-1)
+        mne_time, mne_bands = time_call(mne_band_power, repeats=self.repeats)
+        psd_time, bands = time_call(lambda: psd_estimator.epoch_band_power(data=epochs), repeats=self.repeats)
+        self.report(case='epochs mu/beta band power', mne_time=mne_time, psd_time=psd_time, mne_result=[mne_bands],
+                    psd_result=[bands])
+
+        recordings = [rng.standard_normal((self.N_CHANNELS, seconds * self.SAMPLE_FREQUENCY))
+                      for seconds in self.recording_seconds]
+        mne_time, mne_psds = time_call(
+            lambda: [mne.time_frequency.psd_array_welch(data, self.SAMPLE_FREQUENCY, verbose=False)[0]
+                     for data in recordings], repeats=self.repeats)
+        psd_time, psds = time_call(lambda: psd_estimator.welch_batch(data_list=recordings), repeats=self.repeats)
+        self.report(case='%d recordings PSD' % len(recordings), mne_time=mne_time, psd_time=psd_time,
+                    mne_result=mne_psds, psd_result=psds)
+
+
+if __name__ == '__main__':
+    benchmark = PSDBenchmark()
+    benchmark.run()
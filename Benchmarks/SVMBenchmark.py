@@ -0,0 +1,107 @@
+from Benchmarks import time_call
+from Models.Classification.SVM.SVM import SVM
+import numpy as np
+import tempfile
+import tracemalloc
+import os
+
+
+class SVMBenchmark(object):
+    """
+    Benchmark of the out-of-core SVM on a synthetic feature file. The features are written to a .npy file a block at
+    a time and opened as a memory map; the linear SVM is trained on every trial and the random Fourier features mode
+    on a subset. Each case reports the training time, the number of epochs before early stopping, the peak memory
+    allocated while training (the memory-mapped file pages are not counted) and the accuracy on held-out trials.
+    """
+    # class level constants
+    BLOCK_TRIALS = 65536
+
+    # class level fields
+    n_trials = None
+    n_features = None
+    rbf_trials = None
+    n_test = None
+
+    def __init__(self, n_trials=300000, n_features=16, rbf_trials=100000, n_test=20000):
+        """
+        Constructor for the SVM benchmark
+        :param n_trials: number of training trials in the feature file
+        :type n_trials: int
+        :param n_features: number of features per trial
+        :type n_features: int
+        :param rbf_trials: number of training trials of the random Fourier features case
+        :type rbf_trials: int
+        :param n_test: number of held-out trials
+        :type n_test: int
+        """
+        self.n_trials = n_trials
+        self.n_features = n_features
+        self.rbf_trials = rbf_trials
+        self.n_test = n_test
+
+    def write_features(self, file_name=None) -> np.ndarray:
+        """
+        Method to write the synthetic features to a .npy file a block of trials at a time. The classes depend
+        nonlinearly on the first two features (a disc), so the linear SVM is only approximately right.
+        :param file_name: the .npy file
+        :type file_name: str
+        :return: the class of every trial
+        :rtype: numpy.ndarray
+        """
+        rng = np.random.default_rng(42)
+        n_rows = self.n_trials + self.n_test
+        features = np.lib.format.open_memmap(file_name, mode='w+', dtype=np.float32, shape=(n_rows, self.n_features))
+        labels = np.empty(n_rows, dtype=np.int64)
+        for start in range(0, n_rows, self.BLOCK_TRIALS):
+            block = rng.standard_normal((min(self.BLOCK_TRIALS, n_rows - start), self.n_features))
+            radius = block[:, 0] ** 2 + block[:, 1] ** 2 + 0.3 * block[:, 2]
+            labels[start:start + len(block)] = radius < 1.4
+            features[start:start + len(block)] = 10. * block + 3.
+        features.flush()
+        del features
+        return labels
+
+    def run_case(self, case=None, svm=None, features=None, labels=None, n_train=None):
+        """
+        Method to train one SVM on the first trials of the file and print its results
+        :param case: name of the case
+        :type case: str
+        :param svm: the unfitted SVM
+        :type svm: SVM
+        :param features: the memory-mapped features
+        :type features: numpy.ndarray
+        :param labels: the class of every trial
+        :type labels: numpy.ndarray
+        :param n_train: number of training trials
+        :type n_train: int
+        """
+        tracemalloc.start()
+        svm.fit(features[:n_train], labels[:n_train])
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        accuracy = svm.score(features[-self.n_test:], labels[-self.n_test:])
+        print('%-22s %7d trials (%6.1f MB)   fit %7.2f s (%6d trials/s)   %2d epochs   peak memory %6.1f MB   '
+              'accuracy %.3f' % (case, n_train, n_train * features.shape[1] * features.itemsize / 1e6, svm.fit_time_,
+                                 n_train * svm.n_epochs_ / svm.fit_time_, svm.n_epochs_, peak / 1e6, accuracy))
+
+    def run(self):
+        """
+        Method to run every case and print the results
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            file_name = os.path.join(directory, 'features.npy')
+            write_time, labels = time_call(lambda: self.write_features(file_name=file_name))
+            print('Wrote %d x %d features in %.2f s' % (len(labels), self.n_features, write_time))
+            features = np.load(file_name, mmap_mode='r')
+            chance = max(np.mean(labels[-self.n_test:]), 1. - np.mean(labels[-self.n_test:]))
+            print('Chance level %.3f' % chance)
+            self.run_case(case='linear', svm=SVM(random_state=0), features=features, labels=labels,
+                          n_train=self.n_trials)
+            self.run_case(case='rbf (Fourier features)', svm=SVM(kernel='rbf', random_state=0), features=features,
+                          labels=labels, n_train=self.rbf_trials)
+            del features
+
+
+if __name__ == '__main__':
+    benchmark = SVMBenchmark()
+    benchmark.run()
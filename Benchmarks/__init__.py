@@ -0,0 +1,24 @@
+import time
+
+
+def time_call(function=None, repeats=1, setup=None) -> tuple:
+    """
+    Function to time a call, keeping the fastest of several runs
+    :param function: callable without arguments, or taking the result of setup
+    :type function: callable
+    :param repeats: number of runs
+    :type repeats: int
+    :param setup: optionally, callable without arguments run before every run and not timed, e.g. to give each run
+        a fresh copy of a model that the call changes
+    :type setup: callable
+    :return: the fastest elapsed time in s and the result of the last call
+    :rtype: tuple
+    """
+    best = float('inf')
+    result = None
+    for _ in range(repeats):
+        arguments = () if setup is None else (setup(),)
+        start_time = time.perf_counter()
+        result = function(*arguments)
+        best = min(best, time.perf_counter() - start_time)
+    return best, result
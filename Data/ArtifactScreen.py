@@ -0,0 +1,229 @@
+import numpy as np
+
+
+class ArtifactScreen(object):
+    """
+    Artifact and bad-channel screening of a recording, run once when it is ingested. The signal is cut into fixed
+    windows and the peak-to-peak amplitude of every window and channel is computed in blocks of windows, so the
+    recording is never copied as a whole. From these amplitudes the screen flags flat channels, noisy channels (an
+    outlying median amplitude compared to the other channels) and bad windows (a good channel above the rejection
+    threshold or flat). Clipping is measured as the fraction of samples of each channel at its extreme values. The
+    result is small enough to be stored with the experiment, so loaders can mark info['bads'] and annotate the bad
+    segments without scanning the signal again.
+    """
+    # class level constants
+    BAD_DESCRIPTION = 'BAD_artifact'
+    BLOCK_WINDOWS = 256
+    MAD_SCALE = 1.4826
+
+    # class level fields
+    sfreq = None
+    window_samples = None
+    reject_peak_to_peak = None
+    flat_peak_to_peak = None
+    noisy_z_score = None
+    clip_fraction = None
+
+    def __init__(self, sfreq=None, window_seconds=1.0, reject_peak_to_peak=200.0, flat_peak_to_peak=1.0,
+                 noisy_z_score=5.0, clip_fraction=0.001):
+        """
+        Constructor for the artifact screen
+        :param sfreq: sampling frequency in Hz
+        :type sfreq: float
+        :param window_seconds: length of the screening windows in s
+        :type window_seconds: float
+        :param reject_peak_to_peak: peak-to-peak amplitude above which a window is bad, in the units of the signal
+            (uV at ingest)
+        :type reject_peak_to_peak: float
+        :param flat_peak_to_peak: peak-to-peak amplitude below which a channel or window is flat
+        :type flat_peak_to_peak: float
+        :param noisy_z_score: robust z-score of the log median amplitude above which a channel is noisy
+        :type noisy_z_score: float
+        :param clip_fraction: fraction of samples at the extreme values above which a channel is clipped
+        :type clip_fraction: float
+        """
+        self.sfreq = float(sfreq)
+        self.window_samples = max(int(round(window_seconds * self.sfreq)), 1)
+        self.reject_peak_to_peak = reject_peak_to_peak
+        self.flat_peak_to_peak = flat_peak_to_peak
+        self.noisy_z_score = noisy_z_score
+        self.clip_fraction = clip_fraction
+
+    @classmethod
+    def from_config(cls, config=None, sfreq=None):
+        """
+        Method to create the artifact screen from the screening_settings section of the config
+        :param config: the config settings
+        :type config: dict
+        :param sfreq: sampling frequency in Hz
+        :type sfreq: float
+        :return: the artifact screen
+        :rtype: ArtifactScreen
+        """
+        settings = config.get('screening_settings', {})
+        return cls(sfreq=sfreq, window_seconds=settings.get('window_seconds', 1.0),
+                   reject_peak_to_peak=settings.get('reject_peak_to_peak', 200.0),
+                   flat_peak_to_peak=settings.get('flat_peak_to_peak', 1.0),
+                   noisy_z_score=settings.get('noisy_z_score', 5.0),
+                   clip_fraction=settings.get('clip_fraction', 0.001))
+
+    def get_window_extremes(self, signal=None) -> tuple:
+        """
+        Method to compute the maximum and minimum of every window, a block of windows at a time
+        :param signal: (n_channels, n_samples) signal
+        :type signal: numpy.ndarray
+        :return: (n_windows, n_channels) maxima and minima; the last window may be shorter
+        :rtype: tuple
+        """
+        n_channels, n_samples = signal.shape
+        n_windows = -(-n_samples // self.window_samples)
+        maxima = np.empty((n_windows, n_channels), dtype=np.float32)
+        minima = np.empty((n_windows, n_channels), dtype=np.float32)
+        n_full = n_samples // self.window_samples
+        for start in range(0, n_full, self.BLOCK_WINDOWS):
+            stop = min(start + self.BLOCK_WINDOWS, n_full)
+            block = np.asarray(signal[:, start * self.window_samples:stop * self.window_samples])
+            block = block.reshape(n_channels, stop - start, self.window_samples)
+            maxima[start:stop] = block.max(axis=2).T
+            minima[start:stop] = block.min(axis=2).T
+        if n_full < n_windows:
+            last = np.asarray(signal[:, n_full * self.window_samples:])
+            maxima[-1] = last.max(axis=1)
+            minima[-1] = last.min(axis=1)
+        return maxima, minima
+
+    def get_clipped_fraction(self, signal=None, maxima=None, minima=None) -> np.ndarray:
+        """
+        Method to compute the fraction of samples of each channel at its largest or smallest value; an amplifier
+        that saturates keeps returning the same extreme value, an unclipped channel reaches it only a few times
+        :param signal: (n_channels, n_samples) signal
+        :type signal: numpy.ndarray
+        :param maxima: (n_windows, n_channels) window maxima
+        :type maxima: numpy.ndarray
+        :param minima: (n_windows, n_channels) window minima
+        :type minima: numpy.ndarray
+        :return: (n_channels,) fraction of clipped samples
+        :rtype: numpy.ndarray
+        """
+        n_channels, n_samples = signal.shape
+        # compare in the dtype of the window extremes, so that the values found there match exactly
+        top = maxima.max(axis=0)[:, np.newaxis]
+        bottom = minima.min(axis=0)[:, np.newaxis]
+        counts = np.zeros(n_channels, dtype=np.int64)
+        block_samples = self.BLOCK_WINDOWS * self.window_samples
+        for start in range(0, n_samples, block_samples):
+            block = np.asarray(signal[:, start:start + block_samples]).astype(np.float32, copy=False)
+            counts += np.count_nonzero((block >= top) | (block <= bottom), axis=1)
+        return counts / max(n_samples, 1)
+
+    def screen(self, signal=None, channel_names=None) -> dict:
+        """
+        Method to screen a recording
+        :param signal: (n_channels, n_samples) signal, e.g. a transposed view of the (n_samples, n_channels) readings
+        :type signal: numpy.ndarray
+        :param channel_names: names of the channels
+        :type channel_names: list
+        :return: the screening: window_samples, channel_names, peak_to_peak (n_windows, n_channels), flat, noisy and
+            clipped (n_channels,) flags, clipped_fraction (n_channels,) and bad_windows (indices)
+        :rtype: dict
+        """
+        maxima, minima = self.get_window_extremes(signal=signal)
+        peak_to_peak = maxima - minima
+        clipped_fraction = self.get_clipped_fraction(signal=signal, maxima=maxima, minima=minima)
+
+        # channels: flat, noisy (robust z-score of the log median amplitude across channels) or clipped
+        median_amplitude = np.median(peak_to_peak, axis=0)
+        flat = median_amplitude < self.flat_peak_to_peak
+        log_amplitude = np.log(np.maximum(median_amplitude, np.finfo(np.float32).tiny))
+        centre = np.median(log_amplitude[~flat]) if np.any(~flat) else 0.0
+        spread = self.MAD_SCALE * np.median(np.abs(log_amplitude[~flat] - centre)) if np.any(~flat) else 0.0
+        noisy = ~flat & ((log_amplitude - centre) > self.noisy_z_score * max(spread, 1e-6))
+        clipped = ~flat & (clipped_fraction > self.clip_fraction)
+
+        # windows: a good channel above the rejection threshold or flat; bad channels are handled by info['bads']
+        good = ~(flat | noisy | clipped)
+        good_peak_to_peak = peak_to_peak[:, good]
+        bad = np.any((good_peak_to_peak > self.reject_peak_to_peak) | (good_peak_to_peak < self.flat_peak_to_peak),
+                     axis=1)
+        if channel_names is None:
+            channel_names = [str(channel) for channel in range(signal.shape[0])]
+        return {'window_samples': self.window_samples, 'n_samples': int(signal.shape[1]),
+                'channel_names': list(channel_names), 'peak_to_peak': peak_to_peak, 'flat': flat, 'noisy': noisy,
+                'clipped': clipped, 'clipped_fraction': clipped_fraction.astype(np.float32),
+                'bad_windows': np.flatnonzero(bad)}
+
+    @staticmethod
+    def get_bad_channels(screening=None) -> list:
+        """
+        Method to list the channels flagged by a screening
+        :param screening: the screening, as returned by screen
+        :type screening: dict
+        :return: names of the flat, noisy or clipped channels
+        :rtype: list
+        """
+        bad = np.asarray(screening['flat']) | np.asarray(screening['noisy']) | np.asarray(screening['clipped'])
+        return [name for name, is_bad in zip(screening['channel_names'], bad) if is_bad]
+
+    @staticmethod
+    def get_bad_segments(screening=None) -> np.ndarray:
+        """
+        Method to merge consecutive bad windows into segments
+        :param screening: the screening, as returned by screen
+        :type screening: dict
+        :return: (n_segments, 2) first and last (exclusive) sample of each bad segment
+        :rtype: numpy.ndarray
+        """
+        bad_windows = np.asarray(screening['bad_windows'], dtype=np.int64)
+        if len(bad_windows) == 0:
+            return np.empty((0, 2), dtype=np.int64)
+        breaks = np.flatnonzero(np.diff(bad_windows) > 1)
+        first = bad_windows[np.concatenate([[0], breaks + 1])]
+        last = bad_windows[np.concatenate([breaks, [len(bad_windows) - 1]])] + 1
+        window_samples = int(screening['window_samples'])
+        return np.column_stack([first * window_samples,
+                                np.minimum(last * window_samples, int(screening['n_samples']))])
+
+    @staticmethod
+    def get_bad_mask(screening=None, starts=None, n_times=None) -> np.ndarray:
+        """
+        Method to find which sample ranges (e.g. epochs) overlap a bad window
+        :param screening: the screening, as returned by screen
+        :type screening: dict
+        :param starts: first sample of each range
+        :type starts: numpy.ndarray
+        :param n_times: number of samples of each range
+        :type n_times: int
+        :return: True for the ranges that overlap a bad window
+        :rtype: numpy.ndarray
+        """
+        window_samples = int(screening['window_samples'])
+        n_windows = -(-int(screening['n_samples']) // window_samples)
+        bad = np.zeros(n_windows + 1, dtype=np.int64)
+        bad[np.asarray(screening['bad_windows'], dtype=np.int64) + 1] = 1
+        cumulative = np.cumsum(bad)
+        starts = np.asarray(starts, dtype=np.int64)
+        first = np.clip(starts // window_samples, 0, n_windows)
+        last = np.clip((starts + n_times - 1) // window_samples + 1, 0, n_windows)
+        return cumulative[last] - cumulative[first] > 0
+
+    @classmethod
+    def apply(cls, raw=None, screening=None):
+        """
+        Method to mark the bad channels in info['bads'] and annotate the bad segments of a raw recording, which
+        mne.Epochs then rejects (reject_by_annotation)
+        :param raw: the raw recording the screening was computed for
+        :type raw: mne.io.Raw
+        :param screening: the screening, as returned by screen
+        :type screening: dict
+        :return: the raw recording
+        :rtype: mne.io.Raw
+        """
+        raw.info['bads'] = sorted(set(raw.info['bads']) | set(cls.get_bad_channels(screening=screening)))
+        segments = cls.get_bad_segments(screening=screening)
+        if len(segments) > 0:
+            # annotations of a raw recording are stored relative to its first sample (first_time)
+            sfreq = raw.info['sfreq']
+            raw.annotations.append(onset=segments[:, 0] / sfreq + raw.first_time,
+                                   duration=(segments[:, 1] - segments[:, 0]) / sfreq,
+                                   description=[cls.BAD_DESCRIPTION] * len(segments))
+        return raw
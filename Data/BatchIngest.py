@@ -0,0 +1,125 @@
+from Data.DataLoader import DataLoader
+from Utilities.Config.Config import Config
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import platform
+import copy
+import time
+import sys
+import os
+
+
+def ingest_recording(config=None, file_name=None) -> dict:
+    """
+    Function run in a worker process to load one recording and push it to Postgres. Recordings that are already
+    in experiment_information are skipped before the .mat file is read.
+    :param config: the config settings
+    :type config: dict
+    :param file_name: name of the .mat file in data.directory
+    :type file_name: str
+    :return: the file name, experiment_id (None if it could not be found), number of rows pushed (0 when skipped or
+        pushed by a concurrent run) and elapsed time
+    :rtype: dict
+    """
+    start_time = time.perf_counter()
+    config = copy.deepcopy(config)
+    config['data']['file'] = file_name
+    data_loader = DataLoader(config=config)
+    data_loader.parse_file_name()
+    experiment_id = data_loader.get_experiment_id()
+    n_rows = 0
+    if experiment_id is None:
+        data_loader.load_data_from_file()
+        data_loader.push_data_to_sql()
+        experiment_id = data_loader.experiment_id
+        if experiment_id is not None:
+            n_rows = data_loader.signal_readings.shape[0]
+        else:
+            # a concurrent push inserted the recording first, nothing was inserted by this one
+            experiment_id = data_loader.get_experiment_id()
+    return {'file_name': file_name, 'experiment_id': experiment_id, 'n_rows': n_rows,
+            'elapsed': time.perf_counter() - start_time}
+
+
+class BatchIngest(object):
+    """
+    Batch ingestion of every recording in the configured data directory. Recordings are loaded and pushed
+    concurrently by worker processes; the run is idempotent, so an interrupted run can simply be started again.
+    """
+    config = None
+    data_directory = None
+    max_workers = None
+
+    def __init__(self, config=None, max_workers=None):
+        """
+        Constructor for the batch ingestion
+        :param config: the config settings
+        :type config: dict
+        :param max_workers: number of worker processes, defaults to ingest_settings.parallel_workers
+        :type max_workers: int
+        """
+        self.config = config
+        self.data_directory = DataLoader(config=config).data_directory
+        if max_workers is None:
+            max_workers = int(config.get('ingest_settings', {}).get('parallel_workers', os.cpu_count()))
+        self.max_workers = max_workers
+
+    def find_recordings(self) -> list:
+        """
+        Method to list the .mat recordings in the data directory
+        :return: the file names, sorted
+        :rtype: list
+        """
+        return sorted(name for name in os.listdir(self.data_directory) if name.lower().endswith('.mat'))
+
+    def run(self) -> list:
+        """
+        Method to ingest every recording, printing progress and throughput as the workers finish
+        :return: the result of each recording, as returned by ingest_recording
+        :rtype: list
+        """
+        file_names = self.find_recordings()
+        results = []
+        total_rows = 0
+        start_time = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(ingest_recording, self.config, file_name): file_name
+                       for file_name in file_names}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as ex:
+                    print('[%d/%d] %s failed: %s' % (len(results) + 1, len(file_names), futures[future], ex))
+                    result = {'file_name': futures[future], 'experiment_id': None, 'n_rows': 0, 'elapsed': 0.0,
+                              'error': str(ex)}
+                    results.append(result)
+                    continue
+                results.append(result)
+                total_rows += result['n_rows']
+                elapsed = time.perf_counter() - start_time
+                if result['n_rows'] > 0:
+                    status = 'pushed %d rows as experiment %s in %.1f s' % (result['n_rows'], result['experiment_id'],
+                                                                          result['elapsed'])
+                else:
+                    status = 'already ingested as experiment %s' % result['experiment_id']
+                print('[%d/%d] %s %s (total %.0f rows/s)' % (len(results), len(file_names), result['file_name'],
+                                                             status, total_rows / max(elapsed, 1e-9)))
+        elapsed = time.perf_counter() - start_time
+        print('Ingested %d rows from %d recordings in %.1f s (%.0f rows/s)' %
+              (total_rows, len(file_names), elapsed, total_rows / max(elapsed, 1e-9)))
+        return results
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        filename = sys.argv[1]
+    elif platform.system() == 'Windows':
+        # for Steven
+        filename = 'C:\\Users\\saspr\\source\\Python\\Tegan\\BCI\\Utilities\\Config\\config_steven.json'
+    elif platform.system() == 'Darwin':
+        # for Tegan
+        filename = '/Users/teganasprey/Desktop/BCI/Utilities/Config/config_tegan.json'
+
+    config = Config(file_name=filename)
+    config = config.settings
+    batch_ingest = BatchIngest(config=config)
+    batch_ingest.run()
@@ -1,29 +1,28 @@
+from __future__ import annotations
 from Utilities.Config.Config import Config
 from Utilities.Database.Postgres.PostgresConnector import PostgresConnector
-import pandas as pd
-import polars as pl
-from scipy.io import loadmat
+from Utilities.Database.Postgres.CopyStream import CopyStream
+from Data.EpochExtractor import EpochExtractor, EpochWindows
+from Data.ArtifactScreen import ArtifactScreen
+from Data.MatCache import MatCache
+from Utilities.Cache.StageCache import StageCache
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+import numpy as np
 import getpass
+import json
 import platform
+import time
 import mne
 import os
 
-# imports for preprocessing and classification testing
-import numpy as np
-from mne.decoding import CSP
-from mne.preprocessing import ICA
-from mne.decoding import UnsupervisedSpatialFilter
-
-from sklearn.pipeline import Pipeline
-from sklearn.discriminant_analysis import LinearDiscriminantAnalysis
-from sklearn.model_selection import ShuffleSplit, cross_val_score
-from sklearn.decomposition import PCA, FastICA
-
-
-if platform.system() == 'Darwin':
-    import matplotlib as mpl
-    import matplotlib.pyplot as plt
-    mpl.use('macosx')
+# heavy dependencies (pandas, polars, pyarrow, sklearn, mne.decoding, ...) are imported where they are used, so
+# that importing the data loader stays cheap for jobs that only move data in and out of Postgres
+if TYPE_CHECKING:
+    from Data.ParquetStore import ParquetStore
+    import pandas as pd
+    import polars as pl
+    import pyarrow as pa
 
 
 class DataLoader(object):
@@ -43,10 +42,19 @@ class DataLoader(object):
                                'inter-session rest break period': 91, 'experiment end': 92, 'warm-up': 90}
     FIVE_FINGERS_EVENT_COLORS = {1: 'r', 2: 'g', 3: 'b', 4: 'm', 5: 'y',
                                  99: 'k', 91: 'k', 92: 'k', 90: 'k'}
+    SAMPLE_FREQUENCY = 200
+    COPY_CHUNK_ROWS = 50000
+    SQL_CHUNK_ROWS = 50000
+    SCREENING_TABLE = 'artifact_screening'
 
     # class level fields
     config = None
     data_directory = None
+    mat_cache = None
+    stage_cache = None
+    artifact_screen = None
+    parquet_directory = None
+    parquet_compression = None
     operating_system = None
     user = None
 
@@ -64,7 +72,12 @@ class DataLoader(object):
     data_pandas = None
     data_polars = None
     data_raw_mne = None
+    data_provenance = None
+    epoch_rows = None
+    file_conversions = None
+    screening = None
 
+    experiment_id = None
     framework = None
     data_loaded = False
 
@@ -83,194 +96,664 @@ class DataLoader(object):
         self.framework = config['data_framework']
         self.data_directory = config['data']['directory'].replace('{user}', self.user)
 
+        # optional memory-mapped cache of the converted .mat recordings
+        cache_settings = config.get('cache_settings', {})
+        if bool(cache_settings.get('mat_cache', 0)):
+            cache_directory = cache_settings.get('directory', '')
+            if not cache_directory:
+                cache_directory = os.path.join(self.data_directory, 'Cache')
+            self.mat_cache = MatCache(cache_directory=cache_directory.replace('{user}', self.user))
+
+        # optional on-disk cache of the outputs of the processing stages, keyed by experiment and settings
+        if bool(cache_settings.get('stage_cache', 0)):
+            stage_directory = cache_settings.get('stage_directory', '')
+            if not stage_directory:
+                stage_directory = os.path.join(self.data_directory, 'StageCache')
+            max_gigabytes = cache_settings.get('stage_max_gigabytes', 0)
+            max_bytes = int(max_gigabytes * 1024 ** 3) if max_gigabytes else None
+            self.stage_cache = StageCache(directory=stage_directory.replace('{user}', self.user), max_bytes=max_bytes)
+
+        # screening of artifacts and bad channels, computed at ingest and applied by the loaders
+        if bool(config.get('screening_settings', {}).get('enabled', 0)):
+            self.artifact_screen = ArtifactScreen.from_config(config=config, sfreq=self.SAMPLE_FREQUENCY)
+
+        # local Parquet dataset, used instead of Postgres by the *_parquet methods
+        parquet_settings = config.get('parquet_settings', {})
+        parquet_directory = parquet_settings.get('directory', '')
+        if not parquet_directory:
+            parquet_directory = os.path.join(self.data_directory, 'Parquet')
+        self.parquet_directory = parquet_directory.replace('{user}', self.user)
+        self.parquet_compression = parquet_settings.get('compression', 'zstd')
+
     def load_data_from_file(self) -> bool:
         """
         Method to load the data file specified in the config file being used
         :return: True when the data have been loaded successfully
         :rtype: bool
         """
-        # form the full file name with path, depending on the OS
-        filename = self.data_directory
-        if self.operating_system == 'Windows':
-            filename += '\\' + self.file_name
-        elif self.operating_system == 'Darwin':
-            filename += '/' + self.file_name
+        # form the full file name with path, using the separator of the OS
+        filename = os.path.join(self.data_directory, self.file_name)
 
         # extract information from the file name
+        self.parse_file_name()
+
+        # load the mat file, through the memory-mapped cache when it is enabled
+        if self.mat_cache is not None:
+            recording = self.mat_cache.load_or_convert(filename=filename)
+        else:
+            recording = MatCache.read_mat_file(filename=filename)
+        self.marker_codes, self.signal_readings, self.electrode_names_raw = recording
+        self.file_conversions = {}
+        self.screening = None
+
+        # return
+        self.data_loaded = True
+        return self.data_loaded
+
+    def parse_file_name(self) -> dict:
+        """
+        Method to extract the experiment information from the name of the data file, e.g.
+        CLA-SubjectF-150917-3St-LRHand.mat or HaLT-SubjectA-160223-6St-LRHandLegTongue-Inter.mat
+        :return: the paradigm, subject, date, states, stimuli and mode of the recording
+        :rtype: dict
+        """
         components = self.file_name.split('.')
         info = components[0].split('-')
         self.experiment_paradigm = info[0]
         self.subject = info[1][-1]
         self.file_date = info[2]
-        self.states = info[3]
-        self.experiment_stimuli = info[4]
+        self.states = info[3] if len(info) > 3 else 'Empty'
+        self.experiment_stimuli = info[4] if len(info) > 4 else 'Empty'
         if len(info) > 5:
             self.experiment_mode = info[5]
         else:
             self.experiment_mode = 'Empty'
-
-        # load the mat file
-        rd = loadmat(filename)
-
-        # process the mat file data into arrays
-        raw_data = rd['o']
-        self.marker_codes = raw_data[0][0][4]
-        self.signal_readings = raw_data[0][0][5]
-        self.electrode_names_raw = raw_data[0][0][6]
-
-        # return
-        self.data_loaded = True
-        return self.data_loaded
+        return {'paradigm': self.experiment_paradigm, 'subject': self.subject, 'date': self.file_date,
+                'states': self.states, 'stimuli': self.experiment_stimuli, 'mode': self.experiment_mode}
 
     def load_data_from_sql(self, experiment_id=None, marker=None) -> mne.io.RawArray:
-        postgres = PostgresConnector()
+        """
+        Method to load an experiment from the signal_data table into an MNE RawArray
+        :param experiment_id: the experiment to load
+        :type experiment_id: int
+        :param marker: optionally, only load the samples with this marker code
+        :type marker: int
+        :return: raw MNE data array containing the signal data (in V) and the stim channel
+        :rtype: mne.io.RawArray
+        """
         if experiment_id is None:
             experiment_id = 1
-        sql_query = 'SELECT sample_index, marker as "STI001", "Fp1", "Fp2", "F3", "F4", "C3", "C4", "P3", "P4", ' \
-                    '"O1", "O2", "A1", "A2", "F7", "F8", "T3", "T4", "T5", "T6", "Fz", "Cz", "Pz" ' \
-                    'FROM signal_data ' \
-                    'where experiment_id = ' + str(experiment_id) + ' '
+        # a re-ingested experiment has a new ingest version, so it addresses a new entry of the stage cache
+        ingest_version = self.get_ingest_version(experiment_id=experiment_id)
+        arrays, _ = self.get_stage(experiment_id=experiment_id if ingest_version is not None else None, stage='signal',
+                                   settings={'marker': marker, 'ingest_version': ingest_version},
+                                   compute=lambda: ({'data': self.read_signal_data(experiment_id=experiment_id,
+                                                                                   marker=marker)}, {}))
+        data = arrays['data']
+        info = self.create_mne_info()
+        raw = mne.io.RawArray(data=data, info=info)
+        screened = False
+        if marker is None and self.artifact_screen is not None:
+            screening = self.load_screening(experiment_id=experiment_id)
+            if screening is not None:
+                ArtifactScreen.apply(raw=raw, screening=screening)
+                screened = True
+        self.data_raw_mne = raw
+        # how the recording was produced, which the stages computed from it (Filter, FFT, DWT) add to their keys
+        self.data_provenance = None
+        if ingest_version is not None:
+            self.data_provenance = {'stage': 'signal', 'experiment_id': experiment_id, 'marker': marker,
+                                    'ingest_version': ingest_version, 'screened': screened}
+        import pandas as pd
+        self.data_pandas = pd.DataFrame(data=raw._data.T, columns=self.ELECTRODE_NAMES + ['STI001'], copy=False)
+        return raw
+
+    def get_ingest_version(self, experiment_id=None, postgres=None):
+        """
+        Method to get a version of the ingest of an experiment: the id of the transaction that inserted its row in
+        experiment_information (the xmin system column), which changes when the experiment is deleted and pushed
+        again. The experiment and its signal data are inserted in one transaction (push_data_to_sql).
+        :param experiment_id: the experiment
+        :type experiment_id: int
+        :param postgres: connector to use, a pooled one is checked out when not given
+        :type postgres: PostgresConnector
+        :return: the ingest version, None if the experiment is not in the database
+        :rtype: str
+        """
+        if postgres is None:
+            with PostgresConnector(config=self.config) as postgres:
+                return self.get_ingest_version(experiment_id=experiment_id, postgres=postgres)
+        rows = postgres.execute_query(sql_query='select xmin::text from experiment_information '
+                                                'where experiment_id = %s',
+                                      parameters=(int(experiment_id),))
+        if len(rows) == 0:
+            return None
+        return rows[0][0]
+
+    def get_stage(self, experiment_id=None, stage=None, settings=None, compute=None) -> tuple:
+        """
+        Method to get the output of a processing stage from the stage cache, computing (and caching) it when it is
+        not there. Without a stage cache, or for data that does not belong to a single experiment, the stage is
+        simply computed.
+        :param experiment_id: the experiment the stage is computed for, or None
+        :type experiment_id: int
+        :param stage: name of the stage, e.g. signal, filter, psd
+        :type stage: str
+        :param settings: the config settings the output depends on
+        :type settings: dict
+        :param compute: callable without arguments returning a dict of arrays and a dict of json metadata
+        :return: the arrays and the metadata
+        :rtype: tuple
+        """
+        if self.stage_cache is None or experiment_id is None:
+            return compute()
+        return self.stage_cache.get_or_compute(experiment_id=experiment_id, stage=stage, settings=settings,
+                                               compute=compute)
+
+    def read_signal_data(self, experiment_id=None, marker=None) -> np.ndarray:
+        """
+        Method to read the signal data of an experiment. Rows are streamed from a server-side cursor in blocks of
+        SQL_CHUNK_ROWS and written straight into a preallocated (n_channels, n_samples) array, which can back a
+        RawArray without further copies. The method does not change the state of the loader, so it can be called
+        from several threads at once.
+        :param experiment_id: the experiment to read
+        :type experiment_id: int
+        :param marker: optionally, only read the samples with this marker code
+        :type marker: int
+        :return: the 21 EEG channels (in V) followed by the marker channel
+        :rtype: numpy.ndarray
+        """
+        sql_filter = 'where experiment_id = ' + str(int(experiment_id)) + ' '
         if marker is not None:
-            sql_query += 'and marker = ' + str(marker) + ' '
-        sql_query += 'order by sample_index'
-        data = postgres.execute_query_to_pandas(sql_query=sql_query)
+            sql_filter += 'and marker = ' + str(int(marker)) + ' '
+        with PostgresConnector(config=self.config) as postgres:
+            rows = postgres.execute_query(sql_query='select count(*) from signal_data ' + sql_filter)
+            n_samples = int(rows[0][0])
+            sql_query = 'SELECT "Fp1", "Fp2", "F3", "F4", "C3", "C4", "P3", "P4", "O1", "O2", "A1", "A2", ' \
+                        '"F7", "F8", "T3", "T4", "T5", "T6", "Fz", "Cz", "Pz", marker as "STI001" ' \
+                        'FROM signal_data ' + sql_filter
+            sql_query += 'order by sample_index'
+            data = np.empty((len(self.ELECTRODE_NAMES) + 1, n_samples), dtype=np.float64)
+            position = 0
+            for rows in postgres.execute_query_chunks(sql_query=sql_query, chunk_size=self.SQL_CHUNK_ROWS):
+                if position + len(rows) > n_samples:
+                    raise ValueError('signal_data changed while loading experiment ' + str(experiment_id))
+                data[:, position:position + len(rows)] = np.array(rows, dtype=np.float64).T
+                position += len(rows)
+        data = data[:, :position]
         # convert units from uV to V (expected by MNE)
-        for electrode in self.ELECTRODE_NAMES:
-            data[electrode] = data[electrode] / 1.0e6
+        data[:-1] *= 1.0e-6
+        return data
+
+    def load_epochs_from_sql(self, experiment_id=None, event_id=None, t_min=None, t_max=None,
+                             baseline=(None, 0)) -> mne.EpochsArray:
+        """
+        Method to load only the epoch windows of an experiment. The event onsets (changes of the marker channel to
+        one of the requested codes) are found in SQL, and only the samples in [t_min, t_max] around each onset are
+        transferred, directly into a preallocated (n_epochs, n_channels, n_times) array. The rest and break
+        periods of the recording are never fetched. The number of rows fetched and the number of rows of the
+        experiment are kept in epoch_rows.
+        :param experiment_id: the experiment to load
+        :type experiment_id: int
+        :param event_id: event names and marker codes to epoch, defaults to all motor imagery events
+        :type event_id: dict
+        :param t_min: start of each epoch relative to the onset in s, defaults to epochs_settings.t_min
+        :type t_min: float
+        :param t_max: end of each epoch relative to the onset in s, defaults to epochs_settings.t_max
+        :type t_max: float
+        :param baseline: baseline correction as in mne.Epochs, None for no correction
+        :type baseline: tuple
+        :return: the epochs of the EEG channels (in V), as mne.Epochs(preload=True) over the loaded recording
+        :rtype: mne.EpochsArray
+        """
+        if experiment_id is None:
+            experiment_id = 1
+        if event_id is None:
+            event_id = {name: value for name, value in self.CLA_HALT_FREEFORM_EVENT_DICT.items() if value < 90}
+        if t_min is None:
+            t_min = self.config['epochs_settings']['t_min']
+        if t_max is None:
+            t_max = self.config['epochs_settings']['t_max']
         info = self.create_mne_info()
-        raw = mne.io.RawArray(data=data[self.ELECTRODE_NAMES + ['STI001']].transpose(), info=info)
-        self.data_raw_mne = raw
-        self.data_pandas = data[self.ELECTRODE_NAMES + ['STI001']]
+        info = mne.pick_info(info, mne.pick_types(info, eeg=True, stim=False))
+        start_offset = int(round(t_min * info['sfreq']))
+        n_times = int(round(t_max * info['sfreq'])) - start_offset + 1
+
+        with PostgresConnector(config=self.config) as postgres:
+            # onsets are the samples where the marker changes to one of the requested codes
+            sql_query = 'select sample_index, marker from (' \
+                        'select sample_index, marker, lag(marker, 1, 0) over (order by sample_index) as previous ' \
+                        'from signal_data where experiment_id = %s) as markers ' \
+                        'where marker <> previous and marker = any(%s) order by sample_index'
+            onsets = postgres.execute_query(sql_query=sql_query,
+                                            parameters=(int(experiment_id), [int(v) for v in event_id.values()]))
+            rows = postgres.execute_query(sql_query='select count(*) from signal_data where experiment_id = %s',
+                                          parameters=(int(experiment_id),))
+            n_samples = int(rows[0][0])
+            events = np.array(onsets, dtype=np.int64).reshape(-1, 2)
+            first_samples = events[:, 0] + start_offset
+            # drop the epochs that would run over the edges of the recording
+            keep = (first_samples >= 0) & (first_samples + n_times <= n_samples)
+            # and, when the experiment was screened at ingest, the epochs that overlap a bad window
+            screening = None
+            if self.artifact_screen is not None:
+                screening = self.load_screening(experiment_id=experiment_id, postgres=postgres)
+            if screening is not None:
+                keep &= ~ArtifactScreen.get_bad_mask(screening=screening, starts=first_samples, n_times=n_times)
+                info['bads'] = ArtifactScreen.get_bad_channels(screening=screening)
+            events, first_samples = events[keep], first_samples[keep]
+
+            data = np.empty((len(events), len(self.ELECTRODE_NAMES), n_times), dtype=np.float64)
+            sql_query = 'select windows.epoch, signal_data.sample_index - windows.first_sample, ' + \
+                        ', '.join('"' + electrode + '"' for electrode in self.ELECTRODE_NAMES) + ' ' \
+                        'from signal_data join unnest(%s::int[], %s::int[]) as windows(epoch, first_sample) ' \
+                        'on signal_data.sample_index between windows.first_sample and windows.first_sample + %s ' \
+                        'where signal_data.experiment_id = %s'
+            parameters = (list(range(len(events))), first_samples.tolist(), n_times - 1, int(experiment_id))
+            n_rows = 0
+            for rows in postgres.execute_query_chunks(sql_query=sql_query, chunk_size=self.SQL_CHUNK_ROWS,
+                                                      parameters=parameters):
+                block = np.array(rows, dtype=np.float64)
+                data[block[:, 0].astype(np.int64), :, block[:, 1].astype(np.int64)] = block[:, 2:]
+                n_rows += len(block)
+        if n_rows != data.shape[0] * n_times:
+            raise ValueError('missing samples in the epochs of experiment ' + str(experiment_id))
+        self.epoch_rows = (n_rows, n_samples)
+        # convert units from uV to V (expected by MNE)
+        data *= 1.0e-6
+        mne_events = np.column_stack([events[:, 0], np.zeros(len(events), dtype=np.int64), events[:, 1]])
+        event_id = {name: value for name, value in event_id.items() if value in events[:, 1]}
+        return mne.EpochsArray(data=data, info=info, events=mne_events, tmin=start_offset / info['sfreq'],
+                               event_id=event_id, baseline=baseline)
+
+    def get_experiment_ids(self, paradigm=None, subjects=None, stimuli=None) -> list:
+        """
+        Method to query experiment_information for the experiments matching a filter
+        :param paradigm: paradigm or list of paradigms, e.g. 'HaLT' or ['CLA', 'HaLT']
+        :type paradigm: str or list
+        :param subjects: subject or list of subjects, e.g. ['A', 'B', 'C']
+        :type subjects: str or list
+        :param stimuli: stimuli or list of stimuli, e.g. 'LRHand'
+        :type stimuli: str or list
+        :return: the matching experiment ids, in ascending order
+        :rtype: list
+        """
+        conditions = []
+        parameters = []
+        for column, values in [('paradigm', paradigm), ('subject_id', subjects), ('stimuli', stimuli)]:
+            if values is not None:
+                if isinstance(values, str):
+                    values = [values]
+                conditions.append(column + ' = any(%s)')
+                parameters.append(list(values))
+        sql_query = 'select experiment_id from experiment_information '
+        if len(conditions) > 0:
+            sql_query += 'where ' + ' and '.join(conditions) + ' '
+        sql_query += 'order by experiment_id'
+        with PostgresConnector(config=self.config) as postgres:
+            rows = postgres.execute_query(sql_query=sql_query, parameters=parameters)
+        return [int(row[0]) for row in rows]
+
+    def load_experiments(self, experiment_ids=None, paradigm=None, subjects=None, stimuli=None, concatenate=True,
+                         max_workers=None):
+        """
+        Method to load several experiments at once. The experiments are either given as a list of ids or selected
+        with a filter on experiment_information, and are fetched concurrently over pooled connections.
+        :param experiment_ids: the experiments to load, takes precedence over the filter arguments
+        :type experiment_ids: list
+        :param paradigm: paradigm or list of paradigms to select
+        :type paradigm: str or list
+        :param subjects: subject or list of subjects to select
+        :type subjects: str or list
+        :param stimuli: stimuli or list of stimuli to select
+        :type stimuli: str or list
+        :param concatenate: return one RawArray (True) or a dict of RawArray keyed by experiment id (False)
+        :type concatenate: bool
+        :param max_workers: number of concurrent fetches, defaults to the size of the connection pool
+        :type max_workers: int
+        :return: the concatenated raw data, annotated with the extent of each experiment, or the dict of raws
+        :rtype: mne.io.RawArray or dict
+        """
+        if experiment_ids is None:
+            experiment_ids = self.get_experiment_ids(paradigm=paradigm, subjects=subjects, stimuli=stimuli)
+        if len(experiment_ids) == 0:
+            raise ValueError('no experiments to load')
+        if max_workers is None:
+            max_workers = int(self.config.get('database', {}).get('pool_max_connections',
+                                                                   PostgresConnector.POOL_MAX_CONNECTIONS))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {experiment_id: executor.submit(self.read_signal_data, experiment_id=experiment_id)
+                       for experiment_id in experiment_ids}
+            raws = {experiment_id: mne.io.RawArray(data=future.result(), info=self.create_mne_info())
+                    for experiment_id, future in futures.items()}
+        if not concatenate:
+            return raws
+
+        # mark where each experiment starts and ends, concatenate_raws adds the boundary annotations in between
+        for experiment_id, raw in raws.items():
+            raw.set_annotations(mne.Annotations(onset=[0.0], duration=[raw.n_times / raw.info['sfreq']],
+                                                description=['experiment ' + str(experiment_id)]))
+        raw = mne.concatenate_raws(list(raws.values()))
         return raw
 
     def push_data_to_sql(self) -> bool:
         """
-        Method to insert data into the Postgres tables (experiment_information and signal_data). The method uses
-        the COPY command to push a csv file to Postgres, which in turn is created using Pandas.
+        Method to insert data into the Postgres tables (experiment_information and signal_data). The signal data
+        are streamed from memory with COPY ... FROM STDIN, in binary format when the column types allow it. Both
+        inserts run in one transaction under an advisory lock on the recording, so an interrupted push leaves
+        nothing behind and a recording is never inserted twice, even by concurrent pushes.
         :return: whether the data push was successful
         :rtype: bool
         """
-        postgres = PostgresConnector()
-        experiment_id = self.get_next_experiment_id()
-        if experiment_id > 0:
-            experiment_query = 'insert into experiment_information ' \
-                               '(experiment_id, experiment_date, paradigm, subject_id, states, stimuli, mode) ' \
-                               'values ' \
-                               '('
-            experiment_query += str(experiment_id) + ', '
-            experiment_query += 'to_date(\'20' + self.file_date + '\', \'YYYYMMDD\'), '
-            experiment_query += '\'' + self.experiment_paradigm + '\', '
-            experiment_query += '\'' + self.subject + '\', '
-            experiment_query += '\'' + self.states + '\', '
-            experiment_query += '\'' + self.experiment_stimuli + '\', '
-            experiment_query += '\'' + self.experiment_mode + '\')'
-            postgres.execute(sql_query=experiment_query)
-
-            # create a csv file with the data formatted correctly for the signal_data table
-            data = self.to_pandas()
-            data['experiment_id'] = experiment_id
-            data['sample_index'] = data.reset_index().index
-            columns = data.columns[-2:].tolist() + data.columns[:-2].to_list()
-            data_to_file = data[columns]
-            filename = ''.join([self.experiment_paradigm, self.file_date, self.subject]) + '.csv'
-            if self.operating_system == 'Windows':
-                full_filename = 'C:\\Users\\Public\\Downloads\\' + filename
-            elif self.operating_system == 'Darwin':
-                full_filename = '/Users/Shared/' + filename
-            data_to_file.to_csv(full_filename, sep=',', index=False)
-            data_query = 'COPY signal_data (experiment_id, sample_index, marker, "Fp1", "Fp2", "F3", "F4", "C3", ' \
-                         '"C4", "P3", "P4", "O1", "O2", "A1", "A2", "F7", "F8", "T3", "T4", "T5", "T6", "Fz", "Cz", ' \
-                         '"Pz", "X3") '
-            data_query += 'FROM \'' + full_filename + '\' '
-            data_query += 'DELIMITER \',\' '
-            data_query += 'CSV HEADER;'
-            postgres.execute(sql_query=data_query)
-
-            # delete the temporary csv file
-            try:
-                os.remove(full_filename)
-            except OSError as ex:
-                pass
-        else:
-            # experiment_id already exists, no need to push the data again
-            return True
+        with PostgresConnector(config=self.config) as postgres:
+            postgres.execute_query(sql_query='select pg_advisory_xact_lock(hashtext(%s))',
+                                   parameters=(self.file_name,))
+            experiment_id = self.get_next_experiment_id(postgres=postgres)
+            if experiment_id > 0 and self.artifact_screen is not None:
+                self.screen_data()
+            if experiment_id > 0:
+                experiment_query = 'insert into experiment_information ' \
+                                   '(experiment_id, experiment_date, paradigm, subject_id, states, stimuli, mode) ' \
+                                   'values ' \
+                                   '('
+                experiment_query += str(experiment_id) + ', '
+                experiment_query += 'to_date(\'20' + self.file_date + '\', \'YYYYMMDD\'), '
+                experiment_query += '\'' + self.experiment_paradigm + '\', '
+                experiment_query += '\'' + self.subject + '\', '
+                experiment_query += '\'' + self.states + '\', '
+                experiment_query += '\'' + self.experiment_stimuli + '\', '
+                experiment_query += '\'' + self.experiment_mode + '\')'
+                postgres.execute(sql_query=experiment_query, commit=False)
+
+                # stream the signal arrays from memory into signal_data, in chunks of bounded size
+                columns = ['experiment_id', 'sample_index', 'marker'] + self.ELECTRODE_NAMES_EXPECTED
+                sources = [experiment_id, CopyStream.row_index, self.marker_codes.ravel()]
+                sources += [self.signal_readings[:, i] for i in range(len(self.ELECTRODE_NAMES_EXPECTED))]
+                column_types = postgres.get_column_types(table_name='signal_data')
+                stream = CopyStream(sources=sources, column_types=[column_types[column] for column in columns],
+                                    n_rows=self.signal_readings.shape[0], chunk_rows=self.COPY_CHUNK_ROWS)
+                data_query = 'COPY signal_data (' + ', '.join('"' + column + '"' for column in columns) + ') '
+                data_query += 'FROM STDIN ' + stream.get_copy_options()
+                start_time = time.perf_counter()
+                postgres.copy_from_stream(sql_query=data_query, stream=stream, commit=False)
+                if self.screening is not None:
+                    self.push_screening_to_sql(postgres=postgres, experiment_id=experiment_id)
+                postgres.commit()
+                elapsed = time.perf_counter() - start_time
+                self.experiment_id = experiment_id
+                print('Pushed %d rows for experiment %d in %.2f s (%.0f rows/s, %s COPY)' %
+                      (stream.n_rows, experiment_id, elapsed, stream.n_rows / max(elapsed, 1e-9), stream.copy_format))
+            else:
+                # the recording already exists, no need to push the data again
+                return True
         return True
 
-    def get_next_experiment_id(self) -> int:
+    def screen_data(self) -> dict:
+        """
+        Method to screen the data loaded from file for artifacts and bad channels. With the .mat cache enabled the
+        screening is stored next to the cached recording and read back on later calls.
+        :return: the screening, as returned by ArtifactScreen.screen
+        :rtype: dict
+        """
+        if self.screening is not None:
+            return self.screening
+        filename = os.path.join(self.data_directory, self.file_name)
+        settings = self.config.get('screening_settings', {})
+        if self.mat_cache is not None:
+            self.screening = self.mat_cache.load_screening(filename=filename, settings=settings)
+        if self.screening is None:
+            # a transposed view of the readings, the screen works through it in blocks of windows
+            signal = self.signal_readings[:, :len(self.ELECTRODE_NAMES)].T
+            self.screening = self.artifact_screen.screen(signal=signal, channel_names=self.ELECTRODE_NAMES)
+            if self.mat_cache is not None:
+                self.mat_cache.store_screening(filename=filename, screening=self.screening, settings=settings)
+        return self.screening
+
+    def push_screening_to_sql(self, postgres=None, experiment_id=None):
+        """
+        Method to insert the screening of the loaded data into artifact_screening, one row per experiment, as part
+        of the transaction of the given connector
+        :param postgres: connector whose transaction the screening is inserted in
+        :type postgres: PostgresConnector
+        :param experiment_id: the experiment the screening belongs to
+        :type experiment_id: int
         """
-        Method to check Postgres tables and calculate the next experiment_id tag based on what is already in
-        the database and the file being processed.
+        self.create_screening_table(postgres=postgres)
+        screening = self.screening
+        sql_query = 'insert into ' + self.SCREENING_TABLE + ' ' \
+                    '(experiment_id, window_samples, n_samples, channel_names, flat, noisy, clipped, ' \
+                    'clipped_fraction, bad_windows, peak_to_peak, settings) ' \
+                    'values (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)'
+        parameters = (experiment_id, int(screening['window_samples']), int(screening['n_samples']),
+                      list(screening['channel_names']), np.asarray(screening['flat']).tolist(),
+                      np.asarray(screening['noisy']).tolist(), np.asarray(screening['clipped']).tolist(),
+                      np.asarray(screening['clipped_fraction']).tolist(),
+                      np.asarray(screening['bad_windows']).tolist(), np.asarray(screening['peak_to_peak']).tolist(),
+                      json.dumps(self.config.get('screening_settings', {}), sort_keys=True))
+        postgres.execute(sql_query=sql_query, commit=False, parameters=parameters)
+
+    def create_screening_table(self, postgres=None):
+        """
+        Method to create the artifact_screening table if it does not exist yet. The creation is part of the
+        transaction of the given connector and is serialised with an advisory lock.
+        :param postgres: connector whose transaction the table is created in
+        :type postgres: PostgresConnector
+        """
+        if postgres.has_table(table_name=self.SCREENING_TABLE):
+            return
+        postgres.execute_query(sql_query='select pg_advisory_xact_lock(hashtext(%s))',
+                               parameters=(self.SCREENING_TABLE,))
+        if not postgres.has_table(table_name=self.SCREENING_TABLE):
+            postgres.execute(sql_query='create table ' + self.SCREENING_TABLE + ' ('
+                                       'experiment_id integer primary key, window_samples integer, '
+                                       'n_samples integer, channel_names text[], flat boolean[], noisy boolean[], '
+                                       'clipped boolean[], clipped_fraction real[], bad_windows integer[], '
+                                       'peak_to_peak real[], settings text)', commit=False)
+
+    def load_screening(self, experiment_id=None, postgres=None):
+        """
+        Method to read the screening of an experiment from artifact_screening
+        :param experiment_id: the experiment
+        :type experiment_id: int
+        :param postgres: connector to use, a pooled one is checked out when not given
+        :type postgres: PostgresConnector
+        :return: the screening, as returned by ArtifactScreen.screen, or None when the experiment was not screened
+        :rtype: dict
+        """
+        if postgres is None:
+            with PostgresConnector(config=self.config) as postgres:
+                return self.load_screening(experiment_id=experiment_id, postgres=postgres)
+        if not postgres.has_table(table_name=self.SCREENING_TABLE):
+            return None
+        rows = postgres.execute_query(sql_query='select window_samples, n_samples, channel_names, flat, noisy, '
+                                                'clipped, clipped_fraction, bad_windows, peak_to_peak from ' +
+                                                self.SCREENING_TABLE + ' where experiment_id = %s',
+                                      parameters=(int(experiment_id),))
+        if len(rows) == 0:
+            return None
+        window_samples, n_samples, channel_names, flat, noisy, clipped, clipped_fraction, bad_windows, \
+            peak_to_peak = rows[0]
+        return {'window_samples': window_samples, 'n_samples': n_samples, 'channel_names': channel_names,
+                'peak_to_peak': np.array(peak_to_peak, dtype=np.float32).reshape(-1, len(channel_names)),
+                'flat': np.array(flat, dtype=bool), 'noisy': np.array(noisy, dtype=bool),
+                'clipped': np.array(clipped, dtype=bool),
+                'clipped_fraction': np.array(clipped_fraction, dtype=np.float32),
+                'bad_windows': np.array(bad_windows, dtype=np.int64)}
+
+    def get_experiment_id(self, postgres=None):
+        """
+        Method to look up the experiment_id of the recording being processed
+        :param postgres: connector to use, a pooled one is checked out when not given
+        :type postgres: PostgresConnector
+        :return: the experiment_id, None if the recording is not in the database
+        :rtype: int
+        """
+        if postgres is None:
+            with PostgresConnector(config=self.config) as postgres:
+                return self.get_experiment_id(postgres=postgres)
+        sql_query = 'select experiment_id from experiment_information where paradigm = %s and subject_id = %s ' \
+                    'and experiment_date = to_date(%s, \'YYYYMMDD\') and states = %s and stimuli = %s and mode = %s'
+        rows = postgres.execute_query(sql_query=sql_query,
+                                      parameters=(self.experiment_paradigm, self.subject, '20' + self.file_date,
+                                                  self.states, self.experiment_stimuli, self.experiment_mode))
+        if len(rows) == 0:
+            return None
+        return int(rows[0][0])
+
+    def get_next_experiment_id(self, postgres=None) -> int:
+        """
+        Method to get the experiment_id for the file being processed from the experiment_id_seq sequence, which is
+        created (starting after the largest id in experiment_information) the first time it is needed.
+        :param postgres: connector to use, a pooled one is checked out when not given
+        :type postgres: PostgresConnector
         :return: the experiment_id to use, -1 if already in the database
         :rtype: int
         """
-        postgres = PostgresConnector()
-        sql_query = 'select max(experiment_id) from experiment_information where ' \
-                    'concat(paradigm, to_char(experiment_date, \'YYYYMMDD\')) != \''
-        sql_query += self.experiment_paradigm + '20' + self.file_date + '\''
+        if postgres is None:
+            with PostgresConnector(config=self.config) as postgres:
+                experiment_id = self.get_next_experiment_id(postgres=postgres)
+                postgres.commit()
+                return experiment_id
+        if self.get_experiment_id(postgres=postgres) is not None:
+            return -1
+        self.create_experiment_id_sequence(postgres=postgres)
+        rows = postgres.execute_query(sql_query='select nextval(\'experiment_id_seq\')')
+        return int(rows[0][0])
+
+    def create_experiment_id_sequence(self, postgres=None):
+        """
+        Method to create the experiment_id_seq sequence if it does not exist yet. The creation is part of the
+        transaction of the given connector and is serialised with an advisory lock.
+        :param postgres: connector whose transaction the sequence is created in
+        :type postgres: PostgresConnector
+        """
+        # query pg_class rather than using to_regclass, so that a sequence committed by a concurrent push is seen
+        sql_query = 'select count(*) from pg_class where relname = \'experiment_id_seq\' and relkind = \'S\''
         rows = postgres.execute_query(sql_query=sql_query)
-        # handle null value
-        value = rows[0][0]
-        if value is None:
-            # check whether there are any entries in the table (should only occur once)
-            sql_query = 'select count(*) from experiment_information'
-            rows = postgres.execute_query(sql_query=sql_query)
-            count = int(rows[0][0])
-            if count == 0:
-                value = 0
-            else:
-                return -1
-        else:
-            value = int(value)
-        experiment_id = value + 1
-        return experiment_id
+        if int(rows[0][0]) > 0:
+            return
+        postgres.execute_query(sql_query='select pg_advisory_xact_lock(hashtext(\'experiment_id_seq\'))')
+        rows = postgres.execute_query(sql_query=sql_query)
+        if int(rows[0][0]) == 0:
+            postgres.execute(sql_query='create sequence experiment_id_seq', commit=False)
+            postgres.execute(sql_query='select setval(\'experiment_id_seq\', '
+                                       '(select coalesce(max(experiment_id), 0) + 1 from experiment_information), '
+                                       'false)', commit=False)
+
+    def get_parquet_store(self) -> ParquetStore:
+        """
+        Method to get the local Parquet dataset configured in parquet_settings
+        :return: the Parquet store
+        :rtype: ParquetStore
+        """
+        from Data.ParquetStore import ParquetStore
+        return ParquetStore(directory=self.parquet_directory, compression=self.parquet_compression)
+
+    def push_data_to_parquet(self) -> str:
+        """
+        Method to write the data loaded from file into the local Parquet dataset, partitioned by paradigm, subject
+        and date as parsed from the file name
+        :return: the path of the written Parquet file
+        :rtype: str
+        """
+        if self.data_loaded:
+            experiment = self.file_name.split('.')[0]
+            return self.get_parquet_store().write_recording(data=self.to_polars(), experiment=experiment,
+                                                            paradigm=self.experiment_paradigm, subject=self.subject,
+                                                            file_date=self.file_date)
+
+    def load_data_from_parquet(self, experiment=None, paradigm=None, subject=None, file_date=None, marker=None,
+                               sample_range=None) -> mne.io.RawArray:
+        """
+        Method to load data from the local Parquet dataset into an MNE RawArray. The filters are applied by a lazy
+        polars scan, so only the matching files and row groups are read. When several recordings match, they are
+        returned one after the other, ordered by experiment and sample_index.
+        :param experiment: recording name(s), i.e. the .mat file name without its extension
+        :param paradigm: paradigm(s)
+        :param subject: subject(s)
+        :param file_date: date(s), YYMMDD
+        :param marker: optionally, only load the samples with these marker code(s)
+        :param sample_range: (first, last) sample_index to load, inclusive
+        :type sample_range: tuple
+        :return: raw MNE data array containing the signal data (in V) and the stim channel
+        :rtype: mne.io.RawArray
+        """
+        frame = self.get_parquet_store().scan(experiment=experiment, paradigm=paradigm, subject=subject,
+                                              file_date=file_date, marker=marker, sample_range=sample_range)
+        frame = frame.sort(['experiment', 'sample_index']).select(self.ELECTRODE_NAMES + ['marker']).collect()
+        data = np.empty((len(self.ELECTRODE_NAMES) + 1, frame.height), dtype=np.float64)
+        for i, column in enumerate(self.ELECTRODE_NAMES + ['marker']):
+            data[i] = frame[column].to_numpy()
+        del frame
+        # convert units from uV to V (expected by MNE)
+        data[:-1] *= 1.0e-6
+        raw = mne.io.RawArray(data=data, info=self.create_mne_info())
+        self.data_raw_mne = raw
+        return raw
+
+    def to_arrow(self) -> pa.Table:
+        """
+        Method to wrap the marker and signal arrays loaded from file in an Arrow table. The columns reference the
+        loaded (or memory-mapped) arrays directly, so no data are copied as long as each electrode is stored
+        contiguously, which is the case for the column-major arrays produced by loadmat and the .mat cache.
+        :return: table with the marker column followed by one column per electrode
+        :rtype: pyarrow Table
+        """
+        if self.data_loaded:
+            if 'arrow' not in self.file_conversions:
+                import pyarrow as pa
+                columns = [pa.array(np.ravel(self.marker_codes))]
+                columns += [pa.array(self.signal_readings[:, i]) for i in range(self.signal_readings.shape[1])]
+                self.file_conversions['arrow'] = pa.table(columns, names=['marker'] + self.ELECTRODE_NAMES_EXPECTED)
+            return self.file_conversions['arrow']
 
     def to_pandas(self) -> pd.DataFrame:
         """
-        Method to convert the data into a Pandas DataFrame
+        Method to convert the data into a Pandas DataFrame with Arrow-backed columns that share memory with the
+        loaded arrays. The frame is created once per loaded file and returned on later calls.
         :return: DataFrame containing the data, including markers
         :rtype: pandas DataFrame
         """
         if self.data_loaded:
-            markers_df = pd.DataFrame(self.marker_codes)
-            readings_df = pd.DataFrame(self.signal_readings)
-            electrodes_df = pd.DataFrame(self.electrode_names_raw)
-            dataframe = pd.concat([markers_df, readings_df], axis=1)
-            headers = ['marker'] + self.ELECTRODE_NAMES_EXPECTED
-            dataframe.columns = headers
-            self.data_pandas = dataframe
-            return dataframe
+            if 'pandas' not in self.file_conversions:
+                import pandas as pd
+                self.file_conversions['pandas'] = self.to_arrow().to_pandas(types_mapper=pd.ArrowDtype)
+            self.data_pandas = self.file_conversions['pandas']
+            return self.data_pandas
 
     def to_polars(self) -> pl.DataFrame:
         """
-        Method to convert the data into a Polars DataFrame
+        Method to convert the data into a Polars DataFrame that shares memory with the loaded arrays. The frame is
+        created once per loaded file and returned on later calls.
         :return: DataFrame containing the data, including markers
         :rtype: polars DataFrame
         """
         if self.data_loaded:
-            markers_df = pl.DataFrame(self.marker_codes)
-            markers_df.columns = ['marker']
-            readings_df = pl.DataFrame(self.signal_readings)
-            electrodes_df = pl.DataFrame(self.ELECTRODE_NAMES)
-            dataframe = pl.concat([markers_df, readings_df], how='horizontal')
-            headers = ['marker'] + self.ELECTRODE_NAMES_EXPECTED
-            dataframe.columns = headers
-            self.data_polars = dataframe
-            return dataframe
+            if 'polars' not in self.file_conversions:
+                import polars as pl
+                self.file_conversions['polars'] = pl.from_arrow(self.to_arrow(), rechunk=False)
+            self.data_polars = self.file_conversions['polars']
+            return self.data_polars
 
     def to_mne_raw(self) -> mne.io.RawArray:
         """
-        Method to convert the data into an MNE RawArray, with all relevant meta information
+        Method to convert the data into an MNE RawArray, with all relevant meta information. The electrodes are
+        scaled from uV to V (expected by MNE) in one vectorized operation into a single contiguous array, which
+        backs the RawArray directly. The RawArray is created once per loaded file and returned on later calls.
         :return: raw MNE data array containing the signal data, the info data and electrode montage
         :rtype: mne.io.RawArray
         """
-        data = self.to_pandas()
-        # convert units from uV to V (expected by MNE)
-        for electrode in self.ELECTRODE_NAMES:
-            data[electrode] = data[electrode] / 1.0e6
-        info = self.create_mne_info()
-        raw = mne.io.RawArray(data=data[self.ELECTRODE_NAMES + ['STI001']].transpose(), info=info)
-        self.data_raw_mne = raw
-        return raw
+        if self.data_loaded:
+            if 'mne' not in self.file_conversions:
+                n_electrodes = len(self.ELECTRODE_NAMES)
+                data = np.empty((n_electrodes + 1, self.signal_readings.shape[0]), dtype=np.float64)
+                np.multiply(self.signal_readings[:, :n_electrodes].T, 1.0e-6, out=data[:-1])
+                data[-1] = np.ravel(self.marker_codes)
+                self.file_conversions['mne'] = mne.io.RawArray(data=data, info=self.create_mne_info())
+                if self.artifact_screen is not None:
+                    ArtifactScreen.apply(raw=self.file_conversions['mne'], screening=self.screen_data())
+            self.data_raw_mne = self.file_conversions['mne']
+            return self.data_raw_mne
 
     def create_mne_info(self) -> mne.Info:
         """
@@ -279,7 +762,7 @@ class DataLoader(object):
         :rtype: mne.Info
         """
         # prepare data for the "info" object
-        sample_freq = 200
+        sample_freq = self.SAMPLE_FREQUENCY
         channel_types = ['eeg'] * 21 + ['stim']
         info = mne.create_info(ch_names=self.ELECTRODE_NAMES + ['STI001'], sfreq=sample_freq, ch_types=channel_types)
         info.set_montage('standard_1020')
@@ -292,6 +775,39 @@ class DataLoader(object):
         # info['line_freq'], info['temp']
         return info
 
+    def create_epochs(self, raw_mne=None, reject_by_annotation=True) -> EpochWindows:
+        """
+        Method to epoch the EEG channels around the events of the marker channel without copying the data, with the
+        t_min and t_max of epochs_settings
+        :param raw_mne: the raw data, by default the data loaded last
+        :type raw_mne: mne.io.RawArray
+        :param reject_by_annotation: True to drop the epochs that overlap a bad annotation (e.g. the BAD_artifact
+            segments of the screening), as mne.Epochs does
+        :type reject_by_annotation: bool
+        :return: the epochs, as views into the raw data, with their labels; to_epochs_array() converts them to the
+            epochs of create_mne_epochs
+        :rtype: EpochWindows
+        """
+        if raw_mne is None:
+            raw_mne = self.data_raw_mne
+        markers = raw_mne._data[raw_mne.ch_names.index('STI001')]
+        events = EpochExtractor.find_events(markers=markers)
+        event_dict = self.create_event_dict_from_events(events=events)
+        extractor = EpochExtractor.from_config(config=self.config, sfreq=raw_mne.info['sfreq'], event_id=event_dict)
+        picks = mne.pick_types(raw_mne.info, meg=False, eeg=True, stim=False, eog=False, exclude='bads')
+        # the EEG channels come first, so they can be picked with a slice that keeps the epochs views
+        if len(picks) > 0 and np.array_equal(picks, np.arange(picks[0], picks[-1] + 1)):
+            picks = slice(picks[0], picks[-1] + 1)
+        bad_segments = None
+        if reject_by_annotation:
+            # annotation onsets are relative to the first sample of the recording, as in mne.Epochs
+            annotations = raw_mne.annotations
+            bad = np.array([description.lower().startswith('bad') for description in annotations.description],
+                           dtype=bool)
+            onsets = (annotations.onset[bad] - raw_mne.first_time) * raw_mne.info['sfreq']
+            bad_segments = np.column_stack([onsets, onsets + annotations.duration[bad] * raw_mne.info['sfreq']])
+        return extractor.extract(data=raw_mne._data, markers=markers, picks=picks, bad_segments=bad_segments)
+
     def create_mne_epochs(self, raw_mne) -> mne.Epochs:
         """
         Method to create MNE epochs array from scratch
@@ -301,8 +817,8 @@ class DataLoader(object):
         events = mne.find_events(raw_mne, stim_channel='STI001')
         picks = mne.pick_types(raw_mne.info, meg=False, eeg=True, stim=False, eog=False, exclude='bads')
         event_dict= self.create_event_dict_from_events(events=events)
-        t_min = dl.config['epochs_settings']['t_min']
-        t_max = dl.config['epochs_settings']['t_max']
+        t_min = self.config['epochs_settings']['t_min']
+        t_max = self.config['epochs_settings']['t_max']
         epochs = mne.Epochs(raw=raw_mne, events=events, tmin=t_min, tmax=t_max, event_id=event_dict, preload=True,
                             picks=picks)
         return epochs
@@ -323,6 +839,21 @@ class DataLoader(object):
 
 
 if __name__ == '__main__':
+    # imports for preprocessing and classification testing
+    from mne.decoding import CSP
+    from mne.preprocessing import ICA
+    from mne.decoding import UnsupervisedSpatialFilter
+
+    from Preprocessing.CSP.CovarianceCSP import CovarianceCSP
+    from Preprocessing.CSP.SlidingWindowCSP import SlidingWindowCSP
+    from Preprocessing.Filters.Filter import Filter
+    from sklearn.decomposition import PCA, FastICA
+
+    if platform.system() == 'Darwin':
+        import matplotlib as mpl
+        import matplotlib.pyplot as plt
+        mpl.use('macosx')
+
     if platform.system() == 'Windows':
         # for Steven
         filename = 'C:\\Users\\saspr\\source\\Python\\Tegan\\BCI\\Utilities\\Config\\config_steven.json'
@@ -352,14 +883,11 @@ if __name__ == '__main__':
     if do_plots:
         raw_mne.plot(events=events, color='gray', event_color=dl.CLA_HALT_FREEFORM_EVENT_COLORS, scalings='auto')
 
-    # try some filtering
-    raw_filter = raw_mne.copy()
-    low_pass_frequency = dl.config['filter_settings']['low_pass_frequency']
-    high_pass_frequency = dl.config['filter_settings']['high_pass_frequency']
-    if high_pass_frequency == 0:
-        high_pass_frequency = None
-    raw_filter.filter(low_pass_frequency, high_pass_frequency, fir_design='firwin', skip_by_annotation='edge',
-                      picks='eeg')
+    # try some filtering, reusing the filtered recording from the stage cache when the settings did not change
+    data_filter = Filter(config=dl.config, data_loader=dl)
+    data_filter.set_data(data=raw_mne, experiment_id=dl.config['data']['experiment_id'],
+                         provenance=dl.data_provenance)
+    raw_filter = data_filter.filter()
 
     # other data format tests to run:
     # raw_mne_file = dl.to_mne_raw()
@@ -387,18 +915,29 @@ if __name__ == '__main__':
                                                  tmax=dl.config['CSP_settings']['t_max'])
         labels = epochs_to_use.events[:, -1] - 1
 
-        # define a monte-carlo cross-validation generator (reduce variance):
         epochs_data_train = epochs_train.get_data()
-        cv = ShuffleSplit(10, test_size=0.2, random_state=42)
-        cv_split = cv.split(epochs_data_train)
 
-        # assemble a classifier
-        lda = LinearDiscriminantAnalysis()
-        csp = CSP(n_components=dl.config['CSP_settings']['num_components'], reg=None, log=True, norm_trace=False)
-
-        # use scikit-learn Pipeline with cross_val_score function
-        clf = Pipeline([('CSP', csp), ('LDA', lda)])
-        scores = cross_val_score(clf, epochs_data_train, labels, cv=cv, n_jobs=1)
+        # per-epoch covariance matrices of the training time range, computed once per experiment and settings and
+        # shared by every fold; the filtered recording they come from (its provenance, with the ingest version of
+        # the data) is part of the key, and they are not cached when that provenance is unknown
+        moments_settings = {'filter_settings': dl.config['filter_settings'], 't_min': t_min, 't_max': t_max,
+                            'csp_t_min': dl.config['CSP_settings']['t_min'],
+                            'csp_t_max': dl.config['CSP_settings']['t_max'],
+                            'screening_settings': dl.config.get('screening_settings', {}),
+                            'source': data_filter.output_provenance}
+        moments_experiment_id = None if data_filter.output_provenance is None else dl.config['data']['experiment_id']
+        arrays, _ = dl.get_stage(experiment_id=moments_experiment_id, stage='csp_moments',
+                                 settings=moments_settings,
+                                 compute=lambda: ({'moments': CovarianceCSP.compute_moments(epochs_data_train)}, {}))
+        moments = arrays['moments']
+
+        # monte-carlo cross-validation (reduce variance) of CSP + LDA on the training time range, and in the same
+        # folds (run in parallel) the running classifier: the fold classifier tested on a sliding window
+        sfreq = raw_mne.info['sfreq']
+        sliding_window_csp = SlidingWindowCSP.from_config(config=dl.config, sfreq=sfreq)
+        scores_windows = sliding_window_csp.score(epochs_data_train=epochs_data_train, epochs_data=epochs_data,
+                                                  labels=labels, moments=moments)
+        scores = sliding_window_csp.scores
 
         # printing the results
         class_balance = np.mean(labels == labels[0])
@@ -407,33 +946,12 @@ if __name__ == '__main__':
 
         # plot CSP patterns estimated on full data for visualization
         if do_plots:
+            csp = CSP(n_components=dl.config['CSP_settings']['num_components'], reg=None, log=True, norm_trace=False)
             csp.fit_transform(epochs_data, labels)
             csp.plot_patterns(epochs.info, ch_type='eeg', units='Patterns (AU)', size=1.5)
 
-        sfreq = raw_mne.info['sfreq']
-        w_length = int(sfreq * 0.5)     # running classifier: window length
-        w_step = int(sfreq * 0.1)       # running classifier: window step size
-        w_start = np.arange(0, epochs_data.shape[2] - w_length, w_step)
-
-        scores_windows = []
-        for train_idx, test_idx in cv_split:
-            y_train, y_test = labels[train_idx], labels[test_idx]
-
-            X_train = csp.fit_transform(epochs_data_train[train_idx], y_train)
-            X_test = csp.transform(epochs_data_train[test_idx])
-
-            # fit classifier
-            lda.fit(X_train, y_train)
-
-            # running classifier: test classifier on sliding window
-            score_this_window = []
-            for n in w_start:
-                X_test = csp.transform(epochs_data[test_idx][:, :, n:(n + w_length)])
-                score_this_window.append(lda.score(X_test, y_test))
-            scores_windows.append(score_this_window)
-
         # plot scores over time
-        w_times = (w_start + w_length / 2.) / sfreq + epochs.tmin
+        w_times = sliding_window_csp.get_window_times(sfreq=sfreq, t_min=epochs.tmin)
 
         if do_plots:
             plt.figure()
@@ -485,4 +1003,8 @@ if __name__ == '__main__':
             ica.plot_properties(raw_filter, picks=range(num_components))
             ica.plot_overlay(raw_filter)
 
+    if dl.stage_cache is not None:
+        print('Stage cache: %(hits)d hits, %(misses)d misses, %(entries)d entries, %(bytes)d bytes' %
+              dl.stage_cache.get_stats())
+
     print("Finished.")
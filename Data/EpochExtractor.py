@@ -0,0 +1,214 @@
+from numpy.lib.stride_tricks import as_strided
+import numpy as np
+
+
+class EpochExtractor(object):
+    """
+    Epoching directly from the marker channel, without copying the signal. Onsets are found with a vectorised diff
+    of the marker vector, following mne.find_events (an onset is a rise of the marker value, and an onset without a
+    following offset at the end of the recording is dropped). The epochs are windows over the (n_channels, n_samples)
+    signal array, so extracting them costs no memory: one view per epoch, and a single (n_epochs, n_channels, n_times)
+    strided view when the onsets are evenly spaced.
+    """
+    # class level fields
+    sfreq = None
+    t_min = None
+    t_max = None
+    event_id = None
+    first_offset = None
+    n_times = None
+
+    def __init__(self, sfreq=None, t_min=None, t_max=None, event_id=None):
+        """
+        Constructor for the epoch extractor
+        :param sfreq: sampling frequency in Hz
+        :type sfreq: float
+        :param t_min: start of the epochs relative to the onsets, in s
+        :type t_min: float
+        :param t_max: end of the epochs relative to the onsets, in s (inclusive, as in MNE)
+        :type t_max: float
+        :param event_id: event name to marker code of the events to keep, None for every event
+        :type event_id: dict
+        """
+        self.sfreq = float(sfreq)
+        self.t_min = t_min
+        self.t_max = t_max
+        self.event_id = event_id
+        # same sample rounding as mne.Epochs
+        self.first_offset = int(round(t_min * self.sfreq))
+        self.n_times = int(round(t_max * self.sfreq)) - self.first_offset + 1
+
+    @classmethod
+    def from_config(cls, config=None, sfreq=None, event_id=None):
+        """
+        Method to create the epoch extractor from the epochs_settings section of the config
+        :param config: the config settings
+        :type config: dict
+        :param sfreq: sampling frequency in Hz
+        :type sfreq: float
+        :param event_id: event name to marker code of the events to keep
+        :type event_id: dict
+        :return: the epoch extractor
+        :rtype: EpochExtractor
+        """
+        return cls(sfreq=sfreq, t_min=config['epochs_settings']['t_min'], t_max=config['epochs_settings']['t_max'],
+                   event_id=event_id)
+
+    @staticmethod
+    def find_events(markers=None) -> np.ndarray:
+        """
+        Method to find the events in a marker vector, like mne.find_events with its default settings
+        :param markers: (n_samples,) marker codes
+        :type markers: numpy.ndarray
+        :return: (n_events, 3) MNE events array: onset sample, previous marker code, marker code
+        :rtype: numpy.ndarray
+        """
+        markers = np.asarray(markers).ravel()
+        changes = np.flatnonzero(markers[1:] != markers[:-1]) + 1
+        previous = markers[changes - 1]
+        codes = markers[changes]
+        onsets = codes > previous
+        offsets = (onsets | (codes == 0)) & (previous > 0)
+        onset_index = np.flatnonzero(onsets)
+        offset_index = np.flatnonzero(offsets)
+        if len(onset_index) == 0 or len(offset_index) == 0:
+            return np.empty((0, 3), dtype=np.int64)
+        if onset_index[-1] > offset_index[-1]:
+            # orphaned onset at the end of the recording
+            onset_index = onset_index[:-1]
+        return np.column_stack([changes[onset_index], previous[onset_index], codes[onset_index]]).astype(np.int64)
+
+    def extract(self, data=None, markers=None, picks=None, bad_segments=None):
+        """
+        Method to epoch a signal array around the events of its marker vector
+        :param data: (n_channels, n_samples) signal array, e.g. RawArray._data
+        :type data: numpy.ndarray
+        :param markers: (n_samples,) marker codes, by default the last row of data
+        :type markers: numpy.ndarray
+        :param picks: channels to keep, as a slice to keep the epochs views (a list of channels copies the data)
+        :type picks: slice
+        :param bad_segments: optionally, (n_segments, 2) start and end of the bad segments, in (fractional) samples
+            of data; the epochs that overlap one are dropped, as by mne.Epochs(reject_by_annotation=True)
+        :type bad_segments: numpy.ndarray
+        :return: the epochs
+        :rtype: EpochWindows
+        """
+        if markers is None:
+            markers = data[-1]
+        if picks is not None:
+            data = data[picks]
+        events = self.find_events(markers=markers)
+        if self.event_id is not None:
+            events = events[np.isin(events[:, 2], list(self.event_id.values()))]
+        # drop the epochs that do not fit in the recording, as mne.Epochs does
+        starts = events[:, 0] + self.first_offset
+        inside = (starts >= 0) & (starts + self.n_times <= data.shape[1])
+        if bad_segments is not None and len(bad_segments) > 0:
+            bad_segments = np.asarray(bad_segments, dtype=np.float64)
+            overlaps = (bad_segments[np.newaxis, :, 0] < (starts + self.n_times)[:, np.newaxis]) & \
+                       (bad_segments[np.newaxis, :, 1] > starts[:, np.newaxis])
+            inside &= ~overlaps.any(axis=1)
+        return EpochWindows(data=data, events=events[inside], starts=starts[inside], n_times=self.n_times,
+                            sfreq=self.sfreq, t_min=self.first_offset / self.sfreq, event_id=self.event_id)
+
+
+class EpochWindows(object):
+    """
+    Epochs as views into a signal array. Indexing with an integer returns the (n_channels, n_times) view of one
+    epoch; get_data() returns all epochs as an (n_epochs, n_channels, n_times) array, which is a view when the
+    onsets are evenly spaced.
+    """
+    # class level fields
+    data = None
+    events = None
+    starts = None
+    labels = None
+    n_times = None
+    sfreq = None
+    t_min = None
+    event_id = None
+
+    def __init__(self, data=None, events=None, starts=None, n_times=None, sfreq=None, t_min=None, event_id=None):
+        """
+        Constructor for the epoch views, normally called by EpochExtractor.extract
+        :param data: (n_channels, n_samples) signal array
+        :type data: numpy.ndarray
+        :param events: (n_epochs, 3) MNE events array of the epochs
+        :type events: numpy.ndarray
+        :param starts: first sample of each epoch
+        :type starts: numpy.ndarray
+        :param n_times: number of samples of each epoch
+        :type n_times: int
+        :param sfreq: sampling frequency in Hz
+        :type sfreq: float
+        :param t_min: time of the first sample of each epoch relative to its onset, in s
+        :type t_min: float
+        :param event_id: event name to marker code
+        :type event_id: dict
+        """
+        self.data = data
+        self.events = events
+        self.starts = starts
+        self.labels = events[:, 2]
+        self.n_times = n_times
+        self.sfreq = sfreq
+        self.t_min = t_min
+        self.event_id = event_id
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __getitem__(self, index) -> np.ndarray:
+        start = self.starts[index]
+        return self.data[:, start:start + self.n_times]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    @property
+    def shape(self) -> tuple:
+        return len(self), self.data.shape[0], self.n_times
+
+    def is_regular(self) -> bool:
+        """
+        Method to check whether the epochs can be represented as a single strided view
+        :return: True when the onsets are evenly spaced (or there are fewer than two epochs)
+        :rtype: bool
+        """
+        return len(self) < 2 or bool(np.all(np.diff(self.starts) == self.starts[1] - self.starts[0]))
+
+    def get_data(self) -> np.ndarray:
+        """
+        Method to get the epochs as one array. When the onsets are evenly spaced this is a read-only strided view
+        into the signal array; otherwise the epoch views are gathered into a new array.
+        :return: (n_epochs, n_channels, n_times) epochs
+        :rtype: numpy.ndarray
+        """
+        if len(self) == 0:
+            return np.empty(self.shape, dtype=self.data.dtype)
+        if self.is_regular():
+            step = int(self.starts[1] - self.starts[0]) if len(self) > 1 else 0
+            first = self.data[:, self.starts[0]:]
+            return as_strided(first, shape=self.shape,
+                              strides=(step * first.strides[1], first.strides[0], first.strides[1]), writeable=False)
+        return np.stack(list(self))
+
+    def to_epochs_array(self, info=None, baseline=(None, 0)):
+        """
+        Method to convert the epochs to an MNE EpochsArray, for the MNE features that need one (this copies the data)
+        :param info: MNE info of the picked channels
+        :type info: mne.Info
+        :param baseline: baseline correction as in mne.Epochs, None for no correction
+        :type baseline: tuple
+        :return: the epochs, equivalent to mne.Epochs(preload=True) with the same events and settings
+        :rtype: mne.EpochsArray
+        """
+        import mne
+        event_id = self.event_id
+        if event_id is None:
+            event_id = {str(code): int(code) for code in np.unique(self.labels)}
+        else:
+            event_id = {name: code for name, code in event_id.items() if code in self.labels}
+        return mne.EpochsArray(np.ascontiguousarray(self.get_data()), info, events=self.events.copy(),
+                               tmin=self.t_min, event_id=event_id, baseline=baseline, verbose=False)
@@ -0,0 +1,187 @@
+import numpy as np
+import hashlib
+import json
+import os
+
+
+class MatCache(object):
+    """
+    Cache that converts MATLAB recordings once into a memory-mapped binary layout. Each recording is stored as
+    a (n_samples, 22) signal block, a marker vector and a small json metadata sidecar. Entries are keyed by the
+    full path of the .mat file and are validated against its size and modification time, so a changed file is
+    converted again on the next load.
+    """
+    # class level constants
+    CACHE_VERSION = 1
+    SIGNAL_SUFFIX = '.signal.npy'
+    MARKERS_SUFFIX = '.markers.npy'
+    META_SUFFIX = '.json'
+    SCREENING_SUFFIX = '.screening.npz'
+
+    # class level fields
+    cache_directory = None
+
+    def __init__(self, cache_directory=None):
+        """
+        Constructor for the .mat file cache
+        :param cache_directory: directory where the converted recordings are stored
+        :type cache_directory: str
+        """
+        self.cache_directory = cache_directory
+        os.makedirs(self.cache_directory, exist_ok=True)
+
+    @staticmethod
+    def read_mat_file(filename=None) -> tuple:
+        """
+        Method to parse a recording with scipy and unpack the marker, signal and electrode name arrays
+        :param filename: full path of the .mat file
+        :type filename: str
+        :return: marker codes, signal readings and raw electrode names
+        :rtype: tuple
+        """
+        from scipy.io import loadmat
+        rd = loadmat(filename)
+        raw_data = rd['o']
+        marker_codes = raw_data[0][0][4]
+        signal_readings = raw_data[0][0][5]
+        electrode_names_raw = raw_data[0][0][6]
+        return marker_codes, signal_readings, electrode_names_raw
+
+    def get_key(self, filename=None) -> str:
+        """
+        Method to compute the cache key of a recording from its absolute path
+        :param filename: full path of the .mat file
+        :type filename: str
+        :return: hex digest used as the base name of the cache entry
+        :rtype: str
+        """
+        return hashlib.sha1(os.path.abspath(filename).encode('utf-8')).hexdigest()
+
+    def load(self, filename=None):
+        """
+        Method to open a cached recording as read-only memory maps, without copying the data
+        :param filename: full path of the .mat file
+        :type filename: str
+        :return: marker codes, signal readings and electrode names, or None when the entry is missing or stale
+        :rtype: tuple
+        """
+        base = os.path.join(self.cache_directory, self.get_key(filename=filename))
+        try:
+            with open(base + self.META_SUFFIX, 'r') as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        stat = os.stat(filename)
+        if meta.get('version') != self.CACHE_VERSION or meta.get('source') != os.path.abspath(filename) or \
+                meta.get('size') != stat.st_size or meta.get('mtime_ns') != stat.st_mtime_ns:
+            return None
+        try:
+            marker_codes = np.load(base + self.MARKERS_SUFFIX, mmap_mode='r')
+            signal_readings = np.load(base + self.SIGNAL_SUFFIX, mmap_mode='r')
+        except (FileNotFoundError, ValueError):
+            return None
+        if signal_readings.shape != tuple(meta['signal_shape']):
+            return None
+        return marker_codes, signal_readings, np.array(meta['electrode_names'], dtype=object)
+
+    def store(self, filename=None, marker_codes=None, signal_readings=None, electrode_names_raw=None):
+        """
+        Method to write a recording into the cache. The arrays are written first and the metadata sidecar last,
+        each through a temporary file, so an interrupted write never leaves an entry that validates.
+        :param filename: full path of the .mat file the arrays were read from
+        :type filename: str
+        :param marker_codes: (n_samples, 1) marker vector
+        :type marker_codes: numpy.ndarray
+        :param signal_readings: (n_samples, 22) signal block
+        :type signal_readings: numpy.ndarray
+        :param electrode_names_raw: electrode name cell array as returned by loadmat
+        :type electrode_names_raw: numpy.ndarray
+        """
+        stat = os.stat(filename)
+        base = os.path.join(self.cache_directory, self.get_key(filename=filename))
+        # keep the signal block column-major (as MATLAB stores it) so each electrode is contiguous on disk
+        self._write_array(base + self.MARKERS_SUFFIX, np.asfortranarray(marker_codes))
+        self._write_array(base + self.SIGNAL_SUFFIX, np.asfortranarray(signal_readings))
+        electrode_names = [str(np.asarray(name).ravel()[0]) for name in np.asarray(electrode_names_raw).ravel()]
+        meta = {'version': self.CACHE_VERSION,
+                'source': os.path.abspath(filename),
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'signal_shape': list(signal_readings.shape),
+                'electrode_names': electrode_names}
+        temp_name = base + self.META_SUFFIX + '.tmp'
+        with open(temp_name, 'w') as f:
+            json.dump(meta, f)
+        os.replace(temp_name, base + self.META_SUFFIX)
+
+    def load_or_convert(self, filename=None) -> tuple:
+        """
+        Method to load a recording from the cache, falling back to loadmat (and refreshing the cache) when the
+        entry is missing or stale
+        :param filename: full path of the .mat file
+        :type filename: str
+        :return: marker codes, signal readings and electrode names
+        :rtype: tuple
+        """
+        cached = self.load(filename=filename)
+        if cached is not None:
+            return cached
+        marker_codes, signal_readings, electrode_names_raw = self.read_mat_file(filename=filename)
+        self.store(filename=filename, marker_codes=marker_codes, signal_readings=signal_readings,
+                   electrode_names_raw=electrode_names_raw)
+        cached = self.load(filename=filename)
+        if cached is None:
+            # the source changed while it was being converted, use what was parsed
+            return marker_codes, signal_readings, electrode_names_raw
+        return cached
+
+    def load_screening(self, filename=None, settings=None):
+        """
+        Method to read the artifact screening stored next to a cached recording
+        :param filename: full path of the .mat file
+        :type filename: str
+        :param settings: the screening settings, a screening computed with other settings is not returned
+        :type settings: dict
+        :return: the screening, as returned by ArtifactScreen.screen, or None when it is missing or stale
+        :rtype: dict
+        """
+        base = os.path.join(self.cache_directory, self.get_key(filename=filename))
+        try:
+            with np.load(base + self.SCREENING_SUFFIX, allow_pickle=False) as archive:
+                screening = {name: archive[name] for name in archive.files}
+        except (FileNotFoundError, ValueError):
+            return None
+        stat = os.stat(filename)
+        if int(screening.pop('size')) != stat.st_size or int(screening.pop('mtime_ns')) != stat.st_mtime_ns or \
+                str(screening.pop('settings')) != json.dumps(settings, sort_keys=True):
+            return None
+        screening['window_samples'] = int(screening['window_samples'])
+        screening['n_samples'] = int(screening['n_samples'])
+        screening['channel_names'] = screening['channel_names'].tolist()
+        return screening
+
+    def store_screening(self, filename=None, screening=None, settings=None):
+        """
+        Method to store the artifact screening of a recording next to its cache entry, validated like the entry
+        against the size and modification time of the .mat file
+        :param filename: full path of the .mat file
+        :type filename: str
+        :param screening: the screening, as returned by ArtifactScreen.screen
+        :type screening: dict
+        :param settings: the screening settings the screening was computed with
+        :type settings: dict
+        """
+        stat = os.stat(filename)
+        base = os.path.join(self.cache_directory, self.get_key(filename=filename))
+        temp_name = base + self.SCREENING_SUFFIX + '.tmp'
+        with open(temp_name, 'wb') as f:
+            np.savez(f, size=stat.st_size, mtime_ns=stat.st_mtime_ns, settings=json.dumps(settings, sort_keys=True),
+                     **screening)
+        os.replace(temp_name, base + self.SCREENING_SUFFIX)
+
+    @staticmethod
+    def _write_array(path, array):
+        temp_name = path + '.tmp'
+        with open(temp_name, 'wb') as f:
+            np.save(f, array)
+        os.replace(temp_name, path)
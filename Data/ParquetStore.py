@@ -0,0 +1,106 @@
+import polars as pl
+import os
+
+
+class ParquetStore(object):
+    """
+    Local columnar dataset of recordings, as an alternative to the signal_data table in Postgres. Each recording is
+    a compressed Parquet file in a hive-style partition directory, paradigm=<paradigm>/subject=<subject>/date=<date>,
+    with one row per sample. Reads go through polars lazy scans, so filters on the partition columns prune whole
+    files and filters on experiment, marker or sample_index are pushed down to the Parquet row groups.
+    """
+    # class level constants
+    PARTITION_SCHEMA = {'paradigm': pl.String, 'subject': pl.String, 'date': pl.String}
+    ROW_GROUP_SIZE = 100000
+
+    # class level fields
+    directory = None
+    compression = None
+
+    def __init__(self, directory=None, compression='zstd'):
+        """
+        Constructor for the Parquet store
+        :param directory: root directory of the dataset
+        :type directory: str
+        :param compression: Parquet compression codec, e.g. zstd, lz4 or snappy
+        :type compression: str
+        """
+        self.directory = directory
+        self.compression = compression
+        os.makedirs(self.directory, exist_ok=True)
+
+    def get_partition_directory(self, paradigm=None, subject=None, file_date=None) -> str:
+        """
+        Method to form the partition directory of a recording
+        :param paradigm: e.g. CLA, HaLT, 5F
+        :type paradigm: str
+        :param subject: e.g. A
+        :type subject: str
+        :param file_date: YYMMDD
+        :type file_date: str
+        :return: the directory the recording file is written to
+        :rtype: str
+        """
+        return os.path.join(self.directory, 'paradigm=' + paradigm, 'subject=' + subject, 'date=' + file_date)
+
+    def write_recording(self, data=None, experiment=None, paradigm=None, subject=None, file_date=None) -> str:
+        """
+        Method to write a recording into its partition, replacing any earlier version of it
+        :param data: one row per sample, with a marker column and one column per electrode
+        :type data: polars DataFrame
+        :param experiment: name of the recording, e.g. the .mat file name without its extension
+        :type experiment: str
+        :param paradigm: e.g. CLA, HaLT, 5F
+        :type paradigm: str
+        :param subject: e.g. A
+        :type subject: str
+        :param file_date: YYMMDD
+        :type file_date: str
+        :return: the path of the written file
+        :rtype: str
+        """
+        directory = self.get_partition_directory(paradigm=paradigm, subject=subject, file_date=file_date)
+        os.makedirs(directory, exist_ok=True)
+        data = data.with_columns(pl.lit(experiment).alias('experiment'),
+                                 pl.int_range(0, data.height, dtype=pl.Int64).alias('sample_index'))
+        file_name = os.path.join(directory, experiment + '.parquet')
+        temp_name = file_name + '.tmp'
+        data.write_parquet(temp_name, compression=self.compression, statistics=True,
+                           row_group_size=self.ROW_GROUP_SIZE)
+        os.replace(temp_name, file_name)
+        return file_name
+
+    def scan(self, experiment=None, paradigm=None, subject=None, file_date=None, marker=None,
+             sample_range=None) -> pl.LazyFrame:
+        """
+        Method to lazily scan the dataset with optional filters. Every argument accepts a single value or a list.
+        :param experiment: recording name(s)
+        :param paradigm: paradigm(s)
+        :param subject: subject(s)
+        :param file_date: date(s), YYMMDD
+        :param marker: marker code(s)
+        :param sample_range: (first, last) sample_index, inclusive
+        :type sample_range: tuple
+        :return: lazy frame with the partition columns, experiment, sample_index, marker and the electrodes
+        :rtype: polars LazyFrame
+        """
+        frame = pl.scan_parquet(os.path.join(self.directory, '**', '*.parquet'), hive_partitioning=True,
+                                hive_schema=self.PARTITION_SCHEMA)
+        for column, values in [('experiment', experiment), ('paradigm', paradigm), ('subject', subject),
+                               ('date', file_date), ('marker', marker)]:
+            if values is not None:
+                if not isinstance(values, (list, tuple)):
+                    values = [values]
+                frame = frame.filter(pl.col(column).is_in(list(values)))
+        if sample_range is not None:
+            frame = frame.filter(pl.col('sample_index').is_between(sample_range[0], sample_range[1]))
+        return frame
+
+    def list_recordings(self) -> pl.DataFrame:
+        """
+        Method to list the recordings in the dataset with their partition values and number of samples
+        :return: one row per recording
+        :rtype: polars DataFrame
+        """
+        return self.scan().group_by(['paradigm', 'subject', 'date', 'experiment']) \
+            .agg(pl.len().alias('n_samples')).sort(['paradigm', 'subject', 'date', 'experiment']).collect()
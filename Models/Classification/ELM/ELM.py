@@ -0,0 +1,163 @@
+from sklearn.base import BaseEstimator, ClassifierMixin
+from sklearn.utils.validation import check_is_fitted
+from scipy.linalg import cho_factor, cho_solve
+from scipy.special import expit
+import numpy as np
+
+
+class ELM(BaseEstimator, ClassifierMixin):
+    """
+    Extreme Learning Machine classifier: a single hidden layer with random, fixed input weights and biases, and output
+    weights solved in closed form by ridge regression of the one-hot (+1/-1) targets on the hidden activations. The
+    hidden layer of all trials is one matrix product and the solve is a Cholesky factorisation of the
+    (n_hidden, n_hidden) regularised Gram matrix, so fitting takes milliseconds for a few hundred trials.
+    partial_fit is the online sequential ELM (OS-ELM): it keeps the inverse P of the regularised Gram matrix and
+    updates P and the output weights with a rank-k (Woodbury) update for each batch of k new trials, which gives the
+    same output weights as refitting on every trial seen so far. The features are standardised with the mean and
+    scale of the data of the first fit (or of the first partial_fit batch), so that the random hidden layer does not
+    saturate; later batches are scaled the same way.
+    """
+    # class level constants
+    ACTIVATIONS = {'sigmoid': expit, 'tanh': np.tanh, 'relu': lambda hidden: np.maximum(hidden, 0.)}
+
+    def __init__(self, n_hidden=200, activation='sigmoid', alpha=1.0, random_state=None):
+        """
+        Constructor for the ELM
+        :param n_hidden: number of hidden neurons
+        :type n_hidden: int
+        :param activation: sigmoid, tanh or relu
+        :type activation: str
+        :param alpha: ridge regularisation of the output weights
+        :type alpha: float
+        :param random_state: seed of the random hidden layer
+        :type random_state: int
+        """
+        self.n_hidden = n_hidden
+        self.activation = activation
+        self.alpha = alpha
+        self.random_state = random_state
+
+    def init_hidden_layer(self, X=None, classes=None):
+        """
+        Method to draw the hidden layer and set the feature scaling and the classes, dropping any fitted weights
+        :param X: (n_trials, n_features) trials the feature scaling is estimated from
+        :type X: numpy.ndarray
+        :param classes: the classes
+        :type classes: numpy.ndarray
+        """
+        if self.activation not in self.ACTIVATIONS:
+            raise ValueError('unknown activation ' + str(self.activation))
+        rng = np.random.default_rng(self.random_state)
+        n_features = X.shape[1]
+        self.classes_ = np.asarray(classes)
+        self.n_features_in_ = n_features
+        self.mean_ = X.mean(axis=0)
+        scale = X.std(axis=0) if len(X) > 1 else np.ones(n_features)
+        self.scale_ = np.where(scale > 0, scale, 1.)
+        # unit variance hidden inputs for standardised features
+        self.input_weights_ = rng.standard_normal((n_features, self.n_hidden)) / np.sqrt(n_features)
+        self.biases_ = rng.standard_normal(self.n_hidden)
+        self.output_weights_ = None
+        self.P_ = None
+
+    def get_hidden(self, X=None) -> np.ndarray:
+        """
+        Method to compute the hidden layer activations
+        :param X: (n_trials, n_features) trials
+        :type X: numpy.ndarray
+        :return: (n_trials, n_hidden) activations
+        :rtype: numpy.ndarray
+        """
+        check_is_fitted(self, 'input_weights_')
+        hidden = ((np.asarray(X, dtype=np.float64) - self.mean_) / self.scale_) @ self.input_weights_
+        hidden += self.biases_
+        return self.ACTIVATIONS[self.activation](hidden)
+
+    def get_targets(self, y=None) -> np.ndarray:
+        """
+        Method to encode the classes as +1/-1 targets, one column per class
+        :param y: class of each trial
+        :type y: numpy.ndarray
+        :return: (n_trials, n_classes) targets
+        :rtype: numpy.ndarray
+        """
+        y = np.asarray(y)
+        unknown = ~np.isin(y, self.classes_)
+        if np.any(unknown):
+            raise ValueError('unknown classes ' + str(np.unique(y[unknown])))
+        return np.where(y[:, np.newaxis] == self.classes_, 1., -1.)
+
+    def fit(self, X, y):
+        """
+        Method to draw the hidden layer and solve the output weights on all the trials
+        :param X: (n_trials, n_features) trials
+        :type X: numpy.ndarray
+        :param y: class of each trial
+        :type y: numpy.ndarray
+        :return: the fitted ELM
+        :rtype: ELM
+        """
+        X = np.asarray(X, dtype=np.float64)
+        self.init_hidden_layer(X=X, classes=np.unique(y))
+        hidden = self.get_hidden(X)
+        gram = hidden.T @ hidden
+        gram[np.diag_indices_from(gram)] += self.alpha
+        factor = cho_factor(gram, overwrite_a=True)
+        self.output_weights_ = cho_solve(factor, hidden.T @ self.get_targets(y))
+        self.P_ = cho_solve(factor, np.eye(self.n_hidden))
+        return self
+
+    def partial_fit(self, X, y, classes=None):
+        """
+        Method to update the output weights with new trials (OS-ELM). The first call draws the hidden layer and
+        needs every class, either in y or in classes; it starts from the ridge prior, so a model built only with
+        partial_fit equals one fitted on the same trials with the same scaling.
+        :param X: (n_trials, n_features) new trials
+        :type X: numpy.ndarray
+        :param y: class of each new trial
+        :type y: numpy.ndarray
+        :param classes: every class, needed on the first call when y does not contain them all
+        :type classes: numpy.ndarray
+        :return: the updated ELM
+        :rtype: ELM
+        """
+        X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+        if getattr(self, 'P_', None) is None:
+            self.init_hidden_layer(X=X, classes=np.unique(y) if classes is None else np.unique(classes))
+            self.P_ = np.eye(self.n_hidden) / self.alpha
+            self.output_weights_ = np.zeros((self.n_hidden, len(self.classes_)))
+        hidden = self.get_hidden(X)
+        targets = self.get_targets(np.atleast_1d(y))
+
+        # Woodbury update with the k new rows: gain = P H^T (I + H P H^T)^-1
+        projected = hidden @ self.P_
+        innovation = projected @ hidden.T
+        innovation[np.diag_indices_from(innovation)] += 1.
+        gain = cho_solve(cho_factor(innovation), projected).T
+        self.P_ -= gain @ projected
+        self.output_weights_ += gain @ (targets - hidden @ self.output_weights_)
+        return self
+
+    def decision_function(self, X) -> np.ndarray:
+        """
+        Method to compute the output of the network
+        :param X: (n_trials, n_features) trials
+        :type X: numpy.ndarray
+        :return: (n_trials, n_classes) outputs, or (n_trials,) score of the second class for two classes
+        :rtype: numpy.ndarray
+        """
+        scores = self.get_hidden(X) @ self.output_weights_
+        if len(self.classes_) == 2:
+            return scores[:, 1] - scores[:, 0]
+        return scores
+
+    def predict(self, X) -> np.ndarray:
+        """
+        Method to predict the class of trials
+        :param X: (n_trials, n_features) trials
+        :type X: numpy.ndarray
+        :return: the predicted classes
+        :rtype: numpy.ndarray
+        """
+        scores = self.get_hidden(X) @ self.output_weights_
+        return self.classes_[np.argmax(scores, axis=1)]
@@ -0,0 +1,311 @@
+from sklearn.base import BaseEstimator, ClassifierMixin
+from sklearn.utils.validation import check_is_fitted
+import numpy as np
+import time
+
+
+class KNN(BaseEstimator, ClassifierMixin):
+    """
+    k-nearest neighbour classifier (Euclidean distance) over feature vectors such as CSP log-power or band power,
+    backed by an index of the reference trials so that large reference pools (every subject and session) can be
+    queried. The index is a KD-tree (scipy cKDTree), a ball tree (sklearn BallTree), or none (brute, the chunked
+    exhaustive search of sklearn NearestNeighbors). Trees only prune well in a few dimensions, so auto picks the
+    KD-tree up to KD_TREE_MAX_FEATURES features and brute beyond.
+    In the approximate mode the reference trials are projected onto their n_projections principal directions, a
+    KD-tree of the projections returns n_candidates candidates for each query, and the candidates are re-ranked with
+    their exact distances. The projected distance never exceeds the exact one, and it is close to it only when the
+    features have a low intrinsic dimension (a few principal directions hold most of the variance, as for strongly
+    correlated band powers); otherwise many candidates are needed. By default the number of directions is taken
+    from the variance spectrum, and the number of candidates is doubled until the recall of the exact neighbours of
+    a sample of the reference trials reaches target_recall, up to MAX_CANDIDATES_PER_NEIGHBOR * n_neighbors; when
+    that is not enough, the features are not of low intrinsic dimension and the exact search is used instead. The
+    recall estimate is kept in recall_ (1 for the exact search). Queries are answered a batch at a time and the
+    votes of all the trials of a batch are counted at once. The time taken to build the index and to answer the
+    last query are kept in build_time_ and query_time_.
+    """
+    # class level constants
+    ALGORITHMS = ['auto', 'kd_tree', 'ball_tree', 'brute']
+    WEIGHTS = ['uniform', 'distance']
+    KD_TREE_MAX_FEATURES = 16
+    EXPLAINED_VARIANCE = 0.9
+    RECALL_QUERIES = 256
+    MAX_CANDIDATES_PER_NEIGHBOR = 64
+
+    def __init__(self, n_neighbors=5, algorithm='auto', weights='uniform', leaf_size=40, approximate=False,
+                 n_projections=None, n_candidates=None, target_recall=0.95, batch_size=1024, n_jobs=1,
+                 random_state=None):
+        """
+        Constructor for the KNN classifier
+        :param n_neighbors: number of neighbours that vote
+        :type n_neighbors: int
+        :param algorithm: auto, kd_tree, ball_tree or brute
+        :type algorithm: str
+        :param weights: uniform for one vote per neighbour, distance for votes weighted by the inverse distance
+        :type weights: str
+        :param leaf_size: number of reference trials below which a node of a tree is not split
+        :type leaf_size: int
+        :param approximate: True to search the projections onto the principal directions and re-rank the candidates
+        :type approximate: bool
+        :param n_projections: number of principal directions of the approximate mode, by default the fewest that
+            hold EXPLAINED_VARIANCE of the variance, at most KD_TREE_MAX_FEATURES
+        :type n_projections: int
+        :param n_candidates: number of candidates re-ranked per query in the approximate mode, by default the
+            fewest (from 4 * n_neighbors, doubling) that reach target_recall
+        :type n_candidates: int
+        :param target_recall: share of the exact neighbours the approximate mode should find, when n_candidates is
+            not given
+        :type target_recall: float
+        :param batch_size: number of query trials per call to the index
+        :type batch_size: int
+        :param n_jobs: number of threads the KD-tree or brute search answers a batch with, -1 for all cores
+        :type n_jobs: int
+        :param random_state: seed of the sample of reference trials the recall is estimated on
+        :type random_state: int
+        """
+        self.n_neighbors = n_neighbors
+        self.algorithm = algorithm
+        self.weights = weights
+        self.leaf_size = leaf_size
+        self.approximate = approximate
+        self.n_projections = n_projections
+        self.n_candidates = n_candidates
+        self.target_recall = target_recall
+        self.batch_size = batch_size
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+
+    def fit(self, X, y):
+        """
+        Method to build the index of the reference trials
+        :param X: (n_trials, n_features) reference trials
+        :type X: numpy.ndarray
+        :param y: class of each reference trial
+        :type y: numpy.ndarray
+        :return: the fitted classifier
+        :rtype: KNN
+        """
+        if self.algorithm not in self.ALGORITHMS:
+            raise ValueError('unknown algorithm ' + str(self.algorithm))
+        if self.weights not in self.WEIGHTS:
+            raise ValueError('unknown weights ' + str(self.weights))
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        self.classes_, self.labels_ = np.unique(y, return_inverse=True)
+        self.n_features_in_ = X.shape[1]
+        start_time = time.perf_counter()
+        self.reference_ = X
+        self.projection_ = None
+        self.n_candidates_ = None
+        self.recall_ = None
+        self.algorithm_ = self.algorithm
+        if self.approximate and len(X) > self.n_neighbors + 1:
+            # principal directions by decreasing variance; they are orthonormal, so projected distances are never
+            # larger than exact ones
+            variances, eigenvectors = np.linalg.eigh(np.atleast_2d(np.cov(X, rowvar=False)))
+            n_projections = self.get_n_projections(variances=variances[::-1])
+            if n_projections < X.shape[1]:
+                self.projection_ = np.ascontiguousarray(eigenvectors[:, ::-1][:, :n_projections])
+                self.algorithm_ = 'kd_tree'
+                self.build_index(X=X @ self.projection_)
+                if not self.calibrate():
+                    # too many candidates would be needed, the exact search is faster
+                    self.projection_ = None
+                    self.n_candidates_ = None
+                    self.algorithm_ = self.algorithm
+        if self.projection_ is None:
+            if self.algorithm_ == 'auto':
+                self.algorithm_ = 'kd_tree' if X.shape[1] <= self.KD_TREE_MAX_FEATURES else 'brute'
+            self.build_index(X=X)
+        self.build_time_ = time.perf_counter() - start_time
+        self.query_time_ = None
+        return self
+
+    def build_index(self, X=None):
+        """
+        Method to build the index of algorithm_ over the reference trials (or their projections)
+        :param X: (n_trials, n_dimensions) points to index
+        :type X: numpy.ndarray
+        """
+        if self.algorithm_ == 'kd_tree':
+            from scipy.spatial import cKDTree
+            self.index_ = cKDTree(X, leafsize=self.leaf_size)
+        elif self.algorithm_ == 'ball_tree':
+            from sklearn.neighbors import BallTree
+            self.index_ = BallTree(X, leaf_size=self.leaf_size)
+        else:
+            from sklearn.neighbors import NearestNeighbors
+            self.index_ = NearestNeighbors(algorithm='brute', n_jobs=self.n_jobs).fit(X)
+
+    def get_n_projections(self, variances=None) -> int:
+        """
+        Method to get the number of principal directions of the approximate mode
+        :param variances: variance of the reference trials along each principal direction, in decreasing order
+        :type variances: numpy.ndarray
+        :return: n_projections, or the fewest directions holding EXPLAINED_VARIANCE of the variance, at most
+            KD_TREE_MAX_FEATURES
+        :rtype: int
+        """
+        if self.n_projections is not None:
+            return self.n_projections
+        explained = np.cumsum(variances) / max(variances.sum(), np.finfo(float).tiny)
+        n_projections = int(np.searchsorted(explained, self.EXPLAINED_VARIANCE)) + 1
+        return min(n_projections, self.KD_TREE_MAX_FEATURES)
+
+    def calibrate(self) -> bool:
+        """
+        Method to estimate the recall of the approximate mode on a sample of RECALL_QUERIES reference trials, each
+        queried for its n_neighbors nearest other trials, and to choose n_candidates: the given one, or the fewest
+        (from 4 * n_neighbors, doubling) whose recall reaches target_recall
+        :return: False when target_recall is not reached with MAX_CANDIDATES_PER_NEIGHBOR * n_neighbors candidates
+        :rtype: bool
+        """
+        from sklearn.neighbors import NearestNeighbors
+        rng = np.random.default_rng(self.random_state)
+        n_reference = len(self.labels_)
+        n_neighbors = min(self.n_neighbors, n_reference - 1)
+        sample = np.sort(rng.choice(n_reference, size=min(self.RECALL_QUERIES, n_reference), replace=False))
+        queries = self.reference_[sample]
+        exact = NearestNeighbors(algorithm='brute').fit(self.reference_).kneighbors(
+            queries, n_neighbors=n_neighbors + 1, return_distance=False)
+        exact = self.drop_queries(indices=exact, queries=sample)
+        n_candidates = min(self.n_candidates or 4 * n_neighbors, n_reference - 1)
+        max_candidates = n_candidates if self.n_candidates is not None else \
+            min(self.MAX_CANDIDATES_PER_NEIGHBOR * n_neighbors, n_reference - 1)
+        # the candidates of every count are the first ones by projected distance, found in a single search
+        ranked = NearestNeighbors(algorithm='brute').fit(self.index_.data).kneighbors(
+            queries @ self.projection_, n_neighbors=max(n_candidates, max_candidates) + 1, return_distance=False)
+        while True:
+            found = self.rerank(batch=queries, candidates=ranked[:, :n_candidates + 1], n_neighbors=n_neighbors + 1)[1]
+            found = self.drop_queries(indices=found, queries=sample)
+            self.recall_ = np.mean((found[:, :, np.newaxis] == exact[:, np.newaxis, :]).any(axis=2))
+            if self.n_candidates is not None or self.recall_ >= self.target_recall:
+                break
+            if n_candidates >= max_candidates:
+                self.recall_ = 1.
+                return False
+            n_candidates = min(2 * n_candidates, max_candidates)
+        self.n_candidates_ = n_candidates
+        return True
+
+    @staticmethod
+    def drop_queries(indices=None, queries=None) -> np.ndarray:
+        """
+        Method to remove the query trials themselves from the neighbours of reference trials queried against the
+        reference pool
+        :param indices: (n_queries, n_neighbors + 1) indices of the neighbours
+        :type indices: numpy.ndarray
+        :param queries: index of each query trial in the reference pool
+        :type queries: numpy.ndarray
+        :return: (n_queries, n_neighbors) indices of the other neighbours
+        :rtype: numpy.ndarray
+        """
+        keep = indices != queries[:, np.newaxis]
+        # a query with duplicates in the pool may not be among its own neighbours, drop the farthest instead
+        keep[keep.all(axis=1), -1] = False
+        return indices[keep].reshape(len(indices), -1)
+
+    def rerank(self, batch=None, candidates=None, n_neighbors=None) -> tuple:
+        """
+        Method to keep the nearest of the candidate neighbours of a batch of queries, by their exact distances
+        :param batch: (n_queries, n_features) query trials
+        :type batch: numpy.ndarray
+        :param candidates: (n_queries, n_candidates) indices of the candidate reference trials
+        :type candidates: numpy.ndarray
+        :param n_neighbors: number of neighbours
+        :type n_neighbors: int
+        :return: (n_queries, n_neighbors) distances and indices of the neighbours, sorted by distance
+        :rtype: tuple
+        """
+        differences = self.reference_[candidates] - batch[:, np.newaxis, :]
+        distances = np.sqrt(np.einsum('qcf,qcf->qc', differences, differences))
+        order = np.argsort(distances, axis=1)[:, :n_neighbors]
+        rows = np.arange(len(batch))[:, np.newaxis]
+        return distances[rows, order], candidates[rows, order]
+
+    def kneighbors(self, X=None, n_neighbors=None, return_distance=True):
+        """
+        Method to find the nearest reference trials of every query trial, a batch of queries at a time
+        :param X: (n_queries, n_features) query trials
+        :type X: numpy.ndarray
+        :param n_neighbors: number of neighbours, n_neighbors of the classifier by default
+        :type n_neighbors: int
+        :param return_distance: True to return the distances as well as the indices
+        :type return_distance: bool
+        :return: (n_queries, n_neighbors) distances and indices of the neighbours, sorted by distance, or only the
+            indices
+        :rtype: tuple
+        """
+        check_is_fitted(self, 'index_')
+        if n_neighbors is None:
+            n_neighbors = self.n_neighbors
+        n_reference = len(self.labels_)
+        n_neighbors = min(n_neighbors, n_reference)
+        n_candidates = n_neighbors
+        if self.projection_ is not None:
+            # the calibrated number of candidates, in proportion for another number of neighbours
+            n_candidates = min(max(-(-self.n_candidates_ * n_neighbors // self.n_neighbors), n_neighbors),
+                               n_reference)
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        distances = np.empty((len(X), n_neighbors))
+        indices = np.empty((len(X), n_neighbors), dtype=np.int64)
+        start_time = time.perf_counter()
+        for start in range(0, len(X), self.batch_size):
+            batch = X[start:start + self.batch_size]
+            stop = start + len(batch)
+            queries = batch if self.projection_ is None else batch @ self.projection_
+            if self.algorithm_ == 'kd_tree':
+                # a list of k always returns (n_queries, k) arrays, also for one neighbour
+                found = self.index_.query(queries, k=list(range(1, n_candidates + 1)), workers=self.n_jobs)
+            elif self.algorithm_ == 'ball_tree':
+                found = self.index_.query(queries, k=n_candidates)
+            else:
+                found = self.index_.kneighbors(queries, n_neighbors=n_candidates)
+            if self.projection_ is not None:
+                found = self.rerank(batch=batch, candidates=found[1], n_neighbors=n_neighbors)
+            distances[start:stop], indices[start:stop] = found
+        self.query_time_ = time.perf_counter() - start_time
+        if return_distance:
+            return distances, indices
+        return indices
+
+    def get_votes(self, X=None) -> np.ndarray:
+        """
+        Method to count the (weighted) votes of the neighbours of every query trial for every class
+        :param X: (n_queries, n_features) query trials
+        :type X: numpy.ndarray
+        :return: (n_queries, n_classes) votes
+        :rtype: numpy.ndarray
+        """
+        distances, indices = self.kneighbors(X)
+        if self.weights == 'uniform':
+            weights = np.ones_like(distances)
+        else:
+            # a query that matches reference trials exactly takes the vote of those trials only
+            exact = distances == 0
+            with np.errstate(divide='ignore'):
+                weights = np.where(exact.any(axis=1, keepdims=True), exact, 1. / distances)
+        n_queries = len(indices)
+        votes = np.zeros(n_queries * len(self.classes_))
+        cells = np.arange(n_queries)[:, np.newaxis] * len(self.classes_) + self.labels_[indices]
+        np.add.at(votes, cells.ravel(), weights.ravel())
+        return votes.reshape(n_queries, len(self.classes_))
+
+    def predict_proba(self, X) -> np.ndarray:
+        """
+        Method to compute the share of the votes of every class
+        :param X: (n_queries, n_features) query trials
+        :type X: numpy.ndarray
+        :return: (n_queries, n_classes) probabilities
+        :rtype: numpy.ndarray
+        """
+        votes = self.get_votes(X)
+        return votes / votes.sum(axis=1, keepdims=True)
+
+    def predict(self, X) -> np.ndarray:
+        """
+        Method to predict the class of query trials, ties go to the first class
+        :param X: (n_queries, n_features) query trials
+        :type X: numpy.ndarray
+        :return: the predicted classes
+        :rtype: numpy.ndarray
+        """
+        return self.classes_[np.argmax(self.get_votes(X), axis=1)]
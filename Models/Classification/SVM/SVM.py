@@ -0,0 +1,275 @@
+from sklearn.base import BaseEstimator, ClassifierMixin
+from sklearn.utils.validation import check_is_fitted
+import numpy as np
+import time
+
+
+class SVM(BaseEstimator, ClassifierMixin):
+    """
+    Linear SVM trained out of core: the features are read from a disk-backed array (a numpy memory map, e.g. the
+    tfr_memmap file of FeatureEngineer, or the arrays of the stage cache) one minibatch of rows at a time, and the
+    hinge loss is minimised by stochastic gradient descent (sklearn SGDClassifier.partial_fit), so memory use is set
+    by the batch size and not by the number of trials. The minibatches are contiguous row blocks, read in a new random
+    order at every epoch, so the disk is read sequentially within a block. A first pass computes the mean and scale
+    of every feature for standardisation. Every epoch ends with the accuracy on a validation stream (the given
+    validation arrays, or a random share of the blocks held out of training, or of the rows when the trials fit in a
+    single block), and training stops when it has not improved for n_iter_no_change epochs; the weights of the best
+    epoch are kept. Without validation trials (validation_fraction=0) all max_epochs are run. With kernel='rbf' every
+    batch is mapped to n_components random Fourier features (as sklearn RBFSampler, in float32) before the linear
+    SVM, which approximates an RBF-kernel SVM at the cost of a linear one. Rows with more than one dimension (e.g.
+    times x frequencies x electrodes) are flattened.
+    """
+    # class level constants
+    KERNELS = ['linear', 'rbf']
+
+    def __init__(self, alpha=1e-4, kernel='linear', gamma=None, n_components=1000, batch_size=4096, max_epochs=50,
+                 tol=1e-3, n_iter_no_change=3, validation_fraction=0.1, average=True, random_state=None,
+                 verbose=False):
+        """
+        Constructor for the out-of-core SVM
+        :param alpha: L2 regularisation of the weights
+        :type alpha: float
+        :param kernel: linear, or rbf for the random Fourier features approximation of the RBF kernel
+        :type kernel: str
+        :param gamma: RBF kernel coefficient on the standardised features, 1 / n_features by default
+        :type gamma: float
+        :param n_components: number of random Fourier features
+        :type n_components: int
+        :param batch_size: number of rows read and fitted at a time
+        :type batch_size: int
+        :param max_epochs: maximum number of passes over the training blocks
+        :type max_epochs: int
+        :param tol: improvement of the validation accuracy below which an epoch does not count as better
+        :type tol: float
+        :param n_iter_no_change: number of epochs without improvement before stopping
+        :type n_iter_no_change: int
+        :param validation_fraction: share of the blocks (or of the rows of a single block) held out for validation
+            when no validation arrays are given, 0 for no early stopping
+        :type validation_fraction: float
+        :param average: True to average the SGD weights over the updates (ASGD), which is less noisy than the last
+            weights
+        :type average: bool
+        :param random_state: seed of the block order, the validation blocks, SGD and the Fourier features
+        :type random_state: int
+        :param verbose: True to print the validation accuracy of every epoch
+        :type verbose: bool
+        """
+        self.alpha = alpha
+        self.kernel = kernel
+        self.gamma = gamma
+        self.n_components = n_components
+        self.batch_size = batch_size
+        self.max_epochs = max_epochs
+        self.tol = tol
+        self.n_iter_no_change = n_iter_no_change
+        self.validation_fraction = validation_fraction
+        self.average = average
+        self.random_state = random_state
+        self.verbose = verbose
+
+    def get_blocks(self, n_rows=None) -> list:
+        """
+        Method to cut the rows into contiguous blocks of batch_size rows
+        :param n_rows: number of rows
+        :type n_rows: int
+        :return: (start, stop) of every block
+        :rtype: list
+        """
+        return [(start, min(start + self.batch_size, n_rows)) for start in range(0, n_rows, self.batch_size)]
+
+    @staticmethod
+    def read_block(X=None, start=None, stop=None) -> np.ndarray:
+        """
+        Method to read a block of rows into memory as a (n_rows, n_features) float64 array
+        :param X: (n_trials, ...) features, in memory or disk-backed
+        :type X: numpy.ndarray
+        :param start: first row
+        :type start: int
+        :param stop: last row (exclusive)
+        :type stop: int
+        :return: the rows, flattened
+        :rtype: numpy.ndarray
+        """
+        return np.asarray(X[start:stop], dtype=np.float64).reshape(stop - start, -1)
+
+    def fit_scaling(self, X=None, blocks=None):
+        """
+        Method to compute the mean and scale of every feature in one pass over the training blocks. The mean and sum
+        of squared deviations of each block are merged with those of the previous blocks (Chan et al.), which unlike
+        E[x^2] - E[x]^2 does not cancel for features with a large offset compared to their spread.
+        :param X: (n_trials, ...) features
+        :type X: numpy.ndarray
+        :param blocks: (start, stop) of the training blocks
+        :type blocks: list
+        """
+        n_rows = 0
+        mean = 0.
+        squared_deviations = 0.
+        for start, stop in blocks:
+            block = self.read_block(X=X, start=start, stop=stop)
+            block_mean = block.mean(axis=0)
+            centred = block - block_mean
+            delta = block_mean - mean
+            n_total = n_rows + len(block)
+            mean = mean + delta * (len(block) / n_total)
+            squared_deviations = squared_deviations + np.einsum('ij,ij->j', centred, centred) + \
+                delta ** 2 * (n_rows * len(block) / n_total)
+            n_rows = n_total
+        self.mean_ = mean
+        scale = np.sqrt(squared_deviations / n_rows)
+        self.scale_ = np.where(scale > 0, scale, 1.)
+
+    def transform_block(self, block=None) -> np.ndarray:
+        """
+        Method to standardise a block of rows and, for the rbf kernel, map it to the random Fourier features
+        :param block: (n_rows, n_features) rows
+        :type block: numpy.ndarray
+        :return: the features the linear SVM is fitted on
+        :rtype: numpy.ndarray
+        """
+        block = (block - self.mean_) / self.scale_
+        if self.fourier_weights_ is not None:
+            # sqrt(2 / n_components) cos(x W + b); the cosine dominates the cost and is about 3x faster in float32
+            projection = block.astype(np.float32) @ self.fourier_weights_
+            projection += self.fourier_offsets_
+            np.cos(projection, out=projection)
+            projection *= np.sqrt(2. / self.n_components)
+            return projection
+        return block
+
+    def score_stream(self, X=None, y=None, blocks=None) -> float:
+        """
+        Method to compute the accuracy over blocks of rows
+        :param X: (n_trials, ...) features
+        :type X: numpy.ndarray
+        :param y: class of each trial
+        :type y: numpy.ndarray
+        :param blocks: (start, stop) of the blocks
+        :type blocks: list
+        :return: the accuracy
+        :rtype: float
+        """
+        correct = 0
+        n_rows = 0
+        for start, stop in blocks:
+            features = self.transform_block(block=self.read_block(X=X, start=start, stop=stop))
+            correct += np.count_nonzero(self.sgd_.predict(features) == y[start:stop])
+            n_rows += stop - start
+        return correct / max(n_rows, 1)
+
+    def fit(self, X, y, X_val=None, y_val=None):
+        """
+        Method to train the SVM, streaming the features a block at a time
+        :param X: (n_trials, ...) features, e.g. np.load(file_name, mmap_mode='r')
+        :type X: numpy.ndarray
+        :param y: class of each trial
+        :type y: numpy.ndarray
+        :param X_val: optionally, (n_validation_trials, ...) validation features; by default validation_fraction of
+            the blocks of X are held out, or of the rows when X fits in a single block
+        :type X_val: numpy.ndarray
+        :param y_val: class of each validation trial
+        :type y_val: numpy.ndarray
+        :return: the fitted SVM
+        :rtype: SVM
+        """
+        from sklearn.linear_model import SGDClassifier
+        if self.kernel not in self.KERNELS:
+            raise ValueError('unknown kernel ' + str(self.kernel))
+        start_time = time.perf_counter()
+        rng = np.random.default_rng(self.random_state)
+        y = np.asarray(y)
+        self.classes_ = np.unique(y)
+        blocks = self.get_blocks(n_rows=len(y))
+        if X_val is None and len(blocks) == 1:
+            # the trials fit in memory: hold out a random share of the rows (the rows may be sorted by class)
+            n_validation = int(round(self.validation_fraction * len(y)))
+            order = rng.permutation(len(y))
+            X = self.read_block(X=X, start=0, stop=len(y))
+            if 0 < n_validation < len(y):
+                X_val, y_val = X[order[:n_validation]], y[order[:n_validation]]
+                X, y = X[order[n_validation:]], y[order[n_validation:]]
+            blocks = self.get_blocks(n_rows=len(y))
+            validation_blocks = [] if X_val is None else self.get_blocks(n_rows=len(y_val))
+        elif X_val is None:
+            X_val = X
+            y_val = y
+            order = rng.permutation(len(blocks))
+            n_validation = int(round(self.validation_fraction * len(blocks)))
+            if self.validation_fraction > 0:
+                n_validation = min(max(n_validation, 1), len(blocks) - 1)
+            validation_blocks = [blocks[index] for index in np.sort(order[:n_validation])]
+            blocks = [blocks[index] for index in np.sort(order[n_validation:])]
+        else:
+            y_val = np.asarray(y_val)
+            validation_blocks = self.get_blocks(n_rows=len(y_val))
+
+        self.fit_scaling(X=X, blocks=blocks)
+        self.n_features_in_ = len(self.mean_)
+        self.fourier_weights_ = None
+        self.fourier_offsets_ = None
+        if self.kernel == 'rbf':
+            # random Fourier features of exp(-gamma |x - x'|^2): W ~ N(0, 2 gamma), b ~ U(0, 2 pi)
+            gamma = self.gamma if self.gamma is not None else 1. / self.n_features_in_
+            self.fourier_weights_ = (np.sqrt(2. * gamma) * rng.standard_normal(
+                (self.n_features_in_, self.n_components))).astype(np.float32)
+            self.fourier_offsets_ = rng.uniform(0., 2. * np.pi, self.n_components).astype(np.float32)
+        self.sgd_ = SGDClassifier(loss='hinge', alpha=self.alpha, average=self.average,
+                                  random_state=self.random_state)
+
+        best_score = None
+        best_weights = None
+        no_change = 0
+        self.validation_scores_ = []
+        self.n_epochs_ = 0
+        for epoch in range(self.max_epochs):
+            for index in rng.permutation(len(blocks)):
+                start, stop = blocks[index]
+                features = self.transform_block(block=self.read_block(X=X, start=start, stop=stop))
+                self.sgd_.partial_fit(features, y[start:stop], classes=self.classes_)
+            self.n_epochs_ += 1
+            if len(validation_blocks) == 0:
+                # no validation trials, no early stopping
+                continue
+            score = self.score_stream(X=X_val, y=y_val, blocks=validation_blocks)
+            self.validation_scores_.append(score)
+            if self.verbose:
+                print('Epoch %d: validation accuracy %.4f' % (epoch + 1, score))
+            if best_score is None or score > best_score + self.tol:
+                best_score = score
+                best_weights = (self.sgd_.coef_.copy(), self.sgd_.intercept_.copy())
+                no_change = 0
+            else:
+                no_change += 1
+                if no_change >= self.n_iter_no_change:
+                    break
+        if best_weights is not None:
+            self.sgd_.coef_, self.sgd_.intercept_ = best_weights
+        self.best_validation_score_ = best_score
+        self.fit_time_ = time.perf_counter() - start_time
+        return self
+
+    def decision_function(self, X) -> np.ndarray:
+        """
+        Method to compute the signed distance of trials to the separating hyperplane(s), a block at a time
+        :param X: (n_trials, ...) features
+        :type X: numpy.ndarray
+        :return: (n_trials,) distances for two classes, (n_trials, n_classes) otherwise
+        :rtype: numpy.ndarray
+        """
+        check_is_fitted(self, 'sgd_')
+        return np.concatenate([
+            self.sgd_.decision_function(self.transform_block(block=self.read_block(X=X, start=start, stop=stop)))
+            for start, stop in self.get_blocks(n_rows=len(X))])
+
+    def predict(self, X) -> np.ndarray:
+        """
+        Method to predict the class of trials, a block at a time
+        :param X: (n_trials, ...) features
+        :type X: numpy.ndarray
+        :return: the predicted classes
+        :rtype: numpy.ndarray
+        """
+        scores = self.decision_function(X)
+        if scores.ndim == 1:
+            return self.classes_[(scores > 0).astype(int)]
+        return self.classes_[np.argmax(scores, axis=1)]
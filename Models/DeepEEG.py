@@ -11,6 +11,7 @@ import tensorflow as tf
 import os
 from glob import glob
 from collections import OrderedDict
+from functools import lru_cache
 
 import mne
 from mne.io import RawArray
@@ -20,10 +21,11 @@ from mne import pick_types, viz, io, Epochs, create_info
 from mne import pick_channels, concatenate_epochs
 from mne.datasets import sample
 from mne.simulation import simulate_sparse_stc, simulate_raw
-from mne.time_frequency import tfr_morlet
+from mne.time_frequency import tfr_morlet, morlet
 
 import numpy as np
 from numpy import genfromtxt
+import scipy.fft
 
 import pandas as pd
 pd.options.display.precision = 4
@@ -300,20 +302,49 @@ def mastoidReref(raw):
     return raw
 
 
-def GrattonEmcpRaw(raw):
-    raw_eeg = raw.copy().pick_types(eeg=True)[:][0]
-    raw_eog = raw.copy().pick_types(eog=True)[:][0]
-    b = np.linalg.solve(np.dot(raw_eog, raw_eog.T), np.dot(raw_eog, raw_eeg.T))
-    eeg_corrected = (raw_eeg.T - np.dot(raw_eog.T, b)).T
-    raw_new = raw.copy()
-    raw_new._data[pick_types(raw.info, eeg=True), :] = eeg_corrected
-    return raw_new
+def GrattonEmcpRaw(raw, inplace=False, chunk_size=65536):
+    '''
+    # Correct EEG data for EOG artifacts with regression on continuous data
+    # INPUT - MNE raw object (with eeg and eog channels, preloaded; preload to
+    #         a file, e.g. preload='raw.dat', to keep the data memory-mapped)
+    #       - inplace: correct raw itself instead of a copy
+    #       - chunk_size: number of samples processed at a time
+    # OUTPUT - MNE raw object (with eeg corrected)
+    # The EOG/EEG cross-products are accumulated over time chunks in one pass
+    # and the weighted eye channels are then subtracted chunk by chunk, so
+    # only one chunk of the eeg and eog channels is copied at a time
+    '''
+    if not raw.preload:
+        raise ValueError('GrattonEmcpRaw needs preloaded data, use preload=True or preload=<file>')
+    if not inplace:
+        raw = raw.copy()
+    eeg_chans = pick_types(raw.info, eeg=True)
+    eog_chans = pick_types(raw.info, eeg=False, eog=True)
+    data = raw._data
+
+    # accumulate eog x eog and eog x eeg
+    YY = np.zeros((len(eog_chans), len(eog_chans)))
+    YX = np.zeros((len(eog_chans), len(eeg_chans)))
+    for start in range(0, data.shape[1], chunk_size):
+        X = data[eeg_chans, start:start + chunk_size]
+        Y = data[eog_chans, start:start + chunk_size]
+        YY += np.dot(Y, Y.T)
+        YX += np.dot(Y, X.T)
+    b = np.linalg.solve(YY, YX)
+
+    # subtract weighted eye channels from eeg channels
+    for start in range(0, data.shape[1], chunk_size):
+        Y = data[eog_chans, start:start + chunk_size]
+        data[eeg_chans, start:start + chunk_size] -= np.dot(b.T, Y)
+    return raw
 
 
-def GrattonEmcpEpochs(epochs):
+def GrattonEmcpEpochs(epochs, inplace=False, chunk_size=64):
     '''
     # Correct EEG data for EOG artifacts with regression
     # INPUT - MNE epochs object (with eeg and eog channels)
+    #       - inplace: correct epochs itself instead of a copy
+    #       - chunk_size: number of epochs processed at a time
     # OUTPUT - MNE epochs object (with eeg corrected)
     # After: Gratton,Coles,Donchin, 1983
     # -compute the ERP in each condition
@@ -321,62 +352,55 @@ def GrattonEmcpEpochs(epochs):
     # -subtract baseline (mean over all epoch)
     # -predict eye channel remainder from eeg remainder
     # -use coefficients to subtract eog from eeg
+    # The regression is computed in one pass over the epochs from accumulated
+    # sums instead of building the remainders: with D the epochs, m the mean
+    # over time of each epoch and S_c the sum of the epochs of condition c,
+    # sum(rem rem^T) = sum(D D^T) - n_times sum(m m^T)
+    #                  - sum_c S_c' S_c'^T / n_c   (S_c' = S_c minus its time mean)
     '''
-
-    event_names = ['A_error', 'B_error']
-    i = 0
-    for key, value in sorted(epochs.event_id.items(), key=lambda x: (x[1], x[0])):
-        event_names[i] = key
-        i += 1
+    if not inplace:
+        epochs = epochs.copy()
 
     # select the correct channels and data
     eeg_chans = pick_types(epochs.info, eeg=True, eog=False)
     eog_chans = pick_types(epochs.info, eeg=False, eog=True)
-    original_data = epochs._data
-
-    # subtract the average over trials from each trial
-    rem = {}
-    for event in event_names:
-        data = epochs[event]._data
-        avg = np.mean(epochs[event]._data, axis=0)
-        rem[event] = data - avg
-
-    # concatenate trials together of different types
-    ## then put them all back together in X (regression on all at once)
-    allrem = np.concatenate([rem[event] for event in event_names])
-
-    # separate eog and eeg
-    X = allrem[:, eeg_chans, :]
-    Y = allrem[:, eog_chans, :]
-
-    # subtract mean over time from every trial/channel
-    X = (X.T - np.mean(X, 2).T).T
-    Y = (Y.T - np.mean(Y, 2).T).T
-
-    # move electrodes first
-    X = np.moveaxis(X, 0, 1)
-    Y = np.moveaxis(Y, 0, 1)
-
-    # make 2d and compute regression
-    X = np.reshape(X, (X.shape[0], np.prod(X.shape[1:])))
-    Y = np.reshape(Y, (Y.shape[0], np.prod(Y.shape[1:])))
-    b = np.linalg.solve(np.dot(Y, Y.T), np.dot(Y, X.T))
-
-    # get original data and electrodes first for matrix math
-    raw_eeg = np.moveaxis(original_data[:, eeg_chans, :], 0, 1)
-    raw_eog = np.moveaxis(original_data[:, eog_chans, :], 0, 1)
+    picks = np.concatenate([eeg_chans, eog_chans])
+    data = epochs._data
+    labels = epochs.events[:, 2]
+    codes = np.unique(labels)
+    n_times = data.shape[2]
+
+    # the remainders do not change when a constant is subtracted from each
+    # channel, so center the channels on the first epoch for precision
+    offset = data[0][picks].mean(axis=1)[:, np.newaxis]
+
+    # accumulate cross-products, time means and per condition sums
+    C = np.zeros((len(picks), len(picks)))
+    MM = np.zeros((len(picks), len(picks)))
+    S = np.zeros((len(codes), len(picks), n_times))
+    for start in range(0, data.shape[0], chunk_size):
+        D = data[start:start + chunk_size][:, picks, :] - offset
+        C += np.tensordot(D, D, axes=([0, 2], [0, 2]))
+        m = D.mean(axis=2)
+        MM += np.dot(m.T, m)
+        chunk_labels = labels[start:start + chunk_size]
+        for i, code in enumerate(codes):
+            S[i] += D[chunk_labels == code].sum(axis=0)
+    C -= n_times * MM
+    for i, code in enumerate(codes):
+        S_c = S[i] - S[i].mean(axis=1, keepdims=True)
+        C -= np.dot(S_c, S_c.T) / np.sum(labels == code)
+
+    # regression of the eeg remainder on the eog remainder
+    n_eeg = len(eeg_chans)
+    b = np.linalg.solve(C[n_eeg:, n_eeg:], C[n_eeg:, :n_eeg])
 
     # subtract weighted eye channels from eeg channels
-    eeg_corrected = (raw_eeg.T - np.dot(raw_eog.T, b)).T
-
-    # move back to match epochs
-    eeg_corrected = np.moveaxis(eeg_corrected, 0, 1)
+    for start in range(0, data.shape[0], chunk_size):
+        block = data[start:start + chunk_size]
+        block[:, eeg_chans, :] -= np.einsum('ij,ejt->eit', b.T, block[:, eog_chans, :])
 
-    # copy original epochs and replace with corrected data
-    epochs_new = epochs.copy()
-    epochs_new._data[:, eeg_chans, :] = eeg_corrected
-
-    return epochs_new
+    return epochs
 
 
 def PreProcess(raw, event_id, plot_psd=False, filter_data=True,
@@ -416,7 +440,7 @@ def PreProcess(raw, event_id, plot_psd=False, filter_data=True,
     # Eye Correction
     if emcp_raw:
         print('Raw Eye Movement Correction')
-        raw = GrattonEmcpRaw(raw)
+        raw = GrattonEmcpRaw(raw, inplace=True)
 
     # Epoching
     events = find_events(raw, shortest_event=1)
@@ -439,7 +463,7 @@ def PreProcess(raw, event_id, plot_psd=False, filter_data=True,
     # Gratton eye movement correction procedure on epochs
     if emcp_epochs:
         print('Epochs Eye Movement Correct')
-        epochs = GrattonEmcpEpochs(epochs)
+        epochs = GrattonEmcpEpochs(epochs, inplace=True)
 
     ## plot ERP at each electrode
     evoked_dict = {event_names[0]: epochs[event_names[0]].average(),
@@ -463,6 +487,58 @@ def PreProcess(raw, event_id, plot_psd=False, filter_data=True,
     return epochs
 
 
+@lru_cache(maxsize=16)
+def MorletBankFFT(sfreq, freqs, n_cycles, n_times):
+    '''
+    # FFT-domain Morlet wavelet bank, cached so that every chunk (and every call
+    # with the same settings) reuses it
+    # INPUT - sampling rate, frequencies and cycles (tuples), signal length
+    # OUTPUT - (n_freqs, n_fft) wavelet spectra; each wavelet is rolled so its
+    #          centre is at sample 0, so the first n_times samples of the
+    #          circular convolution are the 'same' convolution of tfr_morlet
+    '''
+    Ws = morlet(sfreq, np.array(freqs), n_cycles=np.array(n_cycles), zero_mean=True)
+    n_fft = scipy.fft.next_fast_len(n_times + max(W.size for W in Ws) - 1)
+    bank = np.zeros((len(Ws), n_fft), dtype=np.complex128)
+    for i, W in enumerate(Ws):
+        centre = (W.size - 1) // 2
+        bank[i, :W.size - centre] = W[centre:]
+        bank[i, n_fft - centre:] = W[:centre]
+    bank = scipy.fft.fft(bank, axis=-1)
+    bank.setflags(write=False)
+    return bank
+
+
+def TfrMorletChunks(data, sfreq, freqs, n_cycles=3, decim=1, output='power',
+                    chunk_size=32, index=None, picks=None):
+    '''
+    # Morlet time-frequency transform of epochs, computed chunk by chunk
+    # Same result as tfr_morlet(average=False) (zero-mean wavelets, decim
+    # applied after the convolution), but only chunk_size epochs are held
+    # in memory at a time
+    # INPUT - (n_epochs, n_channels, n_times) data (array or memmap),
+    #         output 'power' or 'complex', optional epoch index and channel picks
+    # OUTPUT - generator of (first epoch, (n_chunk, n_channels, n_freqs,
+    #          n_times_decim) tfr of the chunk)
+    '''
+    if index is None:
+        index = np.arange(data.shape[0])
+    if picks is None:
+        picks = np.arange(data.shape[1])
+    n_times = data.shape[2]
+    bank = MorletBankFFT(float(sfreq), tuple(np.atleast_1d(freqs).tolist()),
+                         tuple(np.atleast_1d(n_cycles).tolist()), n_times)
+    n_fft = bank.shape[1]
+    for start in range(0, len(index), chunk_size):
+        chunk = np.asarray(data[index[start:start + chunk_size]][:, picks, :], dtype=np.float64)
+        fft_x = scipy.fft.fft(chunk, n_fft, axis=-1)
+        tfr = scipy.fft.ifft(fft_x[:, :, np.newaxis, :] * bank, axis=-1)
+        tfr = tfr[..., :n_times:decim]
+        if output == 'power':
+            tfr = tfr.real ** 2 + tfr.imag ** 2
+        yield start, tfr
+
+
 def FeatureEngineer(epochs, model_type='NN',
                     frequency_domain=False,
                     normalization=False, electrode_median=False,
@@ -471,7 +547,8 @@ def FeatureEngineer(epochs, model_type='NN',
                     wavelet_electrodes=[11, 12, 13, 14, 15],
                     spect_baseline=[-1, -.5],
                     test_split=0.2, val_split=0.2,
-                    random_seed=1017, watermark=False):
+                    random_seed=1017, watermark=False,
+                    tfr_chunk_size=32, tfr_memmap=None):
     """
     Takes epochs object as
 
@@ -488,7 +565,12 @@ def FeatureEngineer(epochs, model_type='NN',
                       wavelet_electrodes = [11,12,13,14,15],
                       spect_baseline=[-1,-.5],
                       test_split = 0.2, val_split = 0.2,
-                      random_seed=1017, watermark = False):
+                      random_seed=1017, watermark = False,
+                      tfr_chunk_size=32, tfr_memmap=None):
+
+    With frequency_domain the wavelet transform is computed tfr_chunk_size
+    epochs at a time into a preallocated float32 X; give tfr_memmap (a .npy
+    path) to write X to a memory-mapped file instead of RAM.
     """
     np.random.seed(random_seed)
 
@@ -524,44 +606,49 @@ def FeatureEngineer(epochs, model_type='NN',
         else:
             tfr_output_type = 'power'
 
-        tfr_dict = {}
-        for event in event_names:
-            print('Computing Morlet Wavelets on ' + event)
-            tfr_temp = tfr_morlet(epochs[event], freqs=frequencies,
-                                  n_cycles=wave_cycles, return_itc=False,
-                                  picks=wavelet_electrodes, average=False,
-                                  decim=wavelet_decim, output=tfr_output_type)
-
-            # Apply spectral baseline and find stim onset time
-            tfr_temp = tfr_temp.apply_baseline(spect_baseline, mode='mean')
-            stim_onset = np.argmax(tfr_temp.times > 0)
-
-            # Reshape power output and save to tfr dict
-            power_out_temp = np.moveaxis(tfr_temp.data[:, :, :, stim_onset:], 1, 3)
-            power_out_temp = np.moveaxis(power_out_temp, 1, 2)
-            print(event + ' trials: ' + str(len(power_out_temp)))
-            tfr_dict[event] = power_out_temp
+        # epochs of each event, in trigger order, and the output times
+        event_index = [np.where(epochs.events[:, 2] == epochs.event_id[event])[0]
+                       for event in event_names]
+        tfr_times = epochs.times[::wavelet_decim]
+        stim_onset = np.argmax(tfr_times > 0)
+        feats.new_times = tfr_times[stim_onset:]
+        baseline_mask = (tfr_times >= spect_baseline[0]) & (tfr_times <= spect_baseline[1])
+        n_freq_out = len(frequencies) * (2 if include_phase else 1)
+
+        # preallocate X (trials, times, frequencies, electrodes), on disk if asked
+        x_shape = (sum(len(index) for index in event_index), len(feats.new_times),
+                   n_freq_out, len(wavelet_electrodes))
+        if tfr_memmap is not None:
+            X = np.lib.format.open_memmap(tfr_memmap, mode='w+', dtype=np.float32, shape=x_shape)
+        else:
+            X = np.empty(x_shape, dtype=np.float32)
+        Y_class = np.concatenate([np.full(len(index), ievent, dtype=float)
+                                  for ievent, index in enumerate(event_index)])
 
-        # reshape times (sloppy but just use the last temp tfr)
-        feats.new_times = tfr_temp.times[stim_onset:]
+        row = 0
+        for event, index in zip(event_names, event_index):
+            print('Computing Morlet Wavelets on ' + event)
+            for _, tfr in TfrMorletChunks(epochs._data, epochs.info['sfreq'], frequencies,
+                                          n_cycles=wave_cycles, decim=wavelet_decim,
+                                          output=tfr_output_type, chunk_size=tfr_chunk_size,
+                                          index=index, picks=wavelet_electrodes):
+                # Apply spectral baseline (mean) and keep the post stimulus times
+                tfr -= tfr[..., baseline_mask].mean(axis=-1, keepdims=True)
+                # (trials, electrodes, frequencies, times) -> (trials, times, frequencies, electrodes)
+                tfr = np.moveaxis(tfr[..., stim_onset:], 1, 3).swapaxes(1, 2)
+                rows = slice(row, row + len(tfr))
+                if include_phase:
+                    # concatenate real and imaginary data
+                    X[rows, :, :len(frequencies)] = tfr.real
+                    X[rows, :, len(frequencies):] = tfr.imag
+                else:
+                    X[rows] = tfr
+                row += len(tfr)
+            print(event + ' trials: ' + str(len(index)))
 
         for event in event_names:
             print(event + ' Time Points: ' + str(len(feats.new_times)))
-            print(event + ' Frequencies: ' + str(len(tfr_temp.freqs)))
-
-        # Construct X and Y
-        for ievent, event in enumerate(event_names):
-            if ievent == 0:
-                X = tfr_dict[event]
-                Y_class = np.zeros(len(tfr_dict[event]))
-            else:
-                X = np.append(X, tfr_dict[event], 0)
-                Y_class = np.append(Y_class, np.ones(len(tfr_dict[event])) * ievent, 0)
-
-        # concatenate real and imaginary data
-        if include_phase:
-            print('Concatenating the real and imaginary components')
-            X = np.append(np.real(X), np.imag(X), 2)
+            print(event + ' Frequencies: ' + str(len(frequencies)))
 
         # compute median over electrodes to decrease features
         if electrode_median:
@@ -625,11 +712,25 @@ def FeatureEngineer(epochs, model_type='NN',
     # Normalize X - TODO: need to save mean and std for future test + val
     if normalization:
         print('Normalizing X')
-        X = (X - np.mean(X)) / np.std(X)
+        if frequency_domain:
+            # in place and by chunks of trials, X may be a memory-mapped file
+            x_sum = 0.
+            x_squares = 0.
+            for start in range(0, len(X), tfr_chunk_size):
+                block = X[start:start + tfr_chunk_size].astype(np.float64)
+                x_sum += block.sum()
+                x_squares += np.dot(block.ravel(), block.ravel())
+            x_mean = x_sum / X.size
+            x_std = np.sqrt(x_squares / X.size - x_mean ** 2)
+            for start in range(0, len(X), tfr_chunk_size):
+                X[start:start + tfr_chunk_size] -= x_mean
+                X[start:start + tfr_chunk_size] /= x_std
+        else:
+            X = (X - np.mean(X)) / np.std(X)
 
     # convert class vectors to one hot Y and recast X
     Y = keras.utils.to_categorical(Y_class, feats.num_classes)
-    X = X.astype('float32')
+    X = X.astype('float32', copy=False)
 
     # add watermark for testing models
     if watermark:
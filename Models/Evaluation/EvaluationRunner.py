@@ -0,0 +1,379 @@
+from Data.DataLoader import DataLoader
+from Preprocessing.Filters.Filter import Filter
+from Utilities.Cache.StageCache import StageCache
+from Utilities.Config.Config import Config
+from Utilities.Database.Postgres.PostgresConnector import PostgresConnector
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import numpy as np
+import platform
+import time
+import mne
+import sys
+import os
+
+
+def create_classifier(name=None, n_components=4):
+    """
+    Function to create one of the classifiers of the evaluation grid, CSP log-power features followed by a
+    classifier. The CSP is fitted from the per-epoch covariance matrices of the stage cache (CovarianceCSP, the same
+    filters and features as mne.decoding.CSP(reg=None)), so the pipelines take those matrices as input.
+    :param name: csp_lda, csp_svm, csp_logistic, csp_elm or csp_knn
+    :type name: str
+    :param n_components: number of CSP components
+    :type n_components: int
+    :return: the unfitted pipeline
+    :rtype: sklearn.pipeline.Pipeline
+    """
+    from sklearn.discriminant_analysis import LinearDiscriminantAnalysis
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.pipeline import make_pipeline
+    from sklearn.svm import SVC
+    from Preprocessing.CSP.CovarianceCSP import CovarianceCSP
+    csp = CovarianceCSP(n_components=n_components, log=True)
+    if name == 'csp_lda':
+        return make_pipeline(csp, LinearDiscriminantAnalysis())
+    if name == 'csp_svm':
+        return make_pipeline(csp, StandardScaler(), SVC(kernel='rbf'))
+    if name == 'csp_logistic':
+        return make_pipeline(csp, StandardScaler(), LogisticRegression())
+    if name == 'csp_elm':
+        from Models.Classification.ELM.ELM import ELM
+        return make_pipeline(csp, ELM(random_state=EvaluationRunner.RANDOM_STATE))
+    if name == 'csp_knn':
+        from Models.Classification.KNN.KNN import KNN
+        return make_pipeline(csp, StandardScaler(), KNN(n_neighbors=15))
+    raise ValueError('unknown classifier ' + str(name))
+
+
+def evaluate_task(directory=None, task=None, n_components=4) -> dict:
+    """
+    Function run in a worker process to fit and score one classifier on one split. The per-epoch covariance matrices
+    are opened as memory maps of the stage cache entries written by the runner, so they are shared by the workers
+    through the page cache instead of being pickled into each of them, and only the epochs of the split are read.
+    :param directory: directory of the stage cache holding the covariance matrices
+    :type directory: str
+    :param task: the split, as created by EvaluationRunner.create_tasks
+    :type task: dict
+    :param n_components: number of CSP components
+    :type n_components: int
+    :return: the task description with n_train, n_test, accuracy, chance level and elapsed time
+    :rtype: dict
+    """
+    from threadpoolctl import threadpool_limits
+    start_time = time.perf_counter()
+    cache = StageCache(directory=directory)
+
+    def gather(parts):
+        data, labels = [], []
+        for key, index in parts:
+            arrays, _ = cache.load(key=key)
+            data.append(arrays['moments'] if index is None else arrays['moments'][index])
+            labels.append(arrays['labels'] if index is None else arrays['labels'][index])
+        return np.concatenate(data), np.concatenate(labels)
+
+    x_train, y_train = gather(task['train'])
+    x_test, y_test = gather(task['test'])
+    # one thread per worker, the pool already uses every core
+    with threadpool_limits(limits=1):
+        classifier = create_classifier(name=task['classifier'], n_components=n_components)
+        classifier.fit(x_train, y_train)
+        accuracy = float(np.mean(classifier.predict(x_test) == y_test))
+    _, counts = np.unique(y_test, return_counts=True)
+    result = {name: value for name, value in task.items() if name not in ('train', 'test')}
+    result.update({'n_train': len(y_train), 'n_test': len(y_test), 'accuracy': accuracy,
+                   'chance': float(counts.max() / counts.sum()), 'elapsed': time.perf_counter() - start_time})
+    return result
+
+
+class EvaluationRunner(object):
+    """
+    Evaluation of a grid of experiments, classifiers and cross-validation schemes. The epochs of every experiment
+    are prepared once, as in the CSP classification of the DataLoader, and only their per-epoch covariance matrices
+    are kept in the stage cache; the splits (the folds of the within-session cross-validation, and
+    leave-one-subject-out within each paradigm) then run on a process pool, which fits the CSP of every split from
+    the memory-mapped matrices instead of the epochs. Results are written to
+    the evaluation_results table as the splits finish, so an interrupted run keeps what it completed.
+    """
+    # class level constants
+    CLASSIFIERS = ['csp_lda', 'csp_svm', 'csp_logistic', 'csp_elm', 'csp_knn']
+    CV_SCHEMES = ['within_session', 'leave_one_subject_out']
+    RESULTS_TABLE = 'evaluation_results'
+    TEST_SIZE = 0.2
+    RANDOM_STATE = 42
+    MIN_EPOCHS_PER_CLASS = 5
+
+    # class level fields
+    config = None
+    data_loader = None
+    cache = None
+    experiment_ids = None
+    paradigms = None
+    classifiers = None
+    cv_schemes = None
+    event_id = None
+    epochs_t_min = None
+    epochs_t_max = None
+    t_min = None
+    t_max = None
+    n_folds = None
+    n_components = None
+    max_workers = None
+    experiments = None
+    run_id = None
+
+    def __init__(self, config=None, experiment_ids=None, classifiers=None, cv_schemes=None, max_workers=None):
+        """
+        Constructor for the evaluation runner, the grid defaults to the evaluation_settings section of the config
+        :param config: the config settings
+        :type config: dict
+        :param experiment_ids: the experiments to evaluate, by default those of evaluation_settings.experiment_ids,
+            or every experiment of evaluation_settings.paradigms when it is empty
+        :type experiment_ids: list
+        :param classifiers: names of the classifiers, see CLASSIFIERS
+        :type classifiers: list
+        :param cv_schemes: names of the cross-validation schemes, see CV_SCHEMES
+        :type cv_schemes: list
+        :param max_workers: number of worker processes, defaults to evaluation_settings.parallel_workers
+        :type max_workers: int
+        """
+        settings = config.get('evaluation_settings', {})
+        self.config = config
+        self.data_loader = DataLoader(config=config)
+        directory = settings.get('directory', '')
+        if not directory:
+            directory = os.path.join(self.data_loader.data_directory, 'Evaluation')
+        self.cache = StageCache(directory=directory.replace('{user}', self.data_loader.user))
+        self.experiment_ids = experiment_ids if experiment_ids is not None else settings.get('experiment_ids', [])
+        self.paradigms = settings.get('paradigms', []) or None
+        self.classifiers = classifiers if classifiers is not None else settings.get('classifiers', ['csp_lda'])
+        self.cv_schemes = cv_schemes if cv_schemes is not None else settings.get('cv_schemes', self.CV_SCHEMES)
+        for scheme in self.cv_schemes:
+            if scheme not in self.CV_SCHEMES:
+                raise ValueError('unknown cross-validation scheme ' + str(scheme))
+        for name in self.classifiers:
+            if name not in self.CLASSIFIERS:
+                raise ValueError('unknown classifier ' + str(name))
+        self.event_id = settings.get('event_id', {'left hand MI': 1, 'right hand MI': 2})
+        self.epochs_t_min = config['epochs_settings']['t_min']
+        self.epochs_t_max = config['epochs_settings']['t_max']
+        self.t_min = config['CSP_settings']['t_min']
+        self.t_max = config['CSP_settings']['t_max']
+        self.n_folds = settings.get('n_folds', 10)
+        self.n_components = config['CSP_settings']['num_components']
+        if max_workers is None:
+            max_workers = int(settings.get('parallel_workers', 0)) or os.cpu_count()
+        self.max_workers = max_workers
+        self.run_id = time.strftime('%Y%m%d-%H%M%S') + '-' + str(os.getpid())
+
+    def get_experiments(self) -> dict:
+        """
+        Method to look up the paradigm, subject and ingest version (see DataLoader.get_ingest_version) of the
+        experiments to evaluate
+        :return: experiment_id to a dict with its paradigm, subject and ingest version
+        :rtype: dict
+        """
+        experiment_ids = self.experiment_ids
+        if len(experiment_ids) == 0:
+            experiment_ids = self.data_loader.get_experiment_ids(paradigm=self.paradigms)
+        with PostgresConnector(config=self.config) as postgres:
+            rows = postgres.execute_query(sql_query='select experiment_id, paradigm, subject_id, xmin::text '
+                                                    'from experiment_information where experiment_id = any(%s) '
+                                                    'order by experiment_id',
+                                          parameters=([int(experiment_id) for experiment_id in experiment_ids],))
+        return {int(experiment_id): {'paradigm': paradigm, 'subject': subject, 'ingest_version': ingest_version}
+                for experiment_id, paradigm, subject, ingest_version in rows}
+
+    def prepare_epochs(self):
+        """
+        Method to prepare the epochs of every experiment as the CSP classification of the DataLoader does: the
+        recording is band-passed as a whole by Filter.filter (reused from the stage cache of the data loader), epoched
+        over epochs_settings with the (None, 0) baseline, and cropped to the time range of CSP_settings. Only the
+        per-epoch covariance matrices (stage csp_moments), which the splits are fitted from, and the labels are kept
+        in the stage cache of the runner, keyed with the ingest version of the experiment; experiments already there
+        are not loaded again. Experiments are prepared concurrently, bounded by the connection pool. Experiments
+        without enough epochs of every class are left out of the grid.
+        """
+        settings = {'event_id': self.event_id, 'epochs_t_min': self.epochs_t_min, 'epochs_t_max': self.epochs_t_max,
+                    't_min': self.t_min, 't_max': self.t_max, 'filter_settings': self.config['filter_settings'],
+                    'screening_settings': self.config.get('screening_settings', {})}
+
+        def compute(experiment_id):
+            from Preprocessing.CSP.CovarianceCSP import CovarianceCSP
+            # a loader per experiment, loading a recording sets the state of the loader
+            data_loader = DataLoader(config=self.config)
+            raw_mne = data_loader.load_data_from_sql(experiment_id=experiment_id)
+            data_filter = Filter(config=self.config, data_loader=data_loader)
+            data_filter.set_data(data=raw_mne, experiment_id=experiment_id, provenance=data_loader.data_provenance)
+            raw_filter = data_filter.filter()
+            events = mne.find_events(raw_filter, stim_channel='STI001', verbose=False)
+            events = events[np.isin(events[:, 2], list(self.event_id.values()))]
+            if len(events) == 0:
+                return {'moments': np.zeros((0, 0, 0)), 'labels': np.zeros(0, dtype=int)}, {}
+            picks = mne.pick_types(raw_filter.info, meg=False, eeg=True, stim=False, eog=False, exclude='bads')
+            epochs = mne.Epochs(raw=raw_filter, events=events, tmin=self.epochs_t_min, tmax=self.epochs_t_max,
+                                event_id=self.event_id, preload=True, picks=picks, on_missing='ignore',
+                                verbose=False)
+            epochs.crop(tmin=self.t_min, tmax=self.t_max)
+            return {'moments': CovarianceCSP.compute_moments(epochs_data=epochs.get_data()),
+                    'labels': epochs.events[:, 2]}, {}
+
+        def prepare(experiment_id):
+            experiment_settings = dict(settings, ingest_version=self.experiments[experiment_id]['ingest_version'])
+            self.cache.get_or_compute(experiment_id=experiment_id, stage='csp_moments', settings=experiment_settings,
+                                      compute=lambda: compute(experiment_id))
+            return self.cache.get_key(experiment_id=experiment_id, stage='csp_moments', settings=experiment_settings)
+
+        self.experiments = self.get_experiments()
+        max_workers = min(self.max_workers, len(self.experiments) or 1,
+                          int(self.config.get('database', {}).get('pool_max_connections',
+                                                                  PostgresConnector.POOL_MAX_CONNECTIONS)))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            keys = dict(zip(self.experiments, executor.map(prepare, self.experiments)))
+        for experiment_id in list(self.experiments):
+            labels = self.cache.load(key=keys[experiment_id])[0]['labels']
+            _, counts = np.unique(labels, return_counts=True)
+            if len(counts) < len(self.event_id) or counts.min() < self.MIN_EPOCHS_PER_CLASS:
+                print('Experiment %d left out: %d epochs per class, %d needed' %
+                      (experiment_id, counts.min() if len(counts) == len(self.event_id) else 0,
+                       self.MIN_EPOCHS_PER_CLASS))
+                del self.experiments[experiment_id]
+                continue
+            self.experiments[experiment_id].update({'key': keys[experiment_id], 'n_epochs': len(labels)})
+
+    def create_tasks(self) -> list:
+        """
+        Method to create the splits of the grid
+        :return: one dict per split with its scheme, classifier, paradigm, subject, experiment_id, fold, and the
+            training and test epochs as (cache key, epoch index or None for all epochs) parts; largest first
+        :rtype: list
+        """
+        from sklearn.model_selection import ShuffleSplit
+        splits = []
+        if 'within_session' in self.cv_schemes:
+            # the monte-carlo cross-validation of the DataLoader, on each experiment
+            cv = ShuffleSplit(self.n_folds, test_size=self.TEST_SIZE, random_state=self.RANDOM_STATE)
+            for experiment_id, experiment in self.experiments.items():
+                for fold, (train_idx, test_idx) in enumerate(cv.split(np.zeros(experiment['n_epochs']))):
+                    splits.append({'scheme': 'within_session', 'paradigm': experiment['paradigm'],
+                                   'subject': experiment['subject'], 'experiment_id': experiment_id, 'fold': fold,
+                                   'train': [(experiment['key'], train_idx)], 'test': [(experiment['key'], test_idx)]})
+        if 'leave_one_subject_out' in self.cv_schemes:
+            # train on the other subjects of the same paradigm, test on every experiment of the subject
+            for paradigm in sorted({experiment['paradigm'] for experiment in self.experiments.values()}):
+                experiments = {experiment_id: experiment for experiment_id, experiment in self.experiments.items()
+                               if experiment['paradigm'] == paradigm}
+                subjects = sorted({experiment['subject'] for experiment in experiments.values()})
+                if len(subjects) < 2:
+                    continue
+                for fold, subject in enumerate(subjects):
+                    train = [(experiment['key'], None) for experiment in experiments.values()
+                             if experiment['subject'] != subject]
+                    test = [(experiment['key'], None) for experiment in experiments.values()
+                            if experiment['subject'] == subject]
+                    splits.append({'scheme': 'leave_one_subject_out', 'paradigm': paradigm, 'subject': subject,
+                                   'experiment_id': None, 'fold': fold, 'train': train, 'test': test})
+        tasks = [dict(split, classifier=name) for split in splits for name in self.classifiers]
+
+        # the largest training sets first, so the long splits do not end up last on an otherwise idle pool
+        n_epochs = {experiment['key']: experiment['n_epochs'] for experiment in self.experiments.values()}
+        return sorted(tasks, key=lambda task: sum(n_epochs[key] if index is None else len(index)
+                                                  for key, index in task['train']), reverse=True)
+
+    def create_results_table(self, postgres=None):
+        """
+        Method to create the evaluation_results table if it does not exist yet, serialised with an advisory lock
+        :param postgres: connector to use
+        :type postgres: PostgresConnector
+        """
+        if postgres.has_table(table_name=self.RESULTS_TABLE):
+            return
+        postgres.execute_query(sql_query='select pg_advisory_xact_lock(hashtext(%s))',
+                               parameters=(self.RESULTS_TABLE,))
+        if not postgres.has_table(table_name=self.RESULTS_TABLE):
+            postgres.execute(sql_query='create table ' + self.RESULTS_TABLE + ' ('
+                                       'run_id text, scheme text, classifier text, paradigm text, subject_id text, '
+                                       'experiment_id integer, fold integer, n_train integer, n_test integer, '
+                                       'accuracy double precision, chance double precision, '
+                                       'elapsed double precision, write_datetime timestamp default now())',
+                             commit=False)
+        postgres.commit()
+
+    def push_result(self, postgres=None, result=None):
+        """
+        Method to insert the result of one split into evaluation_results and commit it
+        :param postgres: connector to use
+        :type postgres: PostgresConnector
+        :param result: the result, as returned by evaluate_task
+        :type result: dict
+        """
+        sql_query = 'insert into ' + self.RESULTS_TABLE + ' (run_id, scheme, classifier, paradigm, subject_id, ' \
+                    'experiment_id, fold, n_train, n_test, accuracy, chance, elapsed) ' \
+                    'values (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)'
+        postgres.execute(sql_query=sql_query, parameters=(self.run_id, result['scheme'], result['classifier'],
+                                                          result['paradigm'], result['subject'],
+                                                          result['experiment_id'], result['fold'],
+                                                          result['n_train'], result['n_test'], result['accuracy'],
+                                                          result['chance'], result['elapsed']))
+
+    def run(self) -> list:
+        """
+        Method to evaluate the grid, printing progress and writing the results as the splits finish
+        :return: the result of each split, as returned by evaluate_task
+        :rtype: list
+        """
+        start_time = time.perf_counter()
+        self.prepare_epochs()
+        tasks = self.create_tasks()
+        print('Evaluating %d splits of %d experiments on %d workers (run %s), epochs prepared in %.1f s' %
+              (len(tasks), len(self.experiments), self.max_workers, self.run_id, time.perf_counter() - start_time))
+        results = []
+        with PostgresConnector(config=self.config) as postgres:
+            self.create_results_table(postgres=postgres)
+            with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [executor.submit(evaluate_task, self.cache.directory, task, self.n_components)
+                           for task in tasks]
+                for future in as_completed(futures):
+                    result = future.result()
+                    self.push_result(postgres=postgres, result=result)
+                    results.append(result)
+                    target = 'experiment %d fold %d' % (result['experiment_id'], result['fold']) \
+                        if result['experiment_id'] is not None else 'subject ' + result['subject']
+                    print('[%d/%d] %s %s %s %s: accuracy %.3f (chance %.3f) in %.1f s' %
+                          (len(results), len(tasks), result['scheme'], result['classifier'], result['paradigm'],
+                           target, result['accuracy'], result['chance'], result['elapsed']))
+        self.print_summary(results=results)
+        print('Evaluated %d splits in %.1f s' % (len(results), time.perf_counter() - start_time))
+        return results
+
+    @staticmethod
+    def print_summary(results=None):
+        """
+        Method to print the mean accuracy of every scheme, classifier and paradigm
+        :param results: the results, as returned by evaluate_task
+        :type results: list
+        """
+        groups = {}
+        for result in results:
+            groups.setdefault((result['scheme'], result['classifier'], result['paradigm']), []).append(result)
+        for (scheme, classifier, paradigm), group in sorted(groups.items()):
+            print('%-22s %-13s %-9s accuracy %.3f +/- %.3f (chance %.3f, %d splits)' %
+                  (scheme, classifier, paradigm, np.mean([result['accuracy'] for result in group]),
+                   np.std([result['accuracy'] for result in group]),
+                   np.mean([result['chance'] for result in group]), len(group)))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        filename = sys.argv[1]
+    elif platform.system() == 'Windows':
+        # for Steven
+        filename = 'C:\\Users\\saspr\\source\\Python\\Tegan\\BCI\\Utilities\\Config\\config_steven.json'
+    elif platform.system() == 'Darwin':
+        # for Tegan
+        filename = '/Users/teganasprey/Desktop/BCI/Utilities/Config/config_tegan.json'
+
+    config = Config(file_name=filename)
+    config = config.settings
+    evaluation_runner = EvaluationRunner(config=config)
+    evaluation_runner.run()
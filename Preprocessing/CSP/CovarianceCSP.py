@@ -0,0 +1,128 @@
+from sklearn.base import BaseEstimator, TransformerMixin
+import numpy as np
+
+
+class CovarianceCSP(BaseEstimator, TransformerMixin):
+    """
+    Two-class CSP fitted from per-epoch Gram matrices instead of epochs. For each epoch E the matrix
+    [E; 1] [E; 1]^T holds the (n_channels, n_channels) products E E^T and, in the last row and column, the sum of
+    each channel and the number of samples. Summing these matrices over the epochs of a class gives exactly the
+    class covariance MNE estimates from the concatenated epochs with reg=None (the products over the number of
+    samples minus one), and the mean power of a spatially filtered epoch is w^T E E^T w / n_times. The matrices can
+    therefore be computed once per experiment (see compute_moments) and every cross-validation fold reduces to
+    summing the matrices of its training epochs and solving a (n_channels, n_channels) generalised eigenproblem.
+    Filters, component order and features are those of mne.decoding.CSP(reg=None, norm_trace=False) with the default
+    mutual_info order, up to the sign of each filter.
+    """
+    # class level constants
+    BLOCK_EPOCHS = 64
+    RANK_TOLERANCE = 1e-8
+
+    def __init__(self, n_components=4, log=True):
+        """
+        Constructor for the covariance CSP
+        :param n_components: number of CSP components
+        :type n_components: int
+        :param log: True for log-power features, False for power features standardised as by CSP(log=False)
+        :type log: bool
+        """
+        self.n_components = n_components
+        self.log = log
+
+    @classmethod
+    def compute_moments(cls, epochs_data=None) -> np.ndarray:
+        """
+        Method to compute the Gram matrix of every epoch augmented with a row of ones, a block of epochs at a time
+        :param epochs_data: (n_epochs, n_channels, n_times) epochs
+        :type epochs_data: numpy.ndarray
+        :return: (n_epochs, n_channels + 1, n_channels + 1) matrices: E E^T, with the sum of each channel over time
+            in the last row and column and n_times in the corner
+        :rtype: numpy.ndarray
+        """
+        n_epochs, n_channels, n_times = epochs_data.shape
+        moments = np.empty((n_epochs, n_channels + 1, n_channels + 1))
+        for start in range(0, n_epochs, cls.BLOCK_EPOCHS):
+            block = np.asarray(epochs_data[start:start + cls.BLOCK_EPOCHS], dtype=np.float64)
+            stop = start + len(block)
+            np.matmul(block, block.transpose(0, 2, 1), out=moments[start:stop, :n_channels, :n_channels])
+            moments[start:stop, :n_channels, n_channels] = block.sum(axis=2)
+        moments[:, n_channels, :n_channels] = moments[:, :n_channels, n_channels]
+        moments[:, n_channels, n_channels] = n_times
+        return moments
+
+    @staticmethod
+    def get_class_covariance(moments=None) -> np.ndarray:
+        """
+        Method to compute the covariance MNE estimates from the concatenated epochs of a class
+        :param moments: (n_channels + 1, n_channels + 1) sum of the matrices of the epochs of the class
+        :type moments: numpy.ndarray
+        :return: (n_channels, n_channels) covariance
+        :rtype: numpy.ndarray
+        """
+        return moments[:-1, :-1] / (moments[-1, -1] - 1)
+
+    def fit(self, X, y):
+        """
+        Method to estimate the CSP filters
+        :param X: (n_epochs, n_channels + 1, n_channels + 1) matrices of the training epochs, as returned by
+            compute_moments
+        :type X: numpy.ndarray
+        :param y: class of each epoch, two classes
+        :type y: numpy.ndarray
+        :return: the fitted CSP
+        :rtype: CovarianceCSP
+        """
+        from scipy.linalg import eigh
+        X = np.asarray(X)
+        y = np.asarray(y)
+        self.classes_ = np.unique(y)
+        if len(self.classes_) != 2:
+            raise ValueError('CovarianceCSP needs two classes, got ' + str(len(self.classes_)))
+        class_covariances = np.stack([self.get_class_covariance(moments=X[y == label].sum(axis=0))
+                                      for label in self.classes_])
+
+        # restrict to the principal subspace of the mean covariance (the rank of the data), as MNE does
+        reference_values, reference_vectors = np.linalg.eigh(class_covariances.mean(axis=0))
+        keep = reference_values > reference_values.max() * self.RANK_TOLERANCE
+        restriction = reference_vectors[:, keep].T
+        first = restriction @ class_covariances[0] @ restriction.T
+        second = restriction @ class_covariances[1] @ restriction.T
+        eigen_values, eigen_vectors = eigh(first, first + second)
+        eigen_vectors = restriction.T @ eigen_vectors
+
+        # most discriminative first: eigenvalues furthest from 0.5
+        order = np.argsort(np.abs(eigen_values - 0.5))[::-1]
+        self.evals_ = eigen_values[order]
+        self.filters_ = eigen_vectors[:, order].T
+        self.patterns_ = np.linalg.pinv(eigen_vectors[:, order])
+
+        power = self.get_power(X)
+        self.mean_ = power.mean(axis=0)
+        self.std_ = power.std(axis=0)
+        return self
+
+    def get_power(self, X) -> np.ndarray:
+        """
+        Method to compute the mean power of the spatially filtered epochs from their Gram matrices
+        :param X: (n_epochs, n_channels + 1, n_channels + 1) matrices, as returned by compute_moments
+        :type X: numpy.ndarray
+        :return: (n_epochs, n_components) mean power
+        :rtype: numpy.ndarray
+        """
+        X = np.asarray(X)
+        filters = self.filters_[:self.n_components]
+        power = np.einsum('kc,ecd,kd->ek', filters, X[:, :-1, :-1], filters, optimize=True)
+        return power / X[:, -1, -1:]
+
+    def transform(self, X) -> np.ndarray:
+        """
+        Method to compute the CSP features
+        :param X: (n_epochs, n_channels + 1, n_channels + 1) matrices, as returned by compute_moments
+        :type X: numpy.ndarray
+        :return: (n_epochs, n_components) log power, or standardised power when log is False
+        :rtype: numpy.ndarray
+        """
+        power = self.get_power(X)
+        if self.log:
+            return np.log(power)
+        return (power - self.mean_) / self.std_
@@ -0,0 +1,182 @@
+from Preprocessing.CSP.CovarianceCSP import CovarianceCSP
+from sklearn.discriminant_analysis import LinearDiscriminantAnalysis
+from sklearn.model_selection import ShuffleSplit
+from joblib import Parallel, delayed
+import numpy as np
+
+
+def score_fold(moments=None, epochs_data=None, labels=None, train_idx=None, test_idx=None,
+               n_components=4, window_length=None, window_starts=None) -> tuple:
+    """
+    Function run for each cross-validation fold: fits CSP + LDA on the training epochs and scores the test epochs,
+    on the training time range and on every sliding window
+    :param moments: (n_epochs, n_channels + 1, n_channels + 1) per-epoch matrices of the epochs cropped to the CSP
+        training time range, as returned by CovarianceCSP.compute_moments
+    :type moments: numpy.ndarray
+    :param epochs_data: (n_epochs, n_channels, n_times) full epochs the windows are taken from
+    :type epochs_data: numpy.ndarray
+    :param labels: class of each epoch
+    :type labels: numpy.ndarray
+    :param train_idx: training epochs of the fold
+    :type train_idx: numpy.ndarray
+    :param test_idx: test epochs of the fold
+    :type test_idx: numpy.ndarray
+    :param n_components: number of CSP components
+    :type n_components: int
+    :param window_length: window length in samples
+    :type window_length: int
+    :param window_starts: first sample of each window
+    :type window_starts: numpy.ndarray
+    :return: the accuracy on the training time range and the (n_windows,) accuracy of every window
+    :rtype: tuple
+    """
+    y_train, y_test = labels[train_idx], labels[test_idx]
+    csp = CovarianceCSP(n_components=n_components, log=True)
+    lda = LinearDiscriminantAnalysis()
+    lda.fit(csp.fit_transform(moments[train_idx], y_train), y_train)
+    score = lda.score(csp.transform(moments[test_idx]), y_test)
+
+    # spatially filter the test epochs once, then the features of all windows at once
+    sources = csp.filters_[:n_components] @ epochs_data[test_idx]
+    features = SlidingWindowCSP.window_log_power(sources=sources, window_length=window_length,
+                                                 window_starts=window_starts)
+    n_windows, n_test = features.shape[:2]
+    predictions = lda.predict(features.reshape(n_windows * n_test, -1)).reshape(n_windows, n_test)
+    return score, (predictions == y_test).mean(axis=1)
+
+
+class SlidingWindowCSP(object):
+    """
+    Time-resolved CSP decoding: CSP + LDA are fitted on each cross-validation fold and the test epochs are scored on
+    a window sliding over the epochs, giving the accuracy over time. The per-epoch covariance matrices of the training
+    time range are computed once and shared by the folds, each of which only sums them and solves a small
+    eigenproblem (CovarianceCSP, the same filters as CSP(reg=None)). The CSP log-power features of all windows are
+    computed at once from the cumulative sum of the squared spatially filtered signal, so each window costs two
+    subtractions instead of a CSP transform, all windows are classified in one batch, and the folds run in parallel
+    on threads (the covariance and eigenvalue computations release the GIL, and the epochs are shared instead of
+    being copied to worker processes). The features are the same as CSP(log=True).transform on each window.
+    """
+    # class level constants
+    N_FOLDS = 10
+    TEST_SIZE = 0.2
+    RANDOM_STATE = 42
+
+    # class level fields
+    n_components = None
+    window_length = None
+    window_step = None
+    n_folds = None
+    n_jobs = None
+    scores = None
+    scores_windows = None
+    window_starts = None
+
+    def __init__(self, n_components=4, window_length=100, window_step=20, n_folds=None, n_jobs=-1):
+        """
+        Constructor for the sliding-window CSP decoder
+        :param n_components: number of CSP components
+        :type n_components: int
+        :param window_length: window length in samples
+        :type window_length: int
+        :param window_step: window step in samples
+        :type window_step: int
+        :param n_folds: number of ShuffleSplit folds
+        :type n_folds: int
+        :param n_jobs: number of parallel folds, -1 for all cores
+        :type n_jobs: int
+        """
+        self.n_components = n_components
+        self.window_length = int(window_length)
+        self.window_step = int(window_step)
+        if n_folds is None:
+            n_folds = self.N_FOLDS
+        self.n_folds = n_folds
+        self.n_jobs = n_jobs
+
+    @classmethod
+    def from_config(cls, config=None, sfreq=None):
+        """
+        Method to create the decoder from the CSP_settings section of the config
+        :param config: the config settings
+        :type config: dict
+        :param sfreq: sampling frequency in Hz, to convert the window settings to samples
+        :type sfreq: float
+        :return: the decoder
+        :rtype: SlidingWindowCSP
+        """
+        settings = config['CSP_settings']
+        return cls(n_components=settings['num_components'],
+                   window_length=int(sfreq * settings.get('window_length', 0.5)),
+                   window_step=int(sfreq * settings.get('window_step', 0.1)),
+                   n_folds=settings.get('n_folds', cls.N_FOLDS), n_jobs=settings.get('n_jobs', -1))
+
+    @staticmethod
+    def window_log_power(sources=None, window_length=None, window_starts=None) -> np.ndarray:
+        """
+        Method to compute the log mean power of every window from a cumulative sum over time
+        :param sources: (n_epochs, n_components, n_times) spatially filtered epochs
+        :type sources: numpy.ndarray
+        :param window_length: window length in samples
+        :type window_length: int
+        :param window_starts: first sample of each window
+        :type window_starts: numpy.ndarray
+        :return: (n_windows, n_epochs, n_components) log mean power
+        :rtype: numpy.ndarray
+        """
+        cumulative = np.zeros(sources.shape[:-1] + (sources.shape[-1] + 1,))
+        np.cumsum(sources * sources, axis=-1, out=cumulative[..., 1:])
+        power = cumulative[..., window_starts + window_length] - cumulative[..., window_starts]
+        power /= window_length
+        return np.log(np.moveaxis(power, -1, 0))
+
+    def get_window_starts(self, n_times=None) -> np.ndarray:
+        """
+        Method to compute the first sample of every window, as in the running classifier of the DataLoader
+        :param n_times: number of samples of the epochs
+        :type n_times: int
+        :return: the window starts
+        :rtype: numpy.ndarray
+        """
+        return np.arange(0, n_times - self.window_length, self.window_step)
+
+    def get_window_times(self, sfreq=None, t_min=None) -> np.ndarray:
+        """
+        Method to compute the centre time of every window
+        :param sfreq: sampling frequency in Hz
+        :type sfreq: float
+        :param t_min: time of the first sample of the epochs in s
+        :type t_min: float
+        :return: the window times in s
+        :rtype: numpy.ndarray
+        """
+        return (self.window_starts + self.window_length / 2.) / sfreq + t_min
+
+    def score(self, epochs_data_train=None, epochs_data=None, labels=None, moments=None) -> np.ndarray:
+        """
+        Method to cross-validate the decoder, using the same ShuffleSplit folds as the running classifier in the
+        DataLoader
+        :param epochs_data_train: (n_epochs, n_channels, n_times) epochs cropped to the CSP training time range
+        :type epochs_data_train: numpy.ndarray
+        :param epochs_data: (n_epochs, n_channels, n_times) full epochs the windows are taken from
+        :type epochs_data: numpy.ndarray
+        :param labels: class of each epoch
+        :type labels: numpy.ndarray
+        :param moments: optionally, the per-epoch matrices of epochs_data_train computed before (e.g. from the stage
+            cache), as returned by CovarianceCSP.compute_moments
+        :type moments: numpy.ndarray
+        :return: (n_folds, n_windows) accuracy of every window in every fold, also kept in scores_windows; the
+            accuracy on the training time range is kept in scores
+        :rtype: numpy.ndarray
+        """
+        if moments is None:
+            moments = CovarianceCSP.compute_moments(epochs_data=epochs_data_train)
+        self.window_starts = self.get_window_starts(n_times=epochs_data.shape[2])
+        cv = ShuffleSplit(self.n_folds, test_size=self.TEST_SIZE, random_state=self.RANDOM_STATE)
+        results = Parallel(n_jobs=self.n_jobs, prefer='threads')(
+            delayed(score_fold)(moments=moments, epochs_data=epochs_data, labels=labels,
+                                train_idx=train_idx, test_idx=test_idx, n_components=self.n_components,
+                                window_length=self.window_length, window_starts=self.window_starts)
+            for train_idx, test_idx in cv.split(moments))
+        self.scores = np.array([score for score, _ in results])
+        self.scores_windows = np.array([scores_window for _, scores_window in results])
+        return self.scores_windows
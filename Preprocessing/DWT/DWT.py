@@ -1,8 +1,8 @@
 from Data.DataLoader import DataLoader
+from Preprocessing.DWT.WaveletDecomposition import WaveletDecomposition
 from Utilities.Config.Config import Config
 import platform
 import mne
-from mne.time_frequency import tfr_morlet
 
 
 class DWT(object):
@@ -12,19 +12,60 @@ class DWT(object):
     pandas_data = None
     data_loader = None
     data_loaded = False
+    experiment_id = None
+    provenance = None
 
-    def __init__(self, config=None):
+    def __init__(self, config=None, data_loader=None):
         self.config = config
-        self.data_loader = DataLoader(config=self.config)
+        # share the caller's data loader when one is given, instead of creating another one
+        if data_loader is None:
+            data_loader = DataLoader(config=self.config)
+        self.data_loader = data_loader
 
     def get_data(self) -> bool:
-        self.raw_mne_data = self.data_loader.load_data_from_sql(self.config['data']['experiment_id'])
+        self.experiment_id = self.config['data']['experiment_id']
+        self.raw_mne_data = self.data_loader.load_data_from_sql(self.experiment_id)
+        self.provenance = self.data_loader.data_provenance
         return True
 
-    def set_data(self, data=None):
+    def set_data(self, data=None, experiment_id=None, provenance=None):
+        # the experiment the data belongs to and how it was produced (e.g. DataLoader.data_provenance or
+        # Filter.output_provenance), if known, are used to cache the results in the stage cache
         self.raw_mne_data = data
+        self.experiment_id = experiment_id
+        self.provenance = provenance
 
-    def to_dwt(self):
+    def to_dwt(self, epochs=None):
+        """
+        Method to compute the multilevel discrete wavelet transform (DWT_settings) of the EEG channels of every epoch
+        :param epochs: the epochs, created from the loaded data by default
+        :type epochs: mne.Epochs
+        :return: the sub-band coefficients, each (n_epochs, n_channels, n_coefficients), and the energy,
+            relative_energy and entropy features, each (n_epochs, n_channels, n_bands)
+        :rtype: tuple
+        """
+        decomposition = WaveletDecomposition.from_config(config=self.config)
+        # epochs given by the caller are not tied to the experiment settings, and data of unknown origin (no
+        # provenance) could be any recording of the experiment, so neither is cached
+        experiment_id = self.experiment_id if epochs is None and self.provenance is not None else None
+
+        def compute():
+            data = epochs if epochs is not None else self.data_loader.create_mne_epochs(self.raw_mne_data)
+            coefficients, features = decomposition.transform(data=data.get_data(picks='eeg', copy=False))
+            arrays = {'coefficients_%d' % band: c for band, c in enumerate(coefficients)}
+            arrays.update(features)
+            return arrays, {'n_bands': len(coefficients)}
+
+        arrays, meta = self.data_loader.get_stage(experiment_id=experiment_id, stage='dwt',
+                                                  settings={'epochs_settings': self.config['epochs_settings'],
+                                                            'DWT_settings': self.config.get('DWT_settings', {}),
+                                                            'source': self.provenance},
+                                                  compute=compute)
+        coefficients = [arrays['coefficients_%d' % band] for band in range(meta['n_bands'])]
+        features = {name: arrays[name] for name in WaveletDecomposition.FEATURES}
+        return coefficients, features
+
+    def to_cwt(self):
         # create Epochs data
         epochs = self.data_loader.create_mne_epochs(self.raw_mne_data)
         # Morlet wavelet requires MNE Epochs format
@@ -44,4 +85,4 @@ if __name__ == '__main__':
     config = config.settings
     dwt = DWT(config=config)
     if dwt.get_data():
-        power, itc = dwt.to_dwt()
+        coefficients, features = dwt.to_dwt()
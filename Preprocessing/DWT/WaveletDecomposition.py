@@ -0,0 +1,137 @@
+import numpy as np
+
+
+class WaveletDecomposition(object):
+    """
+    Batched multilevel discrete wavelet transform of (..., n_times) arrays, e.g. (n_epochs, n_channels, n_times).
+    All signals are decomposed together along the last axis by pywt, in O(n_times) per signal, and each sub-band is
+    summarised by compact features: its energy, its share of the total energy and the Shannon entropy of its
+    normalised coefficient energies. With packet=True a full wavelet packet decomposition is used instead, which
+    splits the detail bands as well and gives 2**level equal-width sub-bands.
+    """
+    # class level constants
+    FEATURES = ['energy', 'relative_energy', 'entropy']
+
+    # class level fields
+    wavelet = None
+    level = None
+    mode = None
+    packet = None
+
+    def __init__(self, wavelet='db4', level=None, mode='symmetric', packet=False):
+        """
+        Constructor for the wavelet decomposition
+        :param wavelet: name of a discrete wavelet known to pywt, e.g. db4, sym5, coif3, haar
+        :type wavelet: str
+        :param level: number of decomposition levels, defaults to the largest useful level for the signal length
+        :type level: int
+        :param mode: signal extension mode, e.g. symmetric, periodization, zero
+        :type mode: str
+        :param packet: True for a wavelet packet decomposition
+        :type packet: bool
+        """
+        import pywt
+        if wavelet not in pywt.wavelist(kind='discrete'):
+            raise ValueError('unknown discrete wavelet ' + str(wavelet))
+        self.wavelet = wavelet
+        self.level = level
+        self.mode = mode
+        self.packet = packet
+
+    @classmethod
+    def from_config(cls, config=None):
+        """
+        Method to create the wavelet decomposition from the DWT_settings section of the config
+        :param config: the config settings
+        :type config: dict
+        :return: the wavelet decomposition
+        :rtype: WaveletDecomposition
+        """
+        settings = config.get('DWT_settings', {})
+        return cls(wavelet=settings.get('wavelet', 'db4'), level=settings.get('level') or None,
+                   mode=settings.get('mode', 'symmetric'), packet=bool(settings.get('packet', 0)))
+
+    def get_level(self, n_times=None) -> int:
+        """
+        Method to determine the number of levels for signals of a given length
+        :param n_times: length of the signals
+        :type n_times: int
+        :return: the configured level, or the largest level at which the filters still fit the coefficients
+        :rtype: int
+        """
+        import pywt
+        if self.level is not None:
+            return self.level
+        return max(pywt.dwt_max_level(n_times, pywt.Wavelet(self.wavelet).dec_len), 1)
+
+    def decompose(self, data=None) -> list:
+        """
+        Method to decompose the signals
+        :param data: (..., n_times) signals
+        :type data: numpy.ndarray
+        :return: list of (..., n_coefficients) sub-band coefficients; for the DWT [cA_n, cD_n, ..., cD_1], for the
+            wavelet packet the 2**level nodes of the last level in frequency order
+        :rtype: list
+        """
+        import pywt
+        data = np.asarray(data)
+        level = self.get_level(n_times=data.shape[-1])
+        if not self.packet:
+            return pywt.wavedec(data, self.wavelet, mode=self.mode, level=level, axis=-1)
+        packet = pywt.WaveletPacket(data, self.wavelet, mode=self.mode, maxlevel=level, axis=-1)
+        return [node.data for node in packet.get_level(level, order='freq')]
+
+    def get_band_names(self, n_times=None) -> list:
+        """
+        Method to name the sub-bands returned by decompose, e.g. A5, D5, ..., D1 or P0, ..., P31 for a packet
+        :param n_times: length of the signals
+        :type n_times: int
+        :return: the sub-band names
+        :rtype: list
+        """
+        level = self.get_level(n_times=n_times)
+        if self.packet:
+            return ['P%d' % node for node in range(2 ** level)]
+        return ['A%d' % level] + ['D%d' % band for band in range(level, 0, -1)]
+
+    def get_features(self, coefficients=None) -> dict:
+        """
+        Method to compute the features of every sub-band
+        :param coefficients: sub-band coefficients as returned by decompose
+        :type coefficients: list
+        :return: energy, relative_energy and entropy, each (..., n_bands)
+        :rtype: dict
+        """
+        energy = np.stack([np.einsum('...i,...i->...', c, c) for c in coefficients], axis=-1)
+        total = energy.sum(axis=-1, keepdims=True)
+        relative_energy = np.divide(energy, total, out=np.zeros_like(energy), where=total > 0)
+        entropy = np.empty_like(energy)
+        for band, c in enumerate(coefficients):
+            band_energy = energy[..., band:band + 1]
+            p = np.divide(c * c, band_energy, out=np.zeros(c.shape), where=band_energy > 0)
+            entropy[..., band] = -np.sum(p * np.log(np.where(p > 0, p, 1.0)), axis=-1)
+        return {'energy': energy, 'relative_energy': relative_energy, 'entropy': entropy}
+
+    def transform(self, data=None) -> tuple:
+        """
+        Method to decompose the signals and compute the sub-band features
+        :param data: (..., n_times) signals
+        :type data: numpy.ndarray
+        :return: the sub-band coefficients and the features, as returned by decompose and get_features
+        :rtype: tuple
+        """
+        coefficients = self.decompose(data=data)
+        return coefficients, self.get_features(coefficients=coefficients)
+
+    def feature_matrix(self, data=None) -> np.ndarray:
+        """
+        Method to compute a feature matrix for classifiers
+        :param data: (n_epochs, n_channels, n_times) signals
+        :type data: numpy.ndarray
+        :return: (n_epochs, n_channels * n_bands * 3) features, per channel and band: energy, relative energy and
+            entropy
+        :rtype: numpy.ndarray
+        """
+        features = self.get_features(coefficients=self.decompose(data=data))
+        stacked = np.stack([features[name] for name in self.FEATURES], axis=-1)
+        return stacked.reshape(stacked.shape[0], -1)
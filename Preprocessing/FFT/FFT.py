@@ -1,5 +1,7 @@
 from Data.DataLoader import DataLoader
+from Preprocessing.FFT.PSD import PSD
 from Utilities.Config.Config import Config
+import numpy as np
 import platform
 import mne
 
@@ -11,21 +13,77 @@ class FFT(object):
     pandas_data = None
     data_loader = None
     data_loaded = False
+    experiment_id = None
+    provenance = None
 
-    def __init__(self, config=None):
+    def __init__(self, config=None, data_loader=None):
         self.config = config
-        self.data_loader = DataLoader(config=self.config)
+        # share the caller's data loader when one is given, instead of creating another one
+        if data_loader is None:
+            data_loader = DataLoader(config=self.config)
+        self.data_loader = data_loader
 
     def get_data(self) -> bool:
-        self.raw_mne_data = self.data_loader.load_data_from_sql(self.config['data']['experiment_id'])
+        self.experiment_id = self.config['data']['experiment_id']
+        self.raw_mne_data = self.data_loader.load_data_from_sql(self.experiment_id)
+        self.provenance = self.data_loader.data_provenance
         return True
 
-    def set_data(self, data=None):
+    def set_data(self, data=None, experiment_id=None, provenance=None):
+        # the experiment the data belongs to and how it was produced (e.g. DataLoader.data_provenance or
+        # Filter.output_provenance), if known, are used to cache the results in the stage cache
         self.raw_mne_data = data
+        self.experiment_id = experiment_id
+        self.provenance = provenance
+
+    def create_psd(self) -> PSD:
+        """
+        Method to create the Welch estimator for the loaded data, with the defaults of MNE (n_fft=256, no overlap)
+        :return: the PSD estimator
+        :rtype: PSD
+        """
+        return PSD(sfreq=self.raw_mne_data.info['sfreq'])
 
     def to_fft(self):
-        psd, freqs = mne.time_frequency.psd_welch(inst=self.raw_mne_data)
-        return psd, freqs
+        # mne.time_frequency.psd_welch was removed from MNE, the batched estimator computes the same PSD of the
+        # data channels
+        picks = mne.pick_types(self.raw_mne_data.info, eeg=True)
+        psd_estimator = self.create_psd()
+        # data of unknown origin (no provenance) is not cached
+        arrays, _ = self.data_loader.get_stage(
+            experiment_id=self.experiment_id if self.provenance is not None else None, stage='psd',
+            settings={'n_fft': psd_estimator.n_fft, 'n_overlap': psd_estimator.n_overlap,
+                      'window': psd_estimator.window, 'source': self.provenance},
+            compute=lambda: ({'psd': psd_estimator.welch(data=self.raw_mne_data._data[picks])}, {}))
+        return arrays['psd'], psd_estimator.freqs
+
+    def band_power(self, epochs=None, per_window=False):
+        """
+        Method to compute the band powers (fft_settings.bands, mu and beta by default) of every epoch and EEG channel
+        :param epochs: the epochs, defaults to the whole loaded recording as a single epoch
+        :type epochs: mne.Epochs
+        :param per_window: True to return the band power of every Welch segment instead of the epoch average
+        :type per_window: bool
+        :return: (n_epochs, n_channels, n_bands) or (n_epochs, n_channels, n_segments, n_bands) band powers, and the
+            band names
+        :rtype: tuple
+        """
+        bands = self.config.get('fft_settings', {}).get('bands')
+        if bands is None:
+            bands = PSD.BANDS
+        if epochs is None:
+            picks = mne.pick_types(self.raw_mne_data.info, eeg=True)
+            data = self.raw_mne_data._data[np.newaxis, picks]
+            sfreq = self.raw_mne_data.info['sfreq']
+        else:
+            data = epochs.get_data(picks='eeg', copy=False)
+            sfreq = epochs.info['sfreq']
+        psd_estimator = PSD(sfreq=sfreq, n_fft=min(256, data.shape[-1]))
+        if per_window:
+            band_power = psd_estimator.window_band_power(data=data, bands=bands)
+        else:
+            band_power = psd_estimator.epoch_band_power(data=data, bands=bands)
+        return band_power, list(bands.keys())
 
 
 if __name__ == '__main__':
@@ -0,0 +1,242 @@
+from numpy.lib.stride_tricks import sliding_window_view
+from functools import lru_cache
+import numpy as np
+
+
+@lru_cache(maxsize=32)
+def get_window(window='hamming', n_per_seg=256) -> np.ndarray:
+    """
+    Function to create a (periodic) window for spectral estimation. Windows are cached and returned read-only, so
+    they are only computed once per (window, length).
+    :param window: window name understood by scipy.signal.get_window
+    :type window: str
+    :param n_per_seg: length of the window
+    :type n_per_seg: int
+    :return: the window
+    :rtype: numpy.ndarray
+    """
+    from scipy import signal
+    values = signal.get_window(window, n_per_seg)
+    values.setflags(write=False)
+    return values
+
+
+class PSD(object):
+    """
+    Batched Welch power spectral density estimator. The segments of every signal are strided views into the data,
+    so a whole batch (epochs x channels x segments) is detrended, windowed and transformed by batched rfft calls
+    over blocks of segments; signals of different lengths (e.g. several recordings) share the blocks. The defaults
+    and the result match mne.time_frequency.psd_array_welch (Hamming window, constant detrending, density scaling,
+    mean over segments), which replaces the removed psd_welch of MNE.
+    Band powers can be computed per signal (e.g. per epoch) or per segment (a sliding-window band power).
+    """
+    # class level constants
+    BANDS = {'mu': (8.0, 12.0), 'beta': (13.0, 30.0)}
+    BLOCK_BYTES = 32 * 1024 * 1024
+
+    # class level fields
+    sfreq = None
+    n_fft = None
+    n_per_seg = None
+    n_overlap = None
+    window = None
+    fmin = None
+    fmax = None
+    freqs = None
+    freq_mask = None
+
+    def __init__(self, sfreq=None, n_fft=256, n_per_seg=None, n_overlap=0, window='hamming', fmin=0.0,
+                 fmax=np.inf):
+        """
+        Constructor for the PSD estimator
+        :param sfreq: sampling frequency in Hz
+        :type sfreq: float
+        :param n_fft: length of the FFT, at least n_per_seg
+        :type n_fft: int
+        :param n_per_seg: length of each segment, defaults to n_fft
+        :type n_per_seg: int
+        :param n_overlap: number of samples shared by consecutive segments
+        :type n_overlap: int
+        :param window: window name understood by scipy.signal.get_window
+        :type window: str
+        :param fmin: lowest frequency returned, in Hz
+        :type fmin: float
+        :param fmax: highest frequency returned, in Hz
+        :type fmax: float
+        """
+        if n_per_seg is None:
+            n_per_seg = n_fft
+        if n_per_seg > n_fft:
+            raise ValueError('n_per_seg must not be larger than n_fft')
+        if n_overlap >= n_per_seg:
+            raise ValueError('n_overlap must be smaller than n_per_seg')
+        self.sfreq = float(sfreq)
+        self.n_fft = int(n_fft)
+        self.n_per_seg = int(n_per_seg)
+        self.n_overlap = int(n_overlap)
+        self.window = window
+        self.fmin = fmin
+        self.fmax = fmax
+        freqs = np.fft.rfftfreq(self.n_fft, 1.0 / self.sfreq)
+        self.freq_mask = (freqs >= fmin) & (freqs <= fmax)
+        if not self.freq_mask.any():
+            raise ValueError('no frequencies between fmin=%s and fmax=%s' % (fmin, fmax))
+        self.freqs = freqs[self.freq_mask]
+
+    def segments(self, data=None) -> np.ndarray:
+        """
+        Method to split signals into overlapping segments without copying them
+        :param data: (..., n_times) signals
+        :type data: numpy.ndarray
+        :return: (..., n_segments, n_per_seg) read-only strided view
+        :rtype: numpy.ndarray
+        """
+        if data.shape[-1] < self.n_per_seg:
+            raise ValueError('signals of %d samples are shorter than n_per_seg=%d' % (data.shape[-1], self.n_per_seg))
+        step = self.n_per_seg - self.n_overlap
+        return sliding_window_view(data, self.n_per_seg, axis=-1)[..., ::step, :]
+
+    def periodograms(self, data=None) -> np.ndarray:
+        """
+        Method to compute the modified periodogram of every segment in one batched rfft
+        :param data: (..., n_times) signals
+        :type data: numpy.ndarray
+        :return: (..., n_segments, n_freqs) power spectral densities, in units**2/Hz
+        :rtype: numpy.ndarray
+        """
+        return self._segment_periodograms(segments=self.segments(data=data))
+
+    def welch(self, data=None) -> np.ndarray:
+        """
+        Method to compute the Welch PSD, the mean of the segment periodograms. Long signals are transformed in blocks
+        of segments, so the temporary spectra stay within BLOCK_BYTES instead of growing with the recording.
+        :param data: (..., n_times) signals, e.g. (n_epochs, n_channels, n_times)
+        :type data: numpy.ndarray
+        :return: (..., n_freqs) power spectral densities, in units**2/Hz
+        :rtype: numpy.ndarray
+        """
+        segments = self.segments(data=data)
+        n_segments = segments.shape[-2]
+        # bytes of the windowed segments and complex spectrum of a single segment of every signal
+        segment_bytes = max(int(np.prod(segments.shape[:-2])), 1) * (self.n_per_seg + self.n_fft + 2) * 8
+        block = max(self.BLOCK_BYTES // segment_bytes, 1)
+        if block >= n_segments:
+            return self._segment_periodograms(segments=segments).mean(axis=-2)
+        psd = self._segment_periodograms(segments=segments[..., :block, :]).sum(axis=-2)
+        for start in range(block, n_segments, block):
+            psd += self._segment_periodograms(segments=segments[..., start:start + block, :]).sum(axis=-2)
+        psd /= n_segments
+        return psd
+
+    def welch_batch(self, data_list=None) -> list:
+        """
+        Method to compute the Welch PSDs of signals with different lengths, e.g. several recordings, in shared
+        batches: the detrended segments of all the signals are packed into blocks of rows of up to BLOCK_BYTES,
+        whatever signal they come from, each block goes through one rfft, and the periodograms of each signal are
+        summed from the rows it filled
+        :param data_list: list of (..., n_times) signals
+        :type data_list: list
+        :return: list of (..., n_freqs) power spectral densities
+        :rtype: list
+        """
+        segments = [self.segments(data=data) for data in data_list]
+        n_signals = [int(np.prod(signal_segments.shape[:-2])) for signal_segments in segments]
+        first_signal = np.concatenate([[0], np.cumsum(n_signals)]).astype(np.int64)
+        psd = np.zeros((first_signal[-1], len(self.freqs)))
+        # rows of a block: the windowed segment and its complex spectrum
+        block_rows = max(self.BLOCK_BYTES // ((self.n_per_seg + self.n_fft + 2) * 8), 1)
+        rows = np.empty((block_rows, self.n_per_seg))
+        # output signal and first row of every run of rows of a single signal in the block
+        targets = []
+        starts = []
+        n_rows = 0
+
+        def transform(n_rows=None):
+            power = self._segment_periodograms(segments=rows[:n_rows], detrended=True)
+            np.add.at(psd, np.concatenate(targets), np.add.reduceat(power, np.concatenate(starts), axis=0))
+            targets.clear()
+            starts.clear()
+
+        for index, signal_segments in enumerate(segments):
+            n_segments = signal_segments.shape[-2]
+            signal_segments = signal_segments.reshape(-1, n_segments, self.n_per_seg)
+            # whole signals per copy, or parts of one signal when its segments do not fit in a block
+            per_copy = max(block_rows // n_segments, 1)
+            for first in range(0, len(signal_segments), per_copy):
+                for segment in range(0, n_segments, block_rows):
+                    pieces = signal_segments[first:first + per_copy, segment:segment + block_rows]
+                    size = pieces.shape[0] * pieces.shape[1]
+                    if n_rows + size > block_rows:
+                        transform(n_rows=n_rows)
+                        n_rows = 0
+                    np.subtract(pieces, pieces.mean(axis=-1, keepdims=True),
+                                out=rows[n_rows:n_rows + size].reshape(pieces.shape))
+                    targets.append(first_signal[index] + first + np.arange(pieces.shape[0]))
+                    starts.append(n_rows + pieces.shape[1] * np.arange(pieces.shape[0]))
+                    n_rows += size
+        if n_rows > 0:
+            transform(n_rows=n_rows)
+        return [(psd[first_signal[index]:first_signal[index + 1]] / signal_segments.shape[-2]).reshape(
+                    signal_segments.shape[:-2] + (len(self.freqs),))
+                for index, signal_segments in enumerate(segments)]
+
+    def band_power(self, psd=None, bands=None) -> np.ndarray:
+        """
+        Method to integrate power spectral densities over frequency bands
+        :param psd: (..., n_freqs) power spectral densities from welch or periodograms
+        :type psd: numpy.ndarray
+        :param bands: band name to (low, high) in Hz, defaults to BANDS (mu and beta)
+        :type bands: dict
+        :return: (..., n_bands) band powers, in units**2, in the order of bands
+        :rtype: numpy.ndarray
+        """
+        if bands is None:
+            bands = self.BANDS
+        resolution = self.sfreq / self.n_fft
+        # (n_freqs, n_bands) indicator matrix, so all bands are summed by a single matrix product
+        weights = np.stack([(self.freqs >= low) & (self.freqs <= high) for low, high in bands.values()], axis=-1)
+        return psd @ (weights * resolution)
+
+    def epoch_band_power(self, data=None, bands=None) -> np.ndarray:
+        """
+        Method to compute the band powers of every signal, e.g. of every epoch and channel
+        :param data: (..., n_times) signals
+        :type data: numpy.ndarray
+        :param bands: band name to (low, high) in Hz, defaults to BANDS
+        :type bands: dict
+        :return: (..., n_bands) band powers
+        :rtype: numpy.ndarray
+        """
+        return self.band_power(psd=self.welch(data=data), bands=bands)
+
+    def window_band_power(self, data=None, bands=None) -> np.ndarray:
+        """
+        Method to compute the band powers of every segment, i.e. a sliding-window band power with a window of
+        n_per_seg samples and a step of n_per_seg - n_overlap samples
+        :param data: (..., n_times) signals
+        :type data: numpy.ndarray
+        :param bands: band name to (low, high) in Hz, defaults to BANDS
+        :type bands: dict
+        :return: (..., n_segments, n_bands) band powers
+        :rtype: numpy.ndarray
+        """
+        return self.band_power(psd=self.periodograms(data=data), bands=bands)
+
+    def _segment_periodograms(self, segments=None, detrended=False) -> np.ndarray:
+        window = get_window(self.window, self.n_per_seg)
+        # constant detrending and windowing, the only copy of the segments (already made when they are detrended)
+        if detrended:
+            windowed = segments
+        else:
+            windowed = segments - segments.mean(axis=-1, keepdims=True)
+        windowed *= window
+        spectrum = np.fft.rfft(windowed, n=self.n_fft, axis=-1)[..., self.freq_mask]
+        power = spectrum.real ** 2
+        power += spectrum.imag ** 2
+        # density scaling, with the power of the negative frequencies folded onto the positive ones
+        scale = np.full(self.freqs.shape, 2.0 / (self.sfreq * (window * window).sum()))
+        scale[self.freqs == 0] /= 2.0
+        if self.n_fft % 2 == 0:
+            scale[self.freqs == self.sfreq / 2.0] /= 2.0
+        power *= scale
+        return power
@@ -1,8 +1,15 @@
+from __future__ import annotations
 from Data.DataLoader import DataLoader
 from Utilities.Config.Config import Config
+from typing import TYPE_CHECKING
+import numpy as np
 import platform
 import mne
 
+# the filter designs import scipy.signal, which is only loaded when streaming or filter-bank filtering is used
+if TYPE_CHECKING:
+    from Preprocessing.Filters.StreamingFilter import StreamingFilter
+
 
 class Filter(object):
 
@@ -11,28 +18,99 @@ class Filter(object):
     pandas_data = None
     data_loader = None
     data_loaded = False
+    experiment_id = None
+    provenance = None
+    output_provenance = None
 
-    def __init__(self, config=None):
+    def __init__(self, config=None, data_loader=None):
         self.config = config
-        self.data_loader = DataLoader(config=self.config)
+        # share the caller's data loader when one is given, instead of creating another one
+        if data_loader is None:
+            data_loader = DataLoader(config=self.config)
+        self.data_loader = data_loader
 
     def get_data(self) -> bool:
-        self.raw_mne_data = self.data_loader.load_data_from_sql(self.config['data']['experiment_id'])
+        self.experiment_id = self.config['data']['experiment_id']
+        self.raw_mne_data = self.data_loader.load_data_from_sql(self.experiment_id)
+        self.provenance = self.data_loader.data_provenance
         return True
 
-    def set_data(self, data=None):
+    def set_data(self, data=None, experiment_id=None, provenance=None):
+        # the experiment the data belongs to and how it was produced (e.g. DataLoader.data_provenance or
+        # Filter.output_provenance), if known, are used to cache the results in the stage cache
         self.raw_mne_data = data
+        self.experiment_id = experiment_id
+        self.provenance = provenance
 
     def filter(self) -> mne.io.RawArray:
-        filtered_data = self.raw_mne_data.copy()
         low_pass_frequency = self.config['filter_settings']['low_pass_frequency']
         high_pass_frequency = self.config['filter_settings']['high_pass_frequency']
         if high_pass_frequency == 0:
             high_pass_frequency = None
-        filtered_data.filter(low_pass_frequency, high_pass_frequency, fir_design='firwin', skip_by_annotation='edge',
-                             picks='eeg')
+
+        def compute():
+            filtered_data = self.raw_mne_data.copy()
+            filtered_data.filter(low_pass_frequency, high_pass_frequency, fir_design='firwin',
+                                 skip_by_annotation='edge', picks='eeg')
+            return {'data': filtered_data._data}, {'highpass': filtered_data.info['highpass'],
+                                                   'lowpass': filtered_data.info['lowpass']}
+
+        # data of unknown origin is not cached, its key could not tell it from another recording of the experiment
+        settings = {'low_pass_frequency': low_pass_frequency, 'high_pass_frequency': high_pass_frequency,
+                    'source': self.provenance}
+        experiment_id = self.experiment_id if self.provenance is not None else None
+        arrays, meta = self.data_loader.get_stage(experiment_id=experiment_id, stage='filter', settings=settings,
+                                                  compute=compute)
+        info = self.raw_mne_data.info.copy()
+        with info._unlock():
+            info['highpass'] = meta['highpass']
+            info['lowpass'] = meta['lowpass']
+        filtered_data = mne.io.RawArray(arrays['data'], info, first_samp=self.raw_mne_data.first_samp, verbose=False)
+        filtered_data.set_annotations(self.raw_mne_data.annotations)
+        # the provenance of the filtered recording, to pass on to FFT or DWT set_data
+        self.output_provenance = None
+        if self.provenance is not None:
+            self.output_provenance = {'stage': 'filter', 'settings': settings}
         return filtered_data
 
+    def create_streaming_filter(self) -> StreamingFilter:
+        """
+        Method to design a streaming filter from filter_settings for the sampling rate of the loaded data
+        :return: the streaming filter, with a cleared state
+        :rtype: StreamingFilter
+        """
+        from Preprocessing.Filters.StreamingFilter import StreamingFilter
+        return StreamingFilter.from_config(config=self.config, sfreq=self.raw_mne_data.info['sfreq'])
+
+    def stream_filter(self, chunks=None):
+        """
+        Method to filter the EEG channels block by block with a stateful causal filter, without copying the
+        recording. By default the loaded recording is read in blocks of filter_settings.streaming.chunk_samples;
+        any iterable of consecutive (n_channels, n_samples) blocks, e.g. from a live acquisition, can be given instead.
+        :param chunks: iterable of (n_channels, n_samples) blocks
+        :return: generator of the filtered blocks
+        """
+        streaming_filter = self.create_streaming_filter()
+        if chunks is None:
+            chunk_samples = int(self.config['filter_settings'].get('streaming', {}).get('chunk_samples', 2000))
+            picks = mne.pick_types(self.raw_mne_data.info, eeg=True)
+            data = self.raw_mne_data._data
+            chunks = (data[picks, start:start + chunk_samples] for start in range(0, data.shape[1], chunk_samples))
+        return streaming_filter.process_stream(chunks=chunks)
+
+    def filter_bank(self, bands=None) -> np.ndarray:
+        """
+        Method to filter the EEG channels with every band of a filter bank in one pass, without copying the raw data
+        :param bands: list of (l_freq, h_freq) in Hz, defaults to filter_bank_settings.bands
+        :type bands: list
+        :return: (n_bands, n_channels, n_samples) filtered EEG
+        :rtype: numpy.ndarray
+        """
+        from Preprocessing.Filters.FilterBank import FilterBank
+        filter_bank = FilterBank.from_config(config=self.config, sfreq=self.raw_mne_data.info['sfreq'], bands=bands)
+        picks = mne.pick_types(self.raw_mne_data.info, eeg=True)
+        return filter_bank.apply(data=self.raw_mne_data._data[picks])
+
 
 if __name__ == '__main__':
     if platform.system() == 'Windows':
@@ -43,4 +121,13 @@ if __name__ == '__main__':
         filename = '/Users/teganasprey/Desktop/BCI/Utilities/Config/config_tegan.json'
 
     config = Config(file_name=filename)
-    config = config.settings
\ No newline at end of file
+    config = config.settings
+    data_filter = Filter(config=config)
+    if data_filter.get_data():
+        # after its warm-up, the streamed FIR filter matches the offline filter
+        streaming_filter = data_filter.create_streaming_filter()
+        if streaming_filter.design == 'fir':
+            picks = mne.pick_types(data_filter.raw_mne_data.info, eeg=True)
+            error = streaming_filter.get_offline_error(data=data_filter.raw_mne_data._data[picks])
+            print('Streamed FIR filter (%d taps): max relative difference to the offline filter %.1e' %
+                  (streaming_filter.num_taps, error))
@@ -0,0 +1,121 @@
+from Preprocessing.Filters.StreamingFilter import StreamingFilter
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from scipy import signal
+import numpy as np
+import os
+
+
+@lru_cache(maxsize=128)
+def design_band(sfreq=None, band=None, design='iir', order=4) -> StreamingFilter:
+    """
+    Function to design the filter of one band. Designs are cached by (sfreq, band, design, order), so repeated
+    filter-bank calls over many recordings only design each band once.
+    :param sfreq: sampling frequency in Hz
+    :type sfreq: float
+    :param band: (l_freq, h_freq) in Hz, either edge may be None
+    :type band: tuple
+    :param design: 'iir' or 'fir'
+    :type design: str
+    :param order: order of the IIR filter
+    :type order: int
+    :return: the designed filter, only its coefficients (sos or taps) are used
+    :rtype: StreamingFilter
+    """
+    return StreamingFilter(sfreq=sfreq, l_freq=band[0], h_freq=band[1], design=design, order=order)
+
+
+class FilterBank(object):
+    """
+    Filter bank that applies many frequency bands to a recording in one pass, e.g. for filter-bank CSP. The output
+    is a single (n_bands, n_channels, n_samples) array; the (band, channel block) pairs are filtered concurrently on
+    a thread pool, since scipy releases the GIL while filtering. Filtering is zero-phase: forward-backward
+    second-order sections for the IIR design, and a centred linear-phase convolution for the FIR design.
+    """
+    # class level constants
+    CHANNEL_BLOCK = 4
+
+    # class level fields
+    sfreq = None
+    bands = None
+    design = None
+    order = None
+    max_workers = None
+    channel_block = None
+
+    def __init__(self, sfreq=None, bands=None, design='iir', order=4, max_workers=None, channel_block=None):
+        """
+        Constructor for the filter bank
+        :param sfreq: sampling frequency in Hz
+        :type sfreq: float
+        :param bands: list of (l_freq, h_freq) in Hz
+        :type bands: list
+        :param design: 'iir' or 'fir'
+        :type design: str
+        :param order: order of the IIR filters
+        :type order: int
+        :param max_workers: number of threads, defaults to the number of cores
+        :type max_workers: int
+        :param channel_block: number of channels filtered per task
+        :type channel_block: int
+        """
+        self.sfreq = float(sfreq)
+        self.bands = [(band[0] or None, band[1] or None) for band in bands]
+        self.design = design
+        self.order = order
+        if not max_workers:
+            max_workers = os.cpu_count()
+        self.max_workers = max_workers
+        if not channel_block:
+            channel_block = self.CHANNEL_BLOCK
+        self.channel_block = channel_block
+
+    @classmethod
+    def from_config(cls, config=None, sfreq=None, bands=None):
+        """
+        Method to create a filter bank from the filter_bank_settings section of the config
+        :param config: the config settings
+        :type config: dict
+        :param sfreq: sampling frequency in Hz
+        :type sfreq: float
+        :param bands: list of (l_freq, h_freq) in Hz, defaults to filter_bank_settings.bands
+        :type bands: list
+        :return: the filter bank
+        :rtype: FilterBank
+        """
+        settings = config['filter_bank_settings']
+        if bands is None:
+            bands = settings['bands']
+        return cls(sfreq=sfreq, bands=bands, design=settings.get('design', 'iir'), order=settings.get('order', 4),
+                   max_workers=settings.get('max_workers'), channel_block=settings.get('channel_block'))
+
+    def apply(self, data=None) -> np.ndarray:
+        """
+        Method to filter a signal with every band of the bank
+        :param data: (n_channels, n_samples) signal
+        :type data: numpy.ndarray
+        :return: (n_bands, n_channels, n_samples) filtered signal
+        :rtype: numpy.ndarray
+        """
+        data = np.atleast_2d(np.asarray(data, dtype=np.float64))
+        n_channels = data.shape[0]
+        filtered = np.empty((len(self.bands),) + data.shape)
+        filters = [design_band(self.sfreq, band, self.design, self.order) for band in self.bands]
+        tasks = [(band_index, start) for band_index in range(len(self.bands))
+                 for start in range(0, n_channels, self.channel_block)]
+
+        def filter_block(task):
+            band_index, start = task
+            stop = min(start + self.channel_block, n_channels)
+            band_filter = filters[band_index]
+            if self.design == 'iir':
+                filtered[band_index, start:stop] = signal.sosfiltfilt(band_filter.sos, data[start:stop], axis=-1)
+            else:
+                filtered[band_index, start:stop] = signal.oaconvolve(data[start:stop],
+                                                                     band_filter.taps[np.newaxis, :],
+                                                                     mode='same', axes=-1)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # consume the iterator so exceptions in the workers are raised here
+            list(executor.map(filter_block, tasks))
+        return filtered
@@ -0,0 +1,176 @@
+from scipy import signal
+import numpy as np
+
+
+class StreamingFilter(object):
+    """
+    Stateful filter for signals that arrive block by block. The filter is designed once, either as a Butterworth
+    IIR filter in second-order sections or as the windowed FIR filter of MNE (fir_design='firwin', as used by
+    Filter.filter) applied with overlap-save, and the filter state is carried from one block to the next. Filtering
+    a recording in consecutive blocks therefore gives the same result as filtering it in one pass with the same
+    (causal) filter, using memory proportional to the block size. Unlike the zero-phase offline filter of MNE, the
+    output is causal: the FIR design delays the signal by (num_taps - 1) / 2 samples, and both designs have a
+    warm-up transient at the start of the stream. After the warm-up of the FIR design, the delayed stream equals the
+    offline result of MNE (get_offline_error).
+    """
+    # class level constants
+    DESIGNS = ['iir', 'fir']
+
+    # class level fields
+    sfreq = None
+    l_freq = None
+    h_freq = None
+    design = None
+    order = None
+    num_taps = None
+    btype = None
+    sos = None
+    taps = None
+
+    zi = None
+    history = None
+
+    def __init__(self, sfreq=None, l_freq=None, h_freq=None, design='iir', order=4, num_taps=None):
+        """
+        Constructor for the streaming filter, following the l_freq / h_freq convention of MNE: l_freq alone is a
+        high-pass, h_freq alone a low-pass and both together a band-pass filter
+        :param sfreq: sampling frequency in Hz
+        :type sfreq: float
+        :param l_freq: lower pass-band edge in Hz, or None
+        :type l_freq: float
+        :param h_freq: upper pass-band edge in Hz, or None
+        :type h_freq: float
+        :param design: 'iir' (Butterworth, second-order sections) or 'fir' (Hamming windowed, overlap-save)
+        :type design: str
+        :param order: order of the IIR filter
+        :type order: int
+        :param num_taps: length of the FIR filter, by default (and at least) the length MNE chooses for the
+            transition bandwidth
+        :type num_taps: int
+        """
+        if design not in self.DESIGNS:
+            raise ValueError('unknown filter design ' + str(design))
+        if l_freq is None and h_freq is None:
+            raise ValueError('at least one of l_freq and h_freq must be given')
+        self.sfreq = float(sfreq)
+        self.l_freq = l_freq
+        self.h_freq = h_freq
+        self.design = design
+        self.order = order
+        if l_freq is not None and h_freq is not None:
+            self.btype = 'bandpass'
+        elif l_freq is not None:
+            self.btype = 'highpass'
+        else:
+            self.btype = 'lowpass'
+
+        if design == 'iir':
+            cutoff = [f for f in (l_freq, h_freq) if f is not None]
+            self.sos = signal.butter(order, cutoff if len(cutoff) > 1 else cutoff[0], btype=self.btype,
+                                     output='sos', fs=self.sfreq)
+        else:
+            # the taps of the offline filter (Filter.filter), so that the streamed output can match it
+            import mne
+            self.taps = mne.filter.create_filter(data=None, sfreq=self.sfreq, l_freq=l_freq, h_freq=h_freq,
+                                                 filter_length='auto' if num_taps is None else num_taps,
+                                                 fir_design='firwin', verbose=False)
+            num_taps = len(self.taps)
+        self.num_taps = num_taps
+        self.reset()
+
+    @classmethod
+    def from_config(cls, config=None, sfreq=None):
+        """
+        Method to create a streaming filter from the filter_settings section of the config
+        :param config: the config settings
+        :type config: dict
+        :param sfreq: sampling frequency in Hz
+        :type sfreq: float
+        :return: the streaming filter
+        :rtype: StreamingFilter
+        """
+        settings = config['filter_settings']
+        streaming = settings.get('streaming', {})
+        l_freq = settings['low_pass_frequency'] or None
+        h_freq = settings['high_pass_frequency'] or None
+        return cls(sfreq=sfreq, l_freq=l_freq, h_freq=h_freq, design=streaming.get('design', 'iir'),
+                   order=streaming.get('order', 4), num_taps=streaming.get('num_taps') or None)
+
+    def reset(self):
+        """
+        Method to clear the filter state, e.g. before starting a new stream
+        """
+        self.zi = None
+        self.history = None
+
+    def process(self, chunk=None) -> np.ndarray:
+        """
+        Method to filter the next block of the stream
+        :param chunk: (n_channels, n_samples) block, following the previous block in time
+        :type chunk: numpy.ndarray
+        :return: the filtered block, with the same shape
+        :rtype: numpy.ndarray
+        """
+        chunk = np.atleast_2d(np.asarray(chunk, dtype=np.float64))
+        if self.design == 'iir':
+            if self.zi is None:
+                self.zi = np.zeros((self.sos.shape[0], chunk.shape[0], 2))
+            filtered, self.zi = signal.sosfilt(self.sos, chunk, axis=-1, zi=self.zi)
+            return filtered
+        # overlap-save: keep the last num_taps - 1 input samples and only compute the valid part of the convolution
+        if self.history is None:
+            self.history = np.zeros((chunk.shape[0], self.num_taps - 1))
+        extended = np.concatenate([self.history, chunk], axis=-1)
+        filtered = signal.oaconvolve(extended, self.taps[np.newaxis, :], mode='valid', axes=-1)
+        self.history = extended[:, extended.shape[1] - (self.num_taps - 1):]
+        return filtered
+
+    def process_stream(self, chunks=None):
+        """
+        Method to filter an iterable of consecutive blocks, e.g. a live acquisition or a recording read in pieces
+        :param chunks: iterable of (n_channels, n_samples) blocks
+        :return: generator of the filtered blocks
+        """
+        for chunk in chunks:
+            yield self.process(chunk=chunk)
+
+    def filter_offline(self, data=None) -> np.ndarray:
+        """
+        Method to apply the same causal filter to a whole signal in one pass, from a zero initial state, which the
+        streamed output is equal to whatever the block sizes
+        :param data: (n_channels, n_samples) signal
+        :type data: numpy.ndarray
+        :return: the filtered signal
+        :rtype: numpy.ndarray
+        """
+        if self.design == 'iir':
+            return signal.sosfilt(self.sos, data, axis=-1)
+        return signal.lfilter(self.taps, 1.0, data, axis=-1)
+
+    def get_offline_error(self, data=None, chunk_samples=2000) -> float:
+        """
+        Method to compare the streamed output of the FIR design with the zero-phase offline filter of MNE
+        (mne.filter.filter_data with fir_design='firwin' and the same taps, as in Filter.filter). The zero-phase
+        filter applies the taps without their delay, so the stream delayed by (num_taps - 1) / 2 samples is compared
+        with it once the num_taps - 1 samples of the warm-up have passed. The filter state is reset.
+        :param data: (n_channels, n_samples) signal, longer than num_taps
+        :type data: numpy.ndarray
+        :param chunk_samples: number of samples of each streamed block
+        :type chunk_samples: int
+        :return: the largest absolute difference after the warm-up, relative to the largest absolute offline value
+        :rtype: float
+        """
+        import mne
+        if self.design != 'fir':
+            raise ValueError('the IIR design is not comparable with the offline FIR filter of MNE')
+        data = np.atleast_2d(np.asarray(data, dtype=np.float64))
+        self.reset()
+        streamed = np.concatenate(list(self.process_stream(
+            chunks=(data[:, start:start + chunk_samples] for start in range(0, data.shape[1], chunk_samples)))),
+            axis=-1)
+        self.reset()
+        offline = mne.filter.filter_data(data, sfreq=self.sfreq, l_freq=self.l_freq, h_freq=self.h_freq,
+                                         filter_length=self.num_taps, fir_design='firwin', verbose=False)
+        delay = (self.num_taps - 1) // 2
+        difference = streamed[:, self.num_taps - 1:] - offline[:, self.num_taps - 1 - delay:data.shape[1] - delay]
+        return float(np.abs(difference).max() / max(np.abs(offline).max(), np.finfo(float).tiny))
@@ -0,0 +1,178 @@
+import numpy as np
+import hashlib
+import json
+import time
+import os
+
+
+class StageCache(object):
+    """
+    Content-addressed on-disk cache for the outputs of processing stages (loaded signals, filtered recordings,
+    epochs, PSD or wavelet features). An entry is keyed by a hash of the experiment, the stage name and the config
+    settings the stage depends on, so changing a setting addresses a different entry and nothing has to be
+    invalidated by hand. Arrays are stored as .npy files and opened as copy-on-write memory maps. The cache is bounded
+    in size, the least recently used entries are removed first, and hits and misses are counted.
+    """
+    # class level constants
+    CACHE_VERSION = 1
+    META_SUFFIX = '.json'
+
+    # class level fields
+    directory = None
+    max_bytes = None
+    hits = 0
+    misses = 0
+    evictions = 0
+
+    def __init__(self, directory=None, max_bytes=None):
+        """
+        Constructor for the stage cache
+        :param directory: directory where the entries are stored
+        :type directory: str
+        :param max_bytes: size limit of the cache, None for no limit
+        :type max_bytes: int
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def get_key(self, experiment_id=None, stage=None, settings=None) -> str:
+        """
+        Method to compute the key of an entry
+        :param experiment_id: the experiment the stage was computed for
+        :type experiment_id: int
+        :param stage: name of the stage, e.g. filter, epochs, psd
+        :type stage: str
+        :param settings: the config settings the output depends on, e.g. {'filter_settings': {...}}
+        :type settings: dict
+        :return: hex digest, used as the base name of the entry files
+        :rtype: str
+        """
+        content = json.dumps({'version': self.CACHE_VERSION, 'experiment_id': experiment_id, 'stage': stage,
+                              'settings': settings}, sort_keys=True, default=str)
+        return stage + '-' + hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    def load(self, key=None):
+        """
+        Method to open an entry
+        :param key: the key of the entry
+        :type key: str
+        :return: the arrays (copy-on-write memory maps) and the metadata of the entry, or None when it is missing
+        :rtype: tuple
+        """
+        base = os.path.join(self.directory, key)
+        try:
+            with open(base + self.META_SUFFIX, 'r') as f:
+                meta = json.load(f)
+            arrays = {name: np.load(base + '.' + name + '.npy', mmap_mode='c') for name in meta['arrays']}
+        except (FileNotFoundError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        # the modification time of the sidecar is the last access time used for the LRU eviction
+        os.utime(base + self.META_SUFFIX)
+        self.hits += 1
+        return arrays, meta['meta']
+
+    def store(self, key=None, arrays=None, meta=None):
+        """
+        Method to write an entry and evict the least recently used entries beyond the size limit. The arrays are
+        written first and the sidecar last, each through a temporary file, so an interrupted write is never loaded.
+        :param key: the key of the entry
+        :type key: str
+        :param arrays: name to array
+        :type arrays: dict
+        :param meta: json serialisable metadata, e.g. the sampling frequency
+        :type meta: dict
+        """
+        base = os.path.join(self.directory, key)
+        for name, array in arrays.items():
+            temp_name = base + '.' + name + '.npy.tmp'
+            with open(temp_name, 'wb') as f:
+                np.save(f, np.asarray(array))
+            os.replace(temp_name, base + '.' + name + '.npy')
+        temp_name = base + self.META_SUFFIX + '.tmp'
+        with open(temp_name, 'w') as f:
+            json.dump({'arrays': list(arrays.keys()), 'meta': meta if meta is not None else {},
+                       'created': time.time()}, f, default=str)
+        os.replace(temp_name, base + self.META_SUFFIX)
+        self.evict(keep=key)
+
+    def get_or_compute(self, experiment_id=None, stage=None, settings=None, compute=None) -> tuple:
+        """
+        Method to load a stage from the cache, computing and storing it on a miss
+        :param experiment_id: the experiment the stage is computed for
+        :type experiment_id: int
+        :param stage: name of the stage
+        :type stage: str
+        :param settings: the config settings the output depends on
+        :type settings: dict
+        :param compute: callable without arguments returning (arrays, meta) as passed to store
+        :return: the arrays and the metadata
+        :rtype: tuple
+        """
+        key = self.get_key(experiment_id=experiment_id, stage=stage, settings=settings)
+        entry = self.load(key=key)
+        if entry is not None:
+            return entry
+        arrays, meta = compute()
+        self.store(key=key, arrays=arrays, meta=meta)
+        entry = self.load(key=key)
+        # the lookup above is counted as the miss
+        self.hits -= 1
+        return entry
+
+    def list_entries(self) -> list:
+        """
+        Method to list the entries of the cache
+        :return: (last access time, size in bytes, key) of every entry, least recently used first
+        :rtype: list
+        """
+        entries = {}
+        for file_name in os.listdir(self.directory):
+            if file_name.endswith('.tmp'):
+                continue
+            key = file_name.split('.')[0]
+            entry = entries.setdefault(key, [0.0, 0, key])
+            stat = os.stat(os.path.join(self.directory, file_name))
+            entry[1] += stat.st_size
+            if file_name.endswith(self.META_SUFFIX):
+                entry[0] = stat.st_mtime
+        return sorted(tuple(entry) for entry in entries.values())
+
+    def evict(self, keep=None):
+        """
+        Method to remove the least recently used entries until the cache is within max_bytes
+        :param keep: key of an entry that is never removed, e.g. the one just stored
+        :type keep: str
+        """
+        if self.max_bytes is None:
+            return
+        entries = self.list_entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            for file_name in os.listdir(self.directory):
+                if file_name.split('.')[0] == key:
+                    try:
+                        os.remove(os.path.join(self.directory, file_name))
+                    except FileNotFoundError:
+                        pass
+            total -= size
+            self.evictions += 1
+
+    def get_stats(self) -> dict:
+        """
+        Method to report the cache statistics
+        :return: hits, misses, hit rate, evictions, number of entries and size in bytes
+        :rtype: dict
+        """
+        entries = self.list_entries()
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions, 'entries': len(entries), 'bytes': sum(size for _, size, _ in entries)}
@@ -0,0 +1,116 @@
+import numpy as np
+import struct
+import io
+
+
+class CopyStream(object):
+    """
+    File-like object that encodes in-memory column arrays for COPY ... FROM STDIN. Rows are encoded in chunks of
+    a bounded size when psycopg2 reads from the stream, so the whole table is never materialised as text. The
+    Postgres binary COPY format is used when every target column has a fixed-width numeric type, otherwise the
+    stream falls back to CSV.
+    """
+    # class level constants
+    BINARY_TYPES = {'smallint': '>i2', 'integer': '>i4', 'bigint': '>i8', 'real': '>f4', 'double precision': '>f8'}
+    BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+    BINARY_TRAILER = struct.pack('>h', -1)
+
+    # class level fields
+    sources = None
+    n_rows = None
+    chunk_rows = None
+    copy_format = None
+    row_dtype = None
+    csv_formats = None
+
+    position = 0
+    buffer = None
+    finished = False
+
+    def __init__(self, sources=None, column_types=None, n_rows=None, chunk_rows=50000):
+        """
+        Constructor for the COPY stream
+        :param sources: one entry per column, either a scalar, a 1-D array of length n_rows or a callable that
+        takes (start, stop) and returns the values of those rows
+        :type sources: list
+        :param column_types: Postgres data type of each column, as reported by information_schema
+        :type column_types: list
+        :param n_rows: number of rows to stream
+        :type n_rows: int
+        :param chunk_rows: number of rows encoded at a time
+        :type chunk_rows: int
+        """
+        self.sources = sources
+        self.n_rows = n_rows
+        self.chunk_rows = chunk_rows
+        self.buffer = io.BytesIO()
+        if all(column_type in self.BINARY_TYPES for column_type in column_types):
+            self.copy_format = 'binary'
+            fields = [('field_count', '>i2')]
+            for i, column_type in enumerate(column_types):
+                fields += [('length_' + str(i), '>i4'), ('value_' + str(i), self.BINARY_TYPES[column_type])]
+            self.row_dtype = np.dtype(fields)
+            self.buffer.write(self.BINARY_HEADER)
+        else:
+            self.copy_format = 'csv'
+            self.csv_formats = ['%d' if column_type in ('smallint', 'integer', 'bigint') else '%.17g'
+                                for column_type in column_types]
+        self.buffer.seek(0)
+
+    @staticmethod
+    def row_index(start, stop) -> np.ndarray:
+        """
+        Column source that yields the position of each row, e.g. for a sample_index column
+        """
+        return np.arange(start, stop)
+
+    def get_copy_options(self) -> str:
+        """
+        Method to get the WITH clause matching the format of the stream
+        :return: options to append to the COPY ... FROM STDIN statement
+        :rtype: str
+        """
+        return 'WITH (FORMAT ' + self.copy_format + ')'
+
+    def read(self, size=-1) -> bytes:
+        """
+        Method called by psycopg2 to pull the next block of encoded rows
+        :param size: maximum number of bytes to return, -1 for everything that is left
+        :type size: int
+        :return: the encoded bytes, empty once the stream is exhausted
+        :rtype: bytes
+        """
+        data = self.buffer.read(size)
+        while (size < 0 or len(data) < size) and not self.finished:
+            self._encode_next_chunk()
+            data += self.buffer.read(-1 if size < 0 else size - len(data))
+        return data
+
+    def _column_values(self, source, start, stop):
+        if callable(source):
+            return source(start, stop)
+        if np.ndim(source) == 0:
+            return source
+        return source[start:stop]
+
+    def _encode_next_chunk(self):
+        start = self.position
+        stop = min(start + self.chunk_rows, self.n_rows)
+        self.buffer = io.BytesIO()
+        if self.copy_format == 'binary':
+            rows = np.empty(stop - start, dtype=self.row_dtype)
+            rows['field_count'] = len(self.sources)
+            for i, source in enumerate(self.sources):
+                rows['length_' + str(i)] = rows.dtype['value_' + str(i)].itemsize
+                rows['value_' + str(i)] = self._column_values(source, start, stop)
+            self.buffer.write(rows.tobytes())
+            if stop == self.n_rows:
+                self.buffer.write(self.BINARY_TRAILER)
+        elif stop > start:
+            rows = np.empty((stop - start, len(self.sources)), dtype=np.float64)
+            for i, source in enumerate(self.sources):
+                rows[:, i] = self._column_values(source, start, stop)
+            np.savetxt(self.buffer, rows, fmt=self.csv_formats, delimiter=',')
+        self.buffer.seek(0)
+        self.position = stop
+        self.finished = stop == self.n_rows
@@ -1,5 +1,12 @@
-import psycopg2 as pg
-import pandas as pd
+from __future__ import annotations
+from psycopg2 import pool as pg_pool
+from typing import TYPE_CHECKING
+import threading
+import uuid
+import os
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 class PostgresConnector(object):
@@ -9,19 +16,84 @@ class PostgresConnector(object):
     PWD = 'root'
     HOST = '127.0.0.1'
     PORT = '5432'
+    POOL_MIN_CONNECTIONS = 1
+    POOL_MAX_CONNECTIONS = 10
+
+    # process-wide connection pool shared by all connectors, recreated after a fork
+    pool = None
+    pool_pid = None
+    pool_slots = None
+    pool_lock = threading.Lock()
 
     connection = None
+    connection_pool = None
+    connection_slots = None
     cursor = None
     connected = None
 
-    def __init__(self):
-        self.connection = pg.connect(database=self.DATABASE, user=self.USER, password=self.PWD, host=self.HOST,
-                                              port=self.PORT)
+    def __init__(self, config=None):
+        """
+        Constructor for the Postgres connector, which checks a connection out of the process-wide pool. Use it as a
+        context manager (or call close_connection) to return the connection to the pool.
+        :param config: the config settings, whose "database" section holds the credentials and pool size
+        :type config: dict
+        """
+        self.connection_pool = self.get_pool(config=config)
+        self.connection_slots = self.pool_slots
+        self.connection_slots.acquire()
+        try:
+            self.connection = self.connection_pool.getconn()
+        except Exception:
+            self.connection_slots.release()
+            raise
         self.cursor = self.connection.cursor()
         self.connected = True
 
-    def execute_query(self, sql_query=None) -> list:
-        self.cursor.execute(sql_query)
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close_connection()
+        return False
+
+    @classmethod
+    def get_pool(cls, config=None) -> pg_pool.ThreadedConnectionPool:
+        """
+        Method to get the process-wide connection pool, creating it on first use. The credentials and pool size
+        are read from the "database" section of the config, with the class constants as defaults.
+        :param config: the config settings
+        :type config: dict
+        :return: the connection pool
+        :rtype: psycopg2.pool.ThreadedConnectionPool
+        """
+        with cls.pool_lock:
+            if cls.pool is None or cls.pool_pid != os.getpid():
+                settings = {} if config is None else config.get('database', {})
+                max_connections = int(settings.get('pool_max_connections', cls.POOL_MAX_CONNECTIONS))
+                cls.pool = pg_pool.ThreadedConnectionPool(
+                    minconn=int(settings.get('pool_min_connections', cls.POOL_MIN_CONNECTIONS)),
+                    maxconn=max_connections,
+                    database=settings.get('name', cls.DATABASE), user=settings.get('user', cls.USER),
+                    password=settings.get('password', cls.PWD), host=settings.get('host', cls.HOST),
+                    port=settings.get('port', cls.PORT))
+                # checkouts block on this semaphore instead of failing when the pool is exhausted
+                cls.pool_slots = threading.BoundedSemaphore(max_connections)
+                cls.pool_pid = os.getpid()
+        return cls.pool
+
+    @classmethod
+    def close_pool(cls):
+        """
+        Method to close every connection of the process-wide pool
+        """
+        with cls.pool_lock:
+            if cls.pool is not None and cls.pool_pid == os.getpid():
+                cls.pool.closeall()
+            cls.pool = None
+            cls.pool_pid = None
+
+    def execute_query(self, sql_query=None, parameters=None) -> list:
+        self.cursor.execute(sql_query, parameters)
         rows = self.cursor.fetchall()
         return rows
 
@@ -30,22 +102,64 @@ class PostgresConnector(object):
         rows = self.cursor.fetchall()
 
         # now create a Pandas DataFrame from the results
+        import pandas as pd
         columns = []
         for desc in self.cursor.description:
             columns.append(desc.name)
         df = pd.DataFrame(data=rows, columns=columns)
         return df
 
-    def execute(self, sql_query=None):
-        self.cursor.execute(sql_query)
+    def execute_query_chunks(self, sql_query=None, chunk_size=50000, parameters=None):
+        # a named (server-side) cursor keeps the result set on the server and sends chunk_size rows at a time
+        cursor = self.connection.cursor(name='chunks_' + uuid.uuid4().hex)
+        cursor.itersize = chunk_size
+        try:
+            cursor.execute(sql_query, parameters)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+    def execute(self, sql_query=None, commit=True, parameters=None):
+        self.cursor.execute(sql_query, parameters)
+        if commit:
+            self.connection.commit()
+
+    def copy_from_stream(self, sql_query=None, stream=None, size=65536, commit=True):
+        self.cursor.copy_expert(sql=sql_query, file=stream, size=size)
+        if commit:
+            self.connection.commit()
+
+    def commit(self):
         self.connection.commit()
 
+    def get_column_types(self, table_name=None) -> dict:
+        self.cursor.execute('select column_name, data_type from information_schema.columns where table_name = %s',
+                            (table_name,))
+        rows = self.cursor.fetchall()
+        return {column_name: data_type for column_name, data_type in rows}
+
+    def has_table(self, table_name=None) -> bool:
+        # query pg_class rather than using to_regclass, so that a table committed by a concurrent transaction is seen
+        self.cursor.execute('select count(*) from pg_class where relname = %s and relkind = \'r\'', (table_name,))
+        return int(self.cursor.fetchone()[0]) > 0
+
     def close_connection(self):
+        if not self.connected:
+            return
         self.cursor.close()
-        self.connection.close()
+        # end any open transaction so the next user of the connection starts clean
+        if not self.connection.closed:
+            self.connection.rollback()
+        self.connection_pool.putconn(self.connection, close=bool(self.connection.closed))
+        self.connection_slots.release()
+        self.connected = False
 
 
 if __name__ == '__main__':
-    postgres = PostgresConnector()
-    df = postgres.execute_query_to_pandas('select * from marker_codes')
+    with PostgresConnector() as postgres:
+        df = postgres.execute_query_to_pandas('select * from marker_codes')
     print('Finished.')